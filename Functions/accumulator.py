@@ -0,0 +1,435 @@
+import numpy as np
+
+from Functions.errorcalc import *
+
+""" This file has the functions to accumulate the local energy and the logarithmic derivatives of the trail wave function
+    while the walkers are sampled. Only running sums are kept, so the chain of positions does not have to be stored.
+"""
+
+def accumulator_init(N_walkers, N_params = 1, keep_E_loc = False):
+    """ Creates an empty accumulator.
+
+    Parameters
+    ----------
+    N_walkers:              Number of random walkers placed
+    N_params:               Number of variational parameters of the trail wave function
+    keep_E_loc:             set to True to also store every local energy
+
+
+    Returns:
+    --------
+    acc:                    dictionary with the running sums
+                                N:          number of samples
+                                E, E2:      sum of E_loc and E_loc**2
+                                dpsi:       sum of dlnψT/dα for every parameter
+                                E_dpsi:     sum of E_loc*dlnψT/dα for every parameter
+                                dpsi2:      sum of dlnψT/dαi dlnψT/dαj for every pair of parameters
+                                E_dpsi2:    sum of dlnψT/dαi E_loc dlnψT/dαj for every pair of parameters
+                                dE:         sum of dE_loc/dα for every parameter, None if not given
+                                dpsi_dE:    sum of dlnψT/dαi dE_loc/dαj for every pair, None if not given
+                                E_dE:       sum of E_loc*dE_loc/dα for every parameter, None if not given
+                                dE2:        sum of dE_loc/dαi dE_loc/dαj for every pair, None if not given
+                                E_steps:    list of the local energy averaged over the walkers for every step,
+                                            used for the blocking statistics
+                                dpsi_steps: list of dlnψT/dα averaged over the walkers for every step
+                                E_dpsi_steps: list of E_loc*dlnψT/dα averaged over the walkers for every step, used
+                                            for the error of the gradient
+                                dE_steps:   list of dE_loc/dα averaged over the walkers for every step, used for the
+                                            error of the zero variance energy
+                                E_loc:      list of the local energies if keep_E_loc is True, else None
+                                step:       width of the trial move used by the sampler
+                                N_equil:    Number of burn in steps of the sampler
+                                seconds:    wall clock time of the sampling
+                                seconds_full: estimated wall clock time if all N_tries steps had been sampled
+                                r_final:    positions of the walkers after the last step, to start the next run from
+    """
+
+    acc = {"N": 0, "N_walkers": N_walkers, "E": 0.0, "E2": 0.0,
+           "dpsi": np.zeros(N_params), "E_dpsi": np.zeros(N_params),
+           "dpsi2": np.zeros((N_params, N_params)), "E_dpsi2": np.zeros((N_params, N_params)),
+           "dE": None, "dpsi_dE": None, "E_dE": None, "dE2": None,
+           "E_steps": [], "dpsi_steps": [], "E_dpsi_steps": [], "dE_steps": [], "E_loc": [] if keep_E_loc else None, "step": None, "N_equil": None,
+           "seconds": 0.0, "seconds_full": 0.0, "r_final": None}
+    return acc
+
+
+def accumulator_update(acc, E, dpsi = None, dE = None):
+    """ Adds a chunk of samples to the accumulator.
+
+    Parameters
+    ----------
+    acc:                    accumulator from accumulator_init
+    E:                      numpy array (N_steps, N_walkers) of the local energies
+    dpsi:                   numpy array (N_steps, N_walkers, N_params) of dlnψT/dα, can be None if not needed
+    dE:                     numpy array (N_steps, N_walkers, N_params) of dE_loc/dα, only needed for the linear method
+                            and the zero variance energy
+
+    """
+
+    acc["N"] += E.size
+    acc["E"] += np.sum(E)
+    acc["E2"] += np.sum(E**2)
+    acc["E_steps"].append(np.mean(E, axis = 1))
+
+    if dpsi is not None:
+        acc["dpsi"] += np.sum(dpsi, axis = (0, 1))
+        acc["E_dpsi"] += np.einsum("ij,ijk->k", E, dpsi)
+        acc["dpsi2"] += np.einsum("ijk,ijl->kl", dpsi, dpsi)
+        acc["E_dpsi2"] += np.einsum("ij,ijk,ijl->kl", E, dpsi, dpsi)
+        acc["dpsi_steps"].append(np.mean(dpsi, axis = 1))
+        acc["E_dpsi_steps"].append(np.einsum("ij,ijk->ik", E, dpsi)/E.shape[1])
+
+    if dE is not None:
+        if acc["dE"] is None:
+            acc["dE"] = 0.0
+            acc["dpsi_dE"] = 0.0
+            acc["E_dE"] = 0.0
+            acc["dE2"] = 0.0
+        acc["dE"] = acc["dE"] + np.sum(dE, axis = (0, 1))
+        acc["E_dE"] = acc["E_dE"] + np.einsum("ij,ijk->k", E, dE)
+        acc["dE2"] = acc["dE2"] + np.einsum("ijk,ijl->kl", dE, dE)
+        acc["dE_steps"].append(np.mean(dE, axis = 1))
+        if dpsi is not None:
+            acc["dpsi_dE"] = acc["dpsi_dE"] + np.einsum("ijk,ijl->kl", dpsi, dE)
+
+    if acc["E_loc"] is not None:
+        acc["E_loc"].append(E)
+
+
+def accumulator_merge(accs):
+    """ Merges the accumulators of independent groups of walkers, for example the ones returned by the processes of
+        metropolis_accumulate. The groups can have sampled a different number of steps, when their burn in differs or
+        they stopped early, so the series of every step are cut to the shortest group. The running sums keep all samples.
+
+    Parameters
+    ----------
+    accs:                   list of accumulators
+
+
+    Returns:
+    --------
+    acc:                    accumulator of all the walkers together
+    """
+
+    if len(accs) == 1:
+        return accs[0]
+
+    acc = {"N": sum(a["N"] for a in accs), "N_walkers": sum(a["N_walkers"] for a in accs),
+           "E": sum(a["E"] for a in accs), "E2": sum(a["E2"] for a in accs),
+           "dpsi": sum(a["dpsi"] for a in accs), "E_dpsi": sum(a["E_dpsi"] for a in accs),
+           "dpsi2": sum(a["dpsi2"] for a in accs), "E_dpsi2": sum(a["E_dpsi2"] for a in accs),
+           "dE": None if accs[0]["dE"] is None else sum(a["dE"] for a in accs),
+           "dpsi_dE": None if accs[0]["dpsi_dE"] is None else sum(a["dpsi_dE"] for a in accs),
+           "E_dE": None if accs[0]["E_dE"] is None else sum(a["E_dE"] for a in accs),
+           "dE2": None if accs[0]["dE2"] is None else sum(a["dE2"] for a in accs),
+           "step": np.mean([a["step"] for a in accs]), "N_equil": max(a["N_equil"] for a in accs),
+           "seconds": max(a["seconds"] for a in accs), "seconds_full": max(a["seconds_full"] for a in accs),
+           "r_final": np.concatenate([a["r_final"] for a in accs])}
+
+    # the walker averages of every step are weighted with the number of walkers of every group
+    N_steps = min(sum(len(E) for E in a["E_steps"]) for a in accs)
+    E_steps = sum(a["N_walkers"]*np.concatenate(a["E_steps"])[:N_steps] for a in accs)/acc["N_walkers"]
+    acc["E_steps"] = [E_steps]
+
+    for key in ["dpsi_steps", "E_dpsi_steps", "dE_steps"]:
+        if len(accs[0][key]) == 0:
+            acc[key] = []
+        else:
+            acc[key] = [sum(a["N_walkers"]*np.concatenate(a[key])[:N_steps] for a in accs)/acc["N_walkers"]]
+
+    if accs[0]["E_loc"] is None:
+        acc["E_loc"] = None
+    else:
+        acc["E_loc"] = [np.concatenate([np.concatenate(a["E_loc"])[:N_steps] for a in accs], axis = 1)]
+
+    return acc
+
+
+def accumulator_arrays(acc, prefix = "acc_"):
+    """ Converts an accumulator to a dictionary of numpy arrays to store it in a checkpoint, see accumulator_from_arrays.
+        The series of every chunk are joined into one array and the entries which are None are left out. All arrays are
+        copies, so the accumulator can be updated while they are written.
+
+    Parameters
+    ----------
+    acc:                    accumulator from accumulator_init
+    prefix:                 prefix of the names of the arrays
+
+
+    Returns:
+    --------
+    dictionary of numpy arrays
+    """
+
+    arrays = {}
+    for key, value in acc.items():
+        if value is None:
+            continue
+        if isinstance(value, list):
+            value = np.concatenate(value) if len(value) > 0 else np.zeros(0)
+        arrays[prefix + key] = np.array(value)
+    return arrays
+
+
+def accumulator_from_arrays(arrays, prefix = "acc_"):
+    """ Restores the accumulator stored by accumulator_arrays, the running sums are the same to the last bit.
+
+    Parameters
+    ----------
+    arrays:                 dictionary of numpy arrays, for example a checkpoint from checkpoint_read
+    prefix:                 prefix of the names of the arrays
+
+
+    Returns:
+    --------
+    acc:                    accumulator
+    """
+
+    acc = accumulator_init(int(arrays[prefix + "N_walkers"]), len(arrays[prefix + "dpsi"]))
+    for key in acc:
+        if prefix + key not in arrays:
+            acc[key] = None
+        elif key in ["E_steps", "dpsi_steps", "E_dpsi_steps", "dE_steps", "E_loc"]:
+            value = arrays[prefix + key]
+            acc[key] = [value] if len(value) > 0 else []
+        elif arrays[prefix + key].ndim == 0:
+            acc[key] = arrays[prefix + key].item()
+        else:
+            acc[key] = arrays[prefix + key]
+    return acc
+
+
+def accumulator_results(acc, block_size = None):
+    """ Computes the estimates from the running sums.
+
+            dE/dα = 2 (<E_loc dlnψT/dα > − E< dlnψT/dα> ).
+
+        The error is calculated with data blocking of the walker averaged local energy of every step. By default the block
+        size is chosen by automatic_blocking_error. A fixed block_size is given in number of samples, like in
+        data_blocking_error, so it contains block_size/N_walkers steps. If the accumulator kept the local energies, the
+        automatic block size is found for the series of every walker instead of the walker average.
+
+    Parameters
+    ----------
+    acc:                    accumulator from accumulator_init
+    block_size:             Size of the blocks in number of samples, None to find the plateau of the blocking transform
+
+
+    Returns:
+    --------
+    E_a:                    The mean of the local energy
+    E_var:                  Variance of the local energy
+    E_error:                error of E_a
+    deriv_E:                numpy array of dE/dα for every parameter
+    """
+
+    N = acc["N"]
+    E_a = acc["E"]/N
+    E_var = acc["E2"]/N - E_a**2
+    deriv_E = 2*(acc["E_dpsi"]/N - E_a*acc["dpsi"]/N)
+
+    E_steps = np.concatenate(acc["E_steps"])
+    if block_size is None and acc["E_loc"] is not None:
+        # the stored local energies are blocked along the time of every walker
+        E_error, _, _ = automatic_blocking_error(accumulated_E_loc_steps(acc))
+    elif block_size is None:
+        E_error, _, _ = automatic_blocking_error(E_steps)
+    else:
+        # the steps which do not fill a complete block are left out
+        block_steps = max(1, block_size//acc["N_walkers"])
+        N_blocks = len(E_steps)//block_steps
+        E_error, _ = data_blocking_error(E_steps[:N_blocks*block_steps], block_steps)
+
+    return (E_a, E_var, E_error, deriv_E)
+
+
+def accumulator_matrices(acc):
+    """ Computes the matrices of the optimizers on the parameter vector from the running sums, with Oi = dlnψT/dαi and
+        ΔOi = Oi - <Oi>:
+
+            gradient:       gi = 2 <ΔOi E_loc>
+            overlap:        Sij = <ΔOi ΔOj>
+            hamiltonian:    the matrix of the linear method in the basis ψT, ΔO1 ψT, ..., ΔOn ψT (Toulouse and Umrigar)
+
+                                H00 = <E_loc>,      Hi0 = gi/2,     H0j = gj/2 + <dE_loc/dαj>
+                                Hij = <ΔOi E_loc ΔOj> + <ΔOi dE_loc/dαj>
+
+        The hamiltonian needs dE_loc/dα, it is None if the accumulator did not get it.
+
+    Parameters
+    ----------
+    acc:                    accumulator from accumulator_init
+
+
+    Returns:
+    --------
+    gradient:               numpy array (N_params,) of dE/dα
+    S:                      numpy array (N_params, N_params) of the covariance of the logarithmic derivatives
+    H:                      numpy array (N_params + 1, N_params + 1) of the hamiltonian of the linear method, or None
+    """
+
+    N = acc["N"]
+    E = acc["E"]/N
+    O = acc["dpsi"]/N
+    EO = acc["E_dpsi"]/N
+
+    gradient = 2*(EO - E*O)
+    S = acc["dpsi2"]/N - np.outer(O, O)
+
+    if acc["dE"] is None:
+        return (gradient, S, None)
+
+    dE = acc["dE"]/N
+    N_params = len(O)
+    H = np.zeros((N_params + 1, N_params + 1))
+    H[0, 0] = E
+    H[1:, 0] = gradient/2
+    H[0, 1:] = gradient/2 + dE
+    H[1:, 1:] = (acc["E_dpsi2"]/N - np.outer(O, EO) - np.outer(EO, O) + E*np.outer(O, O)
+                 + acc["dpsi_dE"]/N - np.outer(O, dE))
+
+    return (gradient, S, H)
+
+
+def accumulator_gradient_error(acc):
+    """ Computes the statistical error of every component of the gradient dE/dα = 2 (<E_loc O> − <E_loc><O>), with
+        O = dlnψT/dα. The gradient is a function of three means, so its error follows from the blocking error of the
+        linearised series of the walker averages of every step
+
+            z = 2 (E_loc O − <O> E_loc − <E_loc> O)
+
+        which has the same fluctuations as the gradient to first order, like the ratio estimator of reweight_accumulate.
+
+    Parameters
+    ----------
+    acc:                    accumulator from accumulator_init which got dlnψT/dα
+
+
+    Returns:
+    --------
+    numpy array (N_params,) of the error of dE/dα
+    """
+
+    N = acc["N"]
+    E = acc["E"]/N
+    O = acc["dpsi"]/N
+
+    E_steps = np.concatenate(acc["E_steps"])
+    z = 2*(np.concatenate(acc["E_dpsi_steps"]) - np.outer(E_steps, O) - E*np.concatenate(acc["dpsi_steps"]))
+
+    gradient_error = np.zeros(len(O))
+    for j in range(len(O)):
+        gradient_error[j], _, _ = automatic_blocking_error(z[:, j])
+    return gradient_error
+
+
+def accumulator_zero_variance(acc):
+    """ Computes the zero variance energy from the running sums. The derivatives of the local energy xj = dE_loc/dαj are
+        the zero variance terms (H - E_loc)ψj/ψT of Assaraf and Caffarel with the auxiliary functions ψj = dψT/dαj, the
+        log-derivatives times ψT, and their mean over |ψT|² is zero. So they are control variates of the energy:
+
+            E_zv = <E_loc - c.x>,       c = Cov(x, x)⁻¹ Cov(x, E_loc)
+
+        The variance of single samples is smallest for c from the covariances of the samples, but x moves slower along the
+        chain than E_loc, so that c makes the series more correlated and the error of the mean hardly goes down. The
+        covariances are therefore taken of the block averages of the walker averaged series, with the block size of
+        automatic_blocking_error of the energy, so c gives the smallest error of the mean. A c fitted on the same blocks it
+        is applied to would take out part of the noise of those blocks too, which biases E_zv and makes its error too
+        small. So c is fitted on each half of the blocks and applied to the steps of the other half. If ψT is the exact ground state for some α the local energy is a
+        constant plus a linear function of x, like for the harmonic oscillator and the Hydrogen atom, and E_zv is exact for
+        every α.
+
+        The zero bias part of the principle corrects the bias of ψT for observables other than the energy, for the energy
+        it is the first order change along the derivatives, dE/dα of accumulator_results, so it is not added.
+
+    Parameters
+    ----------
+    acc:                    accumulator from accumulator_init which got dE_loc/dα
+
+
+    Returns:
+    --------
+    E_zv:                   zero variance energy
+    E_zv_var:               variance of E_loc - c.x
+    E_zv_error:             blocking error of E_zv
+    reduction:              (error of <E_loc>/E_zv_error)², the factor by which fewer steps give the same error
+    c:                      numpy array (N_params,) of the coefficients of the two halves, averaged over their steps
+    """
+
+    N = acc["N"]
+    E = acc["E"]/N
+    x = acc["dE"]/N
+    E_var = acc["E2"]/N - E**2
+    cov_xx = acc["dE2"]/N - np.outer(x, x)
+    cov_xE = acc["E_dE"]/N - x*E
+
+    # the covariances of the block averages, the steps which do not fill a complete block are left out
+    E_steps = np.concatenate(acc["E_steps"])
+    x_steps = np.concatenate(acc["dE_steps"])
+    E_error, _, block_steps = automatic_blocking_error(E_steps)
+    N_blocks = len(E_steps)//block_steps
+    E_blocks = np.mean(np.reshape(E_steps[:N_blocks*block_steps], (N_blocks, block_steps)), axis = 1)
+    x_blocks = np.mean(np.reshape(x_steps[:N_blocks*block_steps], (N_blocks, block_steps, len(x))), axis = 1)
+
+    # c of the first half of the blocks is used for the second half of the steps and the other way around
+    half = N_blocks//2
+    c_first, c_second = [block_fit(E_blocks[part], x_blocks[part]) for part in [slice(0, half), slice(half, N_blocks)]]
+    N_first = half*block_steps
+    correction = np.concatenate((x_steps[:N_first] @ c_second, x_steps[N_first:] @ c_first))
+    fraction = N_first/len(E_steps)
+    c = fraction*c_second + (1 - fraction)*c_first
+
+    E_zv = E - np.mean(correction)
+    E_zv_var = max(E_var - 2*np.dot(c, cov_xE) + c @ cov_xx @ c, 0.0)
+
+    E_zv_error, _, _ = automatic_blocking_error(E_steps - correction)
+    reduction = (E_error/E_zv_error)**2 if E_zv_error > 0 else np.inf
+    return (E_zv, E_zv_var, E_zv_error, reduction, c)
+
+
+def block_fit(E_blocks, x_blocks):
+    """ Coefficients c = Cov(x, x)⁻¹ Cov(x, E) of the control variates from the block averages of the energy and the
+        derivatives, see accumulator_zero_variance. lstsq is used, so a singular covariance of the derivatives does not
+        fail, and too few blocks give c = 0.
+    """
+
+    x_blocks = x_blocks - np.mean(x_blocks, axis = 0)
+    return np.linalg.lstsq(x_blocks.T @ x_blocks, x_blocks.T @ (E_blocks - np.mean(E_blocks)), rcond = None)[0]
+
+
+def accumulated_E_loc(acc):
+    """ Returns the local energies stored by an accumulator with keep_E_loc as a single array of shape (N, 1), in the same
+        order as the positions returned by metropolis_algorithm.
+    """
+    return np.reshape(accumulated_E_loc_steps(acc), (-1, 1))
+
+
+def accumulated_E_loc_steps(acc):
+    """ Returns the local energies stored by an accumulator with keep_E_loc as an array of shape (N_steps, N_walkers), so
+        the series of every walker can be blocked along its own time, see blocking_levels.
+    """
+    return np.concatenate(acc["E_loc"])
+
+
+def accumulator_autocorrelation(acc):
+    """ Integrated autocorrelation time and effective sample size of the local energy of an accumulator. The series of
+        every walker is used if the local energies are kept, else the walker averaged local energy of every step, which has
+        the same autocorrelation time for independent walkers.
+
+    Parameters
+    ----------
+    acc:                    accumulator from accumulator_init
+
+
+    Returns:
+    --------
+    tau_int:                integrated autocorrelation time in steps, see autocorrelation_time
+    ess:                    effective sample size of all the samples of the accumulator
+    """
+
+    if acc["E_loc"] is not None:
+        tau_int, _, _ = autocorrelation_time(accumulated_E_loc_steps(acc))
+    else:
+        tau_int, _, _ = autocorrelation_time(np.concatenate(acc["E_steps"]))
+
+    return (tau_int, acc["N"]/tau_int)
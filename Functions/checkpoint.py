@@ -0,0 +1,145 @@
+import numpy as np
+import os
+import json
+import threading
+from functools import partial
+
+""" This file has the functions to write and read the checkpoints of long sampling and optimization runs. A checkpoint is
+    a single .npz file of numpy arrays. It is written by a background thread, so the sampling goes on while the file is
+    written, and it is first written to a temporary file which replaces the old checkpoint when it is complete, so a run
+    which is killed while writing still has the previous checkpoint.
+
+    Every checkpoint stores the signature of its run, see checkpoint_signature, and is only continued by a run with the
+    same signature. The checkpoint is removed when its run is finished, see checkpoint_remove.
+"""
+
+def checkpoint_write(checkpoint_file, arrays, writer = None):
+    """ Writes the arrays to checkpoint_file in a background thread. The arrays must not be changed by the caller after
+        this call, so give copies of arrays which are updated in place.
+
+    Parameters
+    ----------
+    checkpoint_file:        name of the .npz file
+    arrays:                 dictionary of the numpy arrays to save
+    writer:                 thread of the previous checkpoint, it is finished first so the checkpoints are written in order
+
+
+    Returns:
+    --------
+    writer:                 thread which writes the checkpoint, see checkpoint_wait
+    """
+
+    checkpoint_wait(writer)
+    writer = threading.Thread(target = checkpoint_save, args = (checkpoint_file, arrays))
+    writer.start()
+    return writer
+
+
+def checkpoint_save(checkpoint_file, arrays):
+    """ Saves the arrays to checkpoint_file through a temporary file, this is the work of the thread of checkpoint_write. """
+
+    temporary_file = checkpoint_file + ".tmp"
+    with open(temporary_file, "wb") as file:
+        np.savez(file, **arrays)
+    os.replace(temporary_file, checkpoint_file)
+
+
+def checkpoint_wait(writer):
+    """ Waits until the thread writer of checkpoint_write is finished, nothing happens if writer is None. """
+
+    if writer is not None:
+        writer.join()
+
+
+def checkpoint_read(checkpoint_file, signature = None):
+    """ Reads a checkpoint. A ValueError is raised if the checkpoint was written by a run with another signature, so the
+        chain of another system, parameters or seed is never continued.
+
+    Parameters
+    ----------
+    checkpoint_file:        name of the .npz file, can be None
+    signature:              signature of the run which reads the checkpoint, see checkpoint_signature. None to not check it
+
+
+    Returns:
+    --------
+    dictionary of the numpy arrays of the checkpoint, None if checkpoint_file is None or does not exist
+    """
+
+    if checkpoint_file is None or not os.path.exists(checkpoint_file):
+        return None
+
+    with np.load(checkpoint_file) as checkpoint:
+        arrays = {key: checkpoint[key] for key in checkpoint.files}
+
+    if signature is not None:
+        stored = str(arrays["signature"]) if "signature" in arrays else None
+        if stored != str(signature):
+            raise ValueError(f"The checkpoint {checkpoint_file} was written by the run {stored}, it can not be continued "
+                             f"by the run {signature}. Delete the file to start a new run.")
+
+    return arrays
+
+
+def checkpoint_remove(checkpoint_file, writer = None):
+    """ Removes the checkpoint of a finished run after the thread writer of checkpoint_write is finished, so a new run
+        with the same file starts from the beginning. Nothing happens if checkpoint_file is None.
+    """
+
+    checkpoint_wait(writer)
+    if checkpoint_file is not None and os.path.exists(checkpoint_file):
+        os.remove(checkpoint_file)
+
+
+def checkpoint_signature(**settings):
+    """ Signature of a run as an array of a json string, so it can be stored in a checkpoint and compared by
+        checkpoint_read. The settings are the values which fix the chain of the run, like the system, the parameters, the
+        number of steps and walkers and the seed. Functions are stored by their name, see function_name.
+    """
+
+    settings = {key: function_name(value) if callable(value) else value for key, value in settings.items()}
+    return np.array(json.dumps(settings, sort_keys = True, default = json_value))
+
+
+def json_value(value):
+    """ Numpy arrays and numbers as python lists and numbers for json, anything else by its string. """
+
+    if isinstance(value, (np.ndarray, np.generic)):
+        return value.tolist()
+    return str(value)
+
+
+def function_name(function):
+    """ Name of a function for checkpoint_signature: module.name, with the arguments of a partial, so
+        partial(Helium.log_psi, theta) gives the system and the parameters.
+    """
+
+    if isinstance(function, partial):
+        return [function_name(function.func)] + list(function.args)
+    return f"{getattr(function, '__module__', None)}.{getattr(function, '__qualname__', type(function).__name__)}"
+
+
+def checkpoint_files(checkpoint_file, N):
+    """ Names of the checkpoints of N groups of walkers which are sampled by their own process: checkpoint_file for a
+        single group, else name_0.npz, name_1.npz, ... Returns a list of None if checkpoint_file is None.
+    """
+
+    if checkpoint_file is None:
+        return [None]*N
+    if N == 1:
+        return [checkpoint_file]
+
+    root, extension = os.path.splitext(checkpoint_file)
+    return [f"{root}_{i}{extension}" for i in range(N)]
+
+
+def rng_state(rng):
+    """ State of the numpy random Generator rng as an array of a json string, so it can be stored in a checkpoint. """
+
+    return np.array(json.dumps(rng.bit_generator.state))
+
+
+def rng_restore(rng, state):
+    """ Sets the state of the numpy random Generator rng to the state of rng_state, so it continues with the same numbers. """
+
+    rng.bit_generator.state = json.loads(str(state))
@@ -0,0 +1,319 @@
+import numpy as np
+import time
+import warnings
+from concurrent.futures import ProcessPoolExecutor
+
+from Functions.errorcalc import *
+
+""" This file has the fixed node diffusion Monte Carlo algorithm. The optimized trail wave function of the variational
+    Monte Carlo is used as the guiding function and its equilibrated walkers as the starting population. The walkers
+    drift along the quantum force and diffuse with the time step τ, and they branch with the weight
+
+            w = exp(-τ_eff (½(E_loc(R) + E_loc(R')) - E_T))
+
+    so the population projects out the ground state which has the nodes of ψT. The trail wave functions of the systems
+    here have no nodes, so the fixed node energy is the exact ground state energy up to the time step error of order τ.
+
+    The population is kept in arrays of a fixed size, max_factor times the target population, and branching copies the
+    walkers into a second set of arrays of the same size which is then swapped with the first, so a change of the
+    population does not allocate new arrays of the walkers.
+"""
+
+def diffusion_population(log_function, drift_function, E_loc, r_initial, N_max, local_function = None):
+    """ Makes the preallocated arrays of a population of walkers from the starting positions.
+
+    Parameters
+    ----------
+    log_function:           ln|ψT(R)| of the system with R as its input
+    drift_function:         ∇ln|ψT(R)| of the system with R as its input
+    E_loc:                  local energy of the system with R as its input
+    r_initial:              numpy array (N_walkers, D) of the starting positions, for example acc["r_final"] of a
+                            variational run
+    N_max:                  largest number of walkers, the size of the arrays
+    local_function:         fused kernel of the system which returns ln|ψT|, E_loc and dlnψT/dα from a single geometry,
+                            used instead of log_function and E_loc if it is given
+
+
+    Returns:
+    --------
+    population:             dictionary with the number of walkers "N" and two dictionaries "walkers" and "spare" of the
+                            arrays "r", "log_psi", "drift" and "E_loc" of size N_max, of which the first N rows of walkers
+                            are the current population, the number of accepted and proposed moves and the number of
+                            copies which did not fit in the arrays
+    """
+
+    N, D = r_initial.shape
+    if N > N_max:
+        raise ValueError("the starting population is larger than the largest population")
+
+    walkers, spare = [{"r": np.zeros((N_max, D)), "log_psi": np.zeros(N_max), "drift": np.zeros((N_max, D)),
+                       "E_loc": np.zeros(N_max)} for _ in range(2)]
+
+    walkers["r"][:N] = r_initial
+    walkers["log_psi"][:N], walkers["E_loc"][:N] = evaluate_walkers(log_function, E_loc, local_function, r_initial)
+    walkers["drift"][:N] = np.reshape(drift_function(r_initial), (N, D))
+
+    return {"N": N, "walkers": walkers, "spare": spare, "xi": np.zeros((N_max, D)), "u": np.zeros(N_max),
+            "accepted": 0, "proposed": 0, "dropped": 0}
+
+
+def evaluate_walkers(log_function, E_loc, local_function, r):
+    """ Returns ln|ψT| and the local energy of the positions r as flat arrays, from the fused kernel if it is given. """
+
+    if local_function is not None:
+        log_psi, E, _ = local_function(r)
+    else:
+        log_psi, E = log_function(r), E_loc(r)
+    return (np.reshape(log_psi, len(r)), np.reshape(E, len(r)))
+
+
+def diffusion_steps(log_function, drift_function, E_loc, population, N_steps, rng, tau, E_ref, N_target,
+                    feedback = 0.1, local_function = None):
+    """ Performs N_steps steps of diffusion Monte Carlo on the population. Every step
+
+            1. moves every walker with a Langevin move R' = R + τ∇ln|ψT(R)| + sqrt(τ) ξ, which is accepted like in
+               metropolis_drift_steps so the guiding distribution ψT² is sampled exactly for small weights
+            2. gives every walker the weight w with the local energies before and after the move, with the effective time
+               step τ_eff = τ x (fraction of accepted moves), since rejected moves do not diffuse
+            3. replaces every walker by int(w + u) copies of itself with u uniform in [0, 1), in one pass over the arrays.
+               If there are more copies than room in the arrays, a uniform random choice of the copies is kept, so no
+               walker is dropped because of its place in the arrays
+            4. sets the trial energy to E_T = E_ref - (feedback/τ) ln(N/N_target), which pulls the population back to
+               N_target
+
+        The estimators of a step are the mixed estimator Σ w E_loc(R')/Σ w and the growth estimator E_T - ln(Σ w/N)/τ_eff,
+        which has the energy from the change of the population itself.
+
+    Parameters
+    ----------
+    log_function:           ln|ψT(R)| of the system with R as its input
+    drift_function:         ∇ln|ψT(R)| of the system with R as its input
+    E_loc:                  local energy of the system with R as its input
+    population:             dictionary of diffusion_population with the trial energy "E_T", updated in place
+    N_steps:                Number of steps to perform
+    rng:                    numpy random Generator which draws the moves, coin flips and branching
+    tau:                    time step
+    E_ref:                  best estimate of the energy up to now, the trial energy is set around it
+    N_target:               population the trial energy steers to
+    feedback:               strength of the population control
+    local_function:         fused kernel of the system, see diffusion_population
+
+
+    Returns:
+    --------
+    weight:                 numpy array (N_steps,) of the total weight Σ w of every step
+    E_weight:               numpy array (N_steps,) of Σ w E_loc of every step, the mixed estimator is E_weight/weight
+    E_growth:               numpy array (N_steps,) of the growth estimator of every step
+    N_walkers:              numpy array (N_steps,) of the population at the start of every step
+
+    """
+
+    weight, E_weight, E_growth = np.zeros(N_steps), np.zeros(N_steps), np.zeros(N_steps)
+    N_walkers = np.zeros(N_steps, dtype = int)
+    N_max = len(population["u"])
+
+    for i in range(N_steps):
+        N = population["N"]
+        walkers = population["walkers"]
+        r, log_psi, drift, E = walkers["r"][:N], walkers["log_psi"][:N], walkers["drift"][:N], walkers["E_loc"][:N]
+        N_walkers[i] = N
+
+        # drift diffusion move with the acceptance of the Green's function
+        xi = rng.standard_normal(out = population["xi"][:N])
+        r_trial = r + tau*drift + np.sqrt(tau)*xi
+        log_psi_trial, E_trial = evaluate_walkers(log_function, E_loc, local_function, r_trial)
+        drift_trial = np.reshape(drift_function(r_trial), r_trial.shape)
+
+        log_green = np.sum((tau*xi**2 - (r - r_trial - tau*drift_trial)**2)/(2*tau), axis = -1)
+        accepted = np.log(rng.random(out = population["u"][:N])) < 2*(log_psi_trial - log_psi) + log_green
+
+        population["accepted"] += np.count_nonzero(accepted)
+        population["proposed"] += N
+        tau_eff = tau*population["accepted"]/population["proposed"]
+
+        # branching weight with the local energy before and after the move
+        E_new = np.where(accepted, E_trial, E)
+        w = np.exp(-tau_eff*(0.5*(E + E_new) - population["E_T"]))
+
+        np.copyto(r, r_trial, where = accepted[:, None])
+        np.copyto(log_psi, log_psi_trial, where = accepted)
+        np.copyto(drift, drift_trial, where = accepted[:, None])
+        E[:] = E_new
+
+        weight[i] = np.sum(w)
+        E_weight[i] = np.dot(w, E_new)
+        E_growth[i] = population["E_T"] - np.log(weight[i]/N)/tau_eff
+
+        # every walker is copied int(w + u) times into the spare arrays, which become the population
+        copies = (w + rng.random(out = population["u"][:N])).astype(int)
+        index = np.repeat(np.arange(N), copies)
+        if len(index) > N_max:
+            population["dropped"] += len(index) - N_max
+            index = index[rng.choice(len(index), N_max, replace = False)]
+        N_new = len(index)
+        if N_new == 0:
+            raise RuntimeError("the population died out, use a smaller time step or more walkers")
+
+        spare = population["spare"]
+        for key in walkers:
+            np.take(walkers[key][:N], index, axis = 0, out = spare[key][:N_new])
+        population["walkers"], population["spare"] = spare, walkers
+        population["N"] = N_new
+
+        population["E_T"] = E_ref - feedback/tau*np.log(N_new/N_target)
+
+    return (weight, E_weight, E_growth, N_walkers)
+
+
+def diffusion_monte_carlo(log_function, drift_function, E_loc, r_initial, N_steps, tau = 0.01, N_equil = 1000,
+                          N_target = None, max_factor = 3, feedback = 0.1, chunk_size = 100, N_processes = 1,
+                          seed = None, local_function = None):
+    """ Fixed node diffusion Monte Carlo with ψT as the guiding function. The walkers start from r_initial, which should be
+        an equilibrated variational ensemble of ψT, like acc["r_final"] of metropolis_accumulate, so only the projection
+        from ψT² to ψT φ0 has to be thrown away in the first N_equil steps.
+
+        The steps are done in chunks of chunk_size steps. After every chunk the reference energy of the trial energy is
+        set to the mixed estimator of the steps up to then, of the last chunk during the equilibration. With
+        N_processes > 1 the walkers are split over a pool of processes, every process has its own population of
+        N_target/N_processes walkers with its own random stream and population control, and the estimators of the steps
+        are combined afterwards. The functions have to be picklable in that case, so use functools.partial.
+
+        The errors are the blocking errors of the series of the estimators of every step, see automatic_blocking_error.
+
+    Parameters
+    ----------
+    log_function:           ln|ψT(R)| of the system with R as its input
+    drift_function:         ∇ln|ψT(R)| of the system with R as its input, for example the grad_log_psi of the systems
+    E_loc:                  local energy of the system with R as its input
+    r_initial:              numpy array (N_walkers, D) of the starting positions of the walkers
+    N_steps:                Number of steps of the production run
+    tau:                    time step, the energy has an error of order τ
+    N_equil:                Number of steps thrown away for the projection to the ground state
+    N_target:               population the trial energy steers to, None for the number of starting walkers
+    max_factor:             the arrays of the walkers have room for max_factor x N_target walkers, a random choice of
+                            the copies is kept above that
+    feedback:               strength of the population control, see diffusion_steps
+    chunk_size:             Number of steps between the updates of the reference energy
+    N_processes:            Number of processes the walkers are divided over
+    seed:                   seed of the random number generators, None for a random seed
+    local_function:         fused kernel of the system which returns ln|ψT|, E_loc and dlnψT/dα from a single geometry
+
+
+    Returns:
+    --------
+    E_mixed:                mixed estimator of the energy
+    E_mixed_error:          blocking error of E_mixed
+    E_growth:               growth estimator of the energy
+    E_growth_error:         blocking error of E_growth
+    history:                dictionary with numpy arrays (N_steps,) of the production run
+                                E_mixed:    mixed estimator of every step
+                                E_growth:   growth estimator of every step
+                                N_walkers:  population at the start of every step
+                            and the fraction of accepted moves "rate", the integrated autocorrelation time of the mixed
+                            estimator "tau", the wall clock time "seconds" and the positions of the walkers after the
+                            last step "r_final"
+
+    """
+
+    if N_target is None:
+        N_target = len(r_initial)
+
+    seeds = np.random.SeedSequence(seed).spawn(N_processes)
+    starts = np.array_split(r_initial, N_processes)
+    targets = [len(target) for target in np.array_split(np.arange(N_target), N_processes)]
+
+    settings = {"log_function": log_function, "drift_function": drift_function, "E_loc": E_loc,
+                "local_function": local_function, "N_steps": N_steps, "tau": tau, "N_equil": N_equil,
+                "max_factor": max_factor, "feedback": feedback, "chunk_size": chunk_size}
+    tasks = [dict(settings, r_initial = starts[i], N_target = targets[i], seed = seeds[i]) for i in range(N_processes)]
+
+    start_time = time.time()
+    if N_processes == 1:
+        results = [diffusion_walkers(tasks[0])]
+    else:
+        with ProcessPoolExecutor(max_workers = N_processes) as pool:
+            results = list(pool.map(diffusion_walkers, tasks))
+
+    # the weights of all populations are added, the growth estimators are weighted with the populations
+    weight = sum(result["weight"] for result in results)
+    N_walkers = sum(result["N_walkers"] for result in results)
+    E_mixed_steps = sum(result["E_weight"] for result in results)/weight
+    E_growth_steps = sum(result["N_walkers"]*result["E_growth"] for result in results)/N_walkers
+
+    E_mixed = np.sum(sum(result["E_weight"] for result in results))/np.sum(weight)
+    E_mixed_error, _, _ = automatic_blocking_error(E_mixed_steps)
+    E_growth = np.mean(E_growth_steps)
+    E_growth_error, _, _ = automatic_blocking_error(E_growth_steps)
+
+    history = {"E_mixed": E_mixed_steps, "E_growth": E_growth_steps, "N_walkers": N_walkers,
+               "rate": sum(result["accepted"] for result in results)/sum(result["proposed"] for result in results),
+               "tau": autocorrelation_time(E_mixed_steps)[0], "seconds": time.time() - start_time,
+               "r_final": np.concatenate([result["r_final"] for result in results])}
+
+    # the dropped copies are no longer steered by the trial energy, so the population is biased to the large weights
+    dropped = sum(result["dropped"] for result in results)
+    if dropped > 0:
+        warnings.warn(f"{dropped} copies of walkers did not fit in the arrays of max_factor x N_target walkers, the "
+                      f"energy can be biased, use a larger max_factor or a smaller time step")
+
+    return (E_mixed, E_mixed_error, E_growth, E_growth_error, history)
+
+
+def diffusion_walkers(task):
+    """ Runs the equilibration and the production run of one population with its own random stream. This is the work done
+        by every process of diffusion_monte_carlo.
+
+    Parameters
+    ----------
+    task:                   dictionary of the arguments of diffusion_monte_carlo, with the starting positions, the target
+                            population and a SeedSequence as seed of this population instead of N_processes
+
+
+    Returns:
+    --------
+    dictionary with the arrays "weight", "E_weight", "E_growth" and "N_walkers" of diffusion_steps for the production run,
+    the number of accepted and proposed moves "accepted" and "proposed", the number of copies which did not fit in the
+    arrays "dropped" and the positions after the last step "r_final"
+    """
+
+    log_function, drift_function, E_loc = task["log_function"], task["drift_function"], task["E_loc"]
+    local_function = task["local_function"]
+    tau, feedback, chunk_size, N_target = task["tau"], task["feedback"], task["chunk_size"], task["N_target"]
+    N_equil, N_steps = task["N_equil"], task["N_steps"]
+
+    rng = np.random.default_rng(task["seed"])
+    population = diffusion_population(log_function, drift_function, E_loc, task["r_initial"],
+                                      task["max_factor"]*N_target, local_function)
+
+    # the reference energy starts at the variational energy of the walkers
+    E_ref = np.mean(population["walkers"]["E_loc"][:population["N"]])
+    population["E_T"] = E_ref
+
+    N_done = 0
+    while N_done < N_equil:
+        N_chunk = min(chunk_size, N_equil - N_done)
+        weight, E_weight, _, _ = diffusion_steps(log_function, drift_function, E_loc, population, N_chunk, rng, tau,
+                                                 E_ref, N_target, feedback, local_function)
+        E_ref = np.sum(E_weight)/np.sum(weight)
+        N_done += N_chunk
+
+    # the acceptance of the production run is counted on its own
+    accepted, proposed = population["accepted"], population["proposed"]
+    result = {"weight": np.zeros(N_steps), "E_weight": np.zeros(N_steps), "E_growth": np.zeros(N_steps),
+              "N_walkers": np.zeros(N_steps, dtype = int)}
+
+    N_done = 0
+    while N_done < N_steps:
+        N_chunk = min(chunk_size, N_steps - N_done)
+        chunk = diffusion_steps(log_function, drift_function, E_loc, population, N_chunk, rng, tau, E_ref, N_target,
+                                feedback, local_function)
+        for key, values in zip(["weight", "E_weight", "E_growth", "N_walkers"], chunk):
+            result[key][N_done:N_done + N_chunk] = values
+        N_done += N_chunk
+
+        E_ref = np.sum(result["E_weight"][:N_done])/np.sum(result["weight"][:N_done])
+
+    result["accepted"], result["proposed"] = population["accepted"] - accepted, population["proposed"] - proposed
+    result["dropped"] = population["dropped"]
+    result["r_final"] = np.array(population["walkers"]["r"][:population["N"]])
+    return result
@@ -1,4 +1,6 @@
 import numpy as np
+import warnings
+from concurrent.futures import ProcessPoolExecutor
 
 
 def data_blocking_error(data, block_size):
@@ -33,18 +35,210 @@ def data_blocking_error(data, block_size):
     return (error_data, variance)
 
 
-def bootstrapError(data, N_error):
+def blocking_levels(data):
+    """ Blocking transform of Flyvbjerg and Petersen. At every level the neighbouring points of the series are averaged in
+        pairs, so level k holds the averages of blocks of 2**k points. All levels are computed in a single pass of
+        O(N), the next level is half as long as the previous one. An odd last point of a level is left out, so the error
+        of a level is scaled by sqrt(points used/N) to be the error of the mean of all N points.
+
+        At every level the error of the mean is estimated as if the block averages were uncorrelated, together with its own
+        uncertainty. The lag one autocorrelation is also kept for the plateau test of automatic_blocking_error.
+
+        The data can also be the local energy of N_walkers independent walkers as an array (N_steps, N_walkers). The
+        blocks are then taken along the time of every walker, never across walkers, and the variances and
+        autocovariances of the walkers are pooled around the mean of all walkers. Centring every walker on its own mean
+        would bias the lag one autocovariance by about -σ²/n per walker, which adds about N_walkers/n to M_terms and
+        fails the plateau test at the high levels. The array is used as it is, so a strided view like the transpose
+        of (N_walkers, N_steps) does not have to be reordered or flattened first.
+
+    Parameters
+    ----------
+    data:           Data set of N points, or a numpy array (N_steps, N_walkers) of the series of every walker
+
+
+    Returns:
+    --------
+    block_size:         numpy array of the block size 2**k of every level in number of steps
+    error:              numpy array of the error of the mean at every level
+    error_error:        numpy array of the uncertainty of the error at every level
+    M_terms:            numpy array of n_k (γk/σk²)² of every level, with γk the lag one autocovariance
+    """
+
+    x = np.asarray(data, dtype = float)
+    if x.ndim == 1:
+        x = x[:, None]
+    N_steps, N_walkers = x.shape
+
+    # the walkers sample the same distribution, so they are blocked around their common mean
+    mean = np.mean(x)
+
+    block_size = []
+    error = []
+    error_error = []
+    M_terms = []
+
+    size = 1
+    while len(x) >= 4:
+        n = len(x)
+        dx = x - mean
+        var = np.einsum("ij,ij->", dx, dx)/(n*N_walkers)
+        gamma = np.einsum("ij,ij->", dx[:-1], dx[1:])/(n*N_walkers)
+
+        block_size.append(size)
+        error.append(np.sqrt(var/(n*N_walkers - 1)*n*size/N_steps))
+        error_error.append(error[-1]/np.sqrt(2*(n*N_walkers - 1)))
+        M_terms.append(n*N_walkers*(gamma/var)**2 if var > 0 else 0.0)
+
+        # average the neighbouring points in pairs
+        x = 0.5*(x[0:n - 1:2] + x[1:n:2])
+        size *= 2
+
+    return (np.array(block_size), np.array(error), np.array(error_error), np.array(M_terms))
+
+
+def automatic_blocking_error(data, confidence = 0.99, min_blocks = 16):
+    """ Computes the error of a correlated time series with the blocking transform and picks the plateau automatically with
+        the test of Jonsson (Phys. Rev. E 98, 043304). Starting from the lowest level, the sum of n_k (γk/σk²)² over the
+        level and all higher ones is χ² distributed with one degree of freedom per level if the block averages are
+        uncorrelated. The first level for which the sum is below the χ² quantile is the plateau. Only levels with at least
+        min_blocks blocks for every walker are chosen, the error of fewer blocks is itself too uncertain. If none of
+        them passes the test a warning is given and the highest of them is used.
+
+    Parameters
+    ----------
+    data:           Data set of N points, or a numpy array (N_steps, N_walkers) of the series of every walker
+    confidence:     confidence level of the χ² test
+    min_blocks:     smallest number of blocks of every walker of the chosen level
+
+
+    Returns:
+    --------
+    error_data:         error of the mean of the data
+    error_error:        uncertainty of error_data
+    block_size:         Size of the blocks of the chosen level in number of points, steps for every walker
+    """
+
+    block_size, error, error_error, M_terms = blocking_levels(data)
+
+    if len(error) == 0:
+        N = np.size(data)
+        return (np.std(data)/np.sqrt(max(N - 1, 1)), np.nan, 1)
+
+    M = np.cumsum(M_terms[::-1])[::-1]
+    degrees = np.arange(len(M), 0, -1)
+    allowed = len(data)//block_size >= min_blocks
+    passed = np.nonzero((M < chi2_quantile(degrees, confidence)) & allowed)[0]
+    if len(passed) > 0:
+        k = passed[0]
+    else:
+        warnings.warn("the blocking transform found no plateau with enough blocks for every walker, the error can be "
+                      "too small, use a longer series")
+        k = np.nonzero(allowed)[0][-1] if np.any(allowed) else 0
+
+    return (error[k], error_error[k], block_size[k])
+
+
+def autocorrelation_time(data, c = 5):
+    """ Computes the integrated autocorrelation time of a time series with the FFT. The autocorrelation function ρ(t) is
+        summed up to a window M, which is chosen automatically as the first M with M >= c τ(M) (Sokal), so the noise of
+        the tail is not added:
+
+            τ_int = 1 + 2 Σ_{t=1}^{M} ρ(t),            N_eff = N/τ_int
+
+        τ_int is 1 for uncorrelated data and is given in steps. For an array (N_steps, N_walkers) the autocovariances of
+        the walkers are averaged, the effective sample size counts all walkers.
+
+    Parameters
+    ----------
+    data:           Data set of N points, or a numpy array (N_steps, N_walkers) of the series of every walker
+    c:              factor of the automatic window
+
+
+    Returns:
+    --------
+    tau_int:            integrated autocorrelation time in steps
+    ess:                effective sample size, the number of independent samples
+    window:             the window M which was used
+    """
+
+    x = np.asarray(data, dtype = float)
+    if x.ndim == 1:
+        x = x[:, None]
+    n = len(x)
+
+    # zero padding to twice the length so the FFT gives the linear and not the circular correlation
+    size = 2**int(np.ceil(np.log2(2*n)))
+    f = np.fft.rfft(x - np.mean(x, axis = 0), n = size, axis = 0)
+    acov = np.mean(np.fft.irfft(f*np.conj(f), n = size, axis = 0)[:n], axis = 1)
+
+    if acov[0] <= 0:
+        return (1.0, float(x.size), 0)
+
+    tau = 2*np.cumsum(acov/acov[0]) - 1
+    windows = np.nonzero(np.arange(n) >= c*tau)[0]
+    window = windows[0] if len(windows) > 0 else n - 1
+
+    return (tau[window], x.size/tau[window], window)
+
+
+def efficiency(E_var, tau_int, seconds, N_samples):
+    """ Efficiency of a run, 1/(σ² τ_int t) with t the time per sample. This is 1/(error² x time), so runs with other step
+        sizes, samplers or systems can be compared on how fast they reduce the error.
+
+    Parameters
+    ----------
+    E_var:          Variance of the local energy
+    tau_int:        integrated autocorrelation time from autocorrelation_time
+    seconds:        wall clock time of the run
+    N_samples:      Number of samples of the run
+
+
+    Returns:
+    --------
+    efficiency of the run, np.inf without a warning if E_var is zero or rounded below zero, like for the exact wave
+    function of the harmonic oscillator and the Hydrogen atom
+    """
+
+    cost = np.asarray(E_var, dtype = float)*tau_int*seconds/N_samples
+    return np.where(cost > 0, 1/np.where(cost > 0, cost, 1), np.inf)[()]
+
+
+def chi2_quantile(degrees, confidence = 0.99):
+    """ Quantile of the χ² distribution with the Wilson-Hilferty approximation, which is accurate to within a percent for
+        the confidence levels used by automatic_blocking_error.
+
+    Parameters
+    ----------
+    degrees:        numpy array of the degrees of freedom
+    confidence:     probability below the quantile
+
+
+    Returns:
+    --------
+    numpy array of the quantiles
+    """
+
+    # inverse of the standard normal distribution with the rational approximation of Abramowitz and Stegun 26.2.23
+    t = np.sqrt(-2*np.log(1 - confidence))
+    z = t - (2.515517 + 0.802853*t + 0.010328*t**2)/(1 + 1.432788*t + 0.189269*t**2 + 0.001308*t**3)
+
+    degrees = np.asarray(degrees, dtype = float)
+    return degrees*(1 - 2/(9*degrees) + z*np.sqrt(2/(9*degrees)))**3
+
+
+def bootstrapError(data, N_error, batch_size = 100):
     """ Calculates error of a data set with the bootstrap Method. It picks a
         random set from the data, with this subset the mean is calculated.
         This is done N_error times, then the standard deviation of this gives the error of the
-        data.
+        data. The subsets are drawn in batches of batch_size, so the memory does not grow with N_error.
 
-        # NOTE: This can only be used for non correlated data
+        # NOTE: This can only be used for non correlated data, see block_bootstrap_error for correlated data
 
     Parameters
     ----------
     data:           Data set of N points
     N_error         Number of times to calculate the mean data from the subset
+    batch_size:     Number of subsets drawn at once
 
 
     Returns:
@@ -54,10 +248,15 @@ def bootstrapError(data, N_error):
     """
 
     N_subset = 10000
-    data_subset = np.random.choice(data, (N_subset, N_error))
+    average_data_subsets = np.zeros(N_error)
+    var_rdnset = np.zeros(N_error)
 
-    average_data_subsets = np.mean(data_subset, axis = 0)
-    var_rdnset = np.var(data_subset, axis = 0)
+    for i in range(0, N_error, batch_size):
+        batch = min(batch_size, N_error - i)
+        data_subset = np.random.choice(data, (N_subset, batch))
+
+        average_data_subsets[i:i + batch] = np.mean(data_subset, axis = 0)
+        var_rdnset[i:i + batch] = np.var(data_subset, axis = 0)
 
     variance = np.mean(var_rdnset)
     error_var = np.std(var_rdnset)
@@ -65,3 +264,111 @@ def bootstrapError(data, N_error):
 
 
     return (error_data, variance)
+
+
+def block_bootstrap_error(data, block_length = None, N_resamples = 1000, method = "moving", batch_size = 100,
+                          N_processes = 1, seed = None):
+    """ Calculates the error of the mean of a correlated time series with a block bootstrap. Instead of single points,
+        blocks of consecutive points are resampled so the correlation within the blocks is kept:
+
+            moving:         blocks of block_length points starting at random positions
+            stationary:     blocks with a geometric length of mean block_length starting at random positions, the series is
+                            wrapped around at the end (Politis and Romano)
+
+        The sum of every block follows from the cumulative sum of the series, so a resample never has to be built. The
+        resamples are drawn in batches of batch_size, the memory is of order N + batch_size x N/block_length and does not
+        grow with N_resamples. With N_processes > 1 the batches are divided over a pool of processes with independent
+        random streams.
+
+    Parameters
+    ----------
+    data:           Data set of N points, an array (N_steps, N_walkers) is averaged over the walkers first
+    block_length:   (mean) length of the blocks, None for the block size of automatic_blocking_error
+    N_resamples:    Number of bootstrap resamples
+    method:         "moving" or "stationary"
+    batch_size:     Number of resamples drawn at once
+    N_processes:    Number of processes the batches are divided over
+    seed:           seed of the random number generators, None for a random seed
+
+
+    Returns:
+    --------
+    error_data:         error of the mean of the data
+    variance:           Variance of data
+    """
+
+    data = np.asarray(data, dtype = float)
+    if data.ndim == 2:
+        data = np.mean(data, axis = 1)
+
+    if block_length is None:
+        _, _, block_length = automatic_blocking_error(data)
+
+    seeds = np.random.SeedSequence(seed).spawn(N_processes)
+    resamples = [len(r) for r in np.array_split(np.arange(N_resamples), N_processes)]
+    tasks = [{"data": data, "block_length": int(block_length), "N_resamples": resamples[i], "method": method,
+              "batch_size": batch_size, "seed": seeds[i]} for i in range(N_processes)]
+
+    if N_processes == 1:
+        means = [bootstrap_means(tasks[0])]
+    else:
+        with ProcessPoolExecutor(max_workers = N_processes) as pool:
+            means = list(pool.map(bootstrap_means, tasks))
+
+    error_data = np.std(np.concatenate(means))
+    variance = np.var(data)
+
+    return (error_data, variance)
+
+
+def bootstrap_means(task):
+    """ Draws the block bootstrap resamples of a single process of block_bootstrap_error and returns their means.
+
+    Parameters
+    ----------
+    task:           dictionary of the arguments of block_bootstrap_error, with the number of resamples of this process
+                    and a SeedSequence as seed
+
+
+    Returns:
+    --------
+    numpy array of the mean of every resample
+    """
+
+    data = task["data"]
+    L = min(task["block_length"], len(data))
+    N = len(data)
+    rng = np.random.default_rng(task["seed"])
+    means = np.zeros(task["N_resamples"])
+
+    # cumulative sums, of the series twice for the stationary bootstrap so the blocks can wrap around
+    if task["method"] == "stationary":
+        C = np.concatenate(([0], np.cumsum(np.concatenate((data, data)))))
+    else:
+        C = np.concatenate(([0], np.cumsum(data)))
+        N_blocks = N//L
+
+    for i in range(0, task["N_resamples"], task["batch_size"]):
+        batch = min(task["batch_size"], task["N_resamples"] - i)
+
+        if task["method"] == "stationary":
+            sums = np.zeros(batch)
+            filled = np.zeros(batch, dtype = int)
+
+            # blocks are added until every resample has N points, the last block is cut off
+            while np.any(filled < N):
+                K = int(2*(N - np.min(filled))/L) + 1
+                starts = rng.integers(0, N, (batch, K))
+                lengths = rng.geometric(1/L, (batch, K))
+                end = filled[:, None] + np.cumsum(lengths, axis = 1)
+                lengths = np.clip(lengths - np.maximum(end - N, 0), 0, None)
+
+                sums += np.sum(C[starts + lengths] - C[starts], axis = 1)
+                filled = np.minimum(end[:, -1], N)
+
+            means[i:i + batch] = sums/N
+        else:
+            starts = rng.integers(0, N - L + 1, (batch, N_blocks))
+            means[i:i + batch] = np.sum(C[starts + L] - C[starts], axis = 1)/(N_blocks*L)
+
+    return means
@@ -1,51 +1,951 @@
 import numpy as np
+import time
+import warnings
+from functools import partial
+from concurrent.futures import ProcessPoolExecutor
+from multiprocessing import Manager
 
+from Functions.accumulator import *
+from Functions.checkpoint import *
+from Functions.metropolis_jit import jit_steps
 
-def metropolis_algorithm(function, N_tries, N_walkers, D):
+# fewest steps which have to be left for the production run after the burn in
+min_production_steps = 100
+
+# the error of a run with a target error is estimated again after this fraction more steps
+check_growth = 0.1
+
+
+def log_amplitude(log_function, r):
+    """ Evaluates the natural logarithm of the trail wave function for every walker as a flat array.
+
+    Parameters
+    ----------
+    log_function:           ln|ψT(R)| of the system with R as its input
+    r:                      numpy array (N_walkers, D) of the positions of the walkers, or (n_alpha, N_walkers, D)
+
+
+    Returns:
+    --------
+    log_psi:                numpy array (N_walkers,) of ln|ψT| for every walker, or (n_alpha, N_walkers)
+    """
+    return np.reshape(log_function(r), r.shape[:-1])
+
+
+def metropolis_steps(log_function, r_initial, log_psi, N_steps, rng, step = 0.3, store = True, particle_function = None,
+                     backend = "numpy", drift_function = None):
+    """ Performs N_steps metropolis steps for all of the walkers starting from r_initial. The random numbers are only drawn
+        for these N_steps, so the memory used is of order N_steps x N_walkers x D instead of the full chain.
+
+        The acceptance is done in the log domain, ln(u) < 2(ln|ψT(R')| - ln|ψT(R)|), so the squared ratio can not underflow.
+        ln|ψT(R)| of the current positions is kept in log_psi and only updated for the accepted walkers, so every step needs
+        a single evaluation of the wave function.
+
+        If particle_function is given the electrons are moved one at a time, see metropolis_particle_steps. If
+        drift_function is given the walkers drift along the quantum force, see metropolis_drift_steps. With backend
+        "numba" the loop over the steps runs in the compiled kernel of Functions/metropolis_jit.py, which gives the same
+        chain for the same random numbers.
+
+    Parameters
+    ----------
+    log_function:           ln|ψT(R)| of the system with R as its input
+    r_initial:              numpy array (N_walkers, D) of the current positions of the walkers, can have extra leading
+                            axes like (n_alpha, N_walkers, D) for a batch of chains
+    log_psi:                numpy array (N_walkers,) of ln|ψT| at the current positions
+    N_steps:                Number of steps to perform
+    rng:                    numpy random Generator which draws the trial moves and coin flips
+    step:                   width of the gaussian trial move, an array (n_alpha, 1, 1) gives every chain of a batch its own
+    store:                  set to False if the positions of the walkers do not have to be stored (burn in)
+    particle_function:      ln of the factors of ψT which depend on electron k, see metropolis_particle_steps.
+                            None to move all coordinates of a walker at once
+    backend:                "numpy" for the reference loop or "numba" for the compiled kernel
+    drift_function:         ∇ln|ψT(R)| of the system with R as its input for the Langevin moves, None for the symmetric
+                            gaussian moves
+
+
+    Returns:
+    --------
+    r_chunk:                numpy array (N_steps, N_walkers, D) of the positions after every step, None if store is False
+    r_initial:              numpy array (N_walkers, D) of the positions after the last step
+    log_psi:                numpy array (N_walkers,) of ln|ψT| at the positions after the last step
+    accept:                 numpy array (N_walkers,) of the number of accepted moves of every walker in these steps
+
+    """
+
+    if drift_function is not None:
+        if backend != "numpy" or particle_function is not None:
+            raise ValueError("the Langevin moves are only implemented for moves of the whole walker with the numpy backend")
+        return metropolis_drift_steps(log_function, drift_function, r_initial, log_psi, N_steps, rng, step, store)
+
+    if particle_function is not None:
+        if backend != "numpy":
+            raise ValueError("the moves of single electrons are only implemented for the numpy backend")
+        return metropolis_particle_steps(particle_function, r_initial, log_psi, N_steps, rng, step, store)
+
+    walker_shape = r_initial.shape[:-1]
+    displacement = step*rng.standard_normal((N_steps,) + r_initial.shape)
+    log_coin_flip = np.log(rng.uniform(0, 1, (N_steps,) + walker_shape))    # to compare with if ratio < 1
+
+    if backend == "numba":
+        return jit_steps(log_function, r_initial, log_psi, displacement, log_coin_flip, store)
+
+    r_chunk = np.zeros((N_steps,) + r_initial.shape) if store else None
+    accept = np.zeros(walker_shape, dtype = int)
+
+    for i in range(N_steps):
+        r_trial = r_initial + displacement[i]       # trial move
+        log_psi_trial = log_amplitude(log_function, r_trial)
+
+        accepted = log_coin_flip[i] < 2*(log_psi_trial - log_psi)
+        r_initial = np.where(accepted[..., None], r_trial, r_initial)
+        log_psi = np.where(accepted, log_psi_trial, log_psi)
+
+        if store:
+            r_chunk[i] = r_initial
+
+        # keep track of accepted moves
+        accept += accepted
+
+    return (r_chunk, r_initial, log_psi, accept)
+
+
+
+def metropolis_particle_steps(particle_function, r_initial, log_psi, N_steps, rng, step = 0.3, store = True):
+    """ Performs N_steps metropolis steps in which the electrons of every walker are moved one at a time. Every sub step
+        moves the 3 coordinates of a single electron and is accepted or rejected on its own, so the acceptance does not
+        drop as fast with the step as for moves of the whole walker. The ratio only needs the factors of ψT which depend
+        on the moved electron, so only the distances involving that electron are computed:
+
+            ln(u) < 2(ln φk(R') - ln φk(R))
+
+        where φk is given by particle_function. ln|ψT| of the walkers is updated with the accepted ratios.
+
+    Parameters
+    ----------
+    particle_function:      ln of the factors of ψT which depend on electron k with R, k and the position of electron k
+                            as its input
+    r_initial:              numpy array (N_walkers, D) of the current positions of the walkers, D = 3 x number of electrons
+    log_psi:                numpy array (N_walkers,) of ln|ψT| at the current positions
+    N_steps:                Number of steps to perform, every step moves all electrons once
+    rng:                    numpy random Generator which draws the trial moves and coin flips
+    step:                   width of the gaussian trial move
+    store:                  set to False if the positions of the walkers do not have to be stored (burn in)
+
+
+    Returns:
+    --------
+    r_chunk:                numpy array (N_steps, N_walkers, D) of the positions after every step, None if store is False
+    r_initial:              numpy array (N_walkers, D) of the positions after the last step
+    log_psi:                numpy array (N_walkers,) of ln|ψT| at the positions after the last step
+    accept:                 numpy array (N_walkers,) of the number of accepted moves of every walker divided by the number
+                            of electrons
+
+    """
+
+    walker_shape = r_initial.shape[:-1]
+    N_particles = r_initial.shape[-1]//3
+    displacement = step*rng.standard_normal((N_steps,) + r_initial.shape)
+    log_coin_flip = np.log(rng.uniform(0, 1, (N_steps, N_particles) + walker_shape))
+
+    r_chunk = np.zeros((N_steps,) + r_initial.shape) if store else None
+    r_initial = np.array(r_initial)     # the electrons are updated in place
+    accept = np.zeros(walker_shape)
+
+    for i in range(N_steps):
+        for k in range(N_particles):
+            electron = slice(3*k, 3*k + 3)
+            r_old = r_initial[..., electron]
+            r_trial = r_old + displacement[i, ..., electron]
+
+            log_ratio = particle_function(r_initial, k, r_trial) - particle_function(r_initial, k, r_old)
+            log_ratio = np.reshape(log_ratio, walker_shape)
+
+            accepted = log_coin_flip[i, k] < 2*log_ratio
+            r_initial[..., electron] = np.where(accepted[..., None], r_trial, r_old)
+            log_psi = log_psi + np.where(accepted, log_ratio, 0)
+
+            accept += accepted
+
+        if store:
+            r_chunk[i] = r_initial
+
+    return (r_chunk, r_initial, log_psi, accept/N_particles)
+
+def metropolis_drift_steps(log_function, drift_function, r_initial, log_psi, N_steps, rng, step = 0.3, store = True):
+    """ Performs N_steps metropolis steps with Langevin moves. Instead of a symmetric gaussian move around the walker, the
+        trial move drifts along the quantum force F = 2∇ln|ψT|, with time step τ = step² and diffusion constant 1/2:
+
+            R' = R + τ∇ln|ψT(R)| + sqrt(τ) ξ
+
+        The walkers move towards the regions where ψT is large, for Helium away from the other electron and towards the
+        nucleus, so fewer moves are rejected near the cusps and the chain decorrelates in fewer steps. The move is not
+        symmetric, so the acceptance has the Green's function of the move G(R'|R) ~ exp(-(R' - R - τ∇ln|ψT(R)|)²/2τ):
+
+            ln(u) < 2(ln|ψT(R')| - ln|ψT(R)|) + ln G(R|R') - ln G(R'|R)
+
+        The same random numbers are drawn as for the gaussian moves, the gradient at the current positions is kept like
+        log_psi, so every step needs a single evaluation of the wave function and of its gradient.
+
+    Parameters
+    ----------
+    log_function:           ln|ψT(R)| of the system with R as its input
+    drift_function:         ∇ln|ψT(R)| of the system with R as its input, for example the grad_log_psi of the systems
+    r_initial:              numpy array (N_walkers, D) of the current positions of the walkers, can have extra leading
+                            axes like (n_alpha, N_walkers, D) for a batch of chains
+    log_psi:                numpy array (N_walkers,) of ln|ψT| at the current positions
+    N_steps:                Number of steps to perform
+    rng:                    numpy random Generator which draws the trial moves and coin flips
+    step:                   square root of the time step τ, the width of the random part of the move
+    store:                  set to False if the positions of the walkers do not have to be stored (burn in)
+
+
+    Returns:
+    --------
+    r_chunk:                numpy array (N_steps, N_walkers, D) of the positions after every step, None if store is False
+    r_initial:              numpy array (N_walkers, D) of the positions after the last step
+    log_psi:                numpy array (N_walkers,) of ln|ψT| at the positions after the last step
+    accept:                 numpy array (N_walkers,) of the number of accepted moves of every walker in these steps
+
+    """
+
+    walker_shape = r_initial.shape[:-1]
+    tau = step**2
+    displacement = step*rng.standard_normal((N_steps,) + r_initial.shape)
+    log_coin_flip = np.log(rng.uniform(0, 1, (N_steps,) + walker_shape))
+
+    r_chunk = np.zeros((N_steps,) + r_initial.shape) if store else None
+    accept = np.zeros(walker_shape, dtype = int)
+    drift = np.reshape(drift_function(r_initial), r_initial.shape)
+
+    for i in range(N_steps):
+        r_trial = r_initial + tau*drift + displacement[i]
+        log_psi_trial = log_amplitude(log_function, r_trial)
+        drift_trial = np.reshape(drift_function(r_trial), r_trial.shape)
+
+        # ln G(R|R') - ln G(R'|R), the forward move without the drift is the gaussian displacement
+        log_green = np.sum((displacement[i]**2 - (r_initial - r_trial - tau*drift_trial)**2)/(2*tau), axis = -1)
+
+        accepted = log_coin_flip[i] < 2*(log_psi_trial - log_psi) + log_green
+        r_initial = np.where(accepted[..., None], r_trial, r_initial)
+        log_psi = np.where(accepted, log_psi_trial, log_psi)
+        drift = np.where(accepted[..., None], drift_trial, drift)
+
+        if store:
+            r_chunk[i] = r_initial
+
+        accept += accepted
+
+    return (r_chunk, r_initial, log_psi, accept)
+
+def metropolis_stream(log_function, N_tries, N_walkers, D, chunk_size = 1000, N_equil = 4000, rng = None, step = 0.3,
+                      r_initial = None, particle_function = None, backend = "numpy", log_psi = None, walkers = None,
+                      drift_function = None):
+    """ Streaming version of the metropolis algorithm. The chain is generated in chunks of chunk_size steps and every chunk
+        of positions is yielded after the first N_equil steps are thrown away for equilibrium. The memory used is of order
+        N_walkers x D x chunk_size and does not depend on N_tries.
+
+    Parameters
+    ----------
+    log_function:           ln|ψT(R)| of the system with R as its input
+    N_tries:                Number of steps for the walkers to try, including the equilibration steps
+    N_walkers:              Number of random walkers placed, or a tuple (n_alpha, N_walkers) for a batch of chains
+    D:                      Dimension of the system
+    chunk_size:             Number of steps in each yielded block of positions
+    N_equil:                Number of steps thrown away to ensure equilibrium
+    rng:                    numpy random Generator, a new unseeded one is made if None
+    step:                   width of the gaussian trial move
+    r_initial:              numpy array (N_walkers, D) of the starting positions, None for random positions
+    particle_function:      ln of the factors of ψT which depend on electron k to move the electrons one at a time,
+                            None to move the whole walker. See metropolis_particle_steps
+    backend:                "numpy" or "numba", see metropolis_steps
+    log_psi:                numpy array of ln|ψT| at r_initial, None to evaluate it. Give the value kept by a previous
+                            stream to continue its chain exactly, since the moves of single electrons update it in parts
+    walkers:                dictionary which is updated with the positions "r" and ln|ψT| "log_psi" of the walkers after
+                            every chunk, so the chain can be continued from there, None if not needed
+    drift_function:         ∇ln|ψT(R)| for the Langevin moves, None for the gaussian moves. See metropolis_drift_steps
+
+
+    Yields:
+    --------
+    r_chunk:                numpy array (chunk_size, N_walkers, D) of the positions of the walkers, the last one can be shorter
+    accept:                 numpy array (N_walkers,) of the number of accepted moves of every walker up to and including
+                            this chunk
+
+    """
+
+    if rng is None:
+        rng = np.random.default_rng()
+
+    if r_initial is None:
+        r_initial = rng.standard_normal(tuple(np.atleast_1d(N_walkers)) + (D,))
+    if log_psi is None:
+        log_psi = log_amplitude(log_function, r_initial)
+    accept = 0
+
+    # equilibration, the positions are not stored
+    N_done = 0
+    while N_done < N_equil:
+        N_steps = min(chunk_size, N_equil - N_done)
+        _, r_initial, log_psi, n_accept = metropolis_steps(log_function, r_initial, log_psi, N_steps, rng, step, False,
+                                                           particle_function, backend, drift_function)
+        accept += n_accept
+        N_done += N_steps
+
+    while N_done < N_tries:
+        N_steps = min(chunk_size, N_tries - N_done)
+        r_chunk, r_initial, log_psi, n_accept = metropolis_steps(log_function, r_initial, log_psi, N_steps, rng, step,
+                                                                particle_function = particle_function, backend = backend,
+                                                                drift_function = drift_function)
+        accept += n_accept
+        N_done += N_steps
+
+        if walkers is not None:
+            walkers["r"] = r_initial
+            walkers["log_psi"] = log_psi
+
+        yield (r_chunk, accept)
+
+
+def exact_stream(log_function, sample_function, N_tries, N_walkers, D, chunk_size = 1000, rng = None, walkers = None):
+    """ Stream of independent positions drawn directly from |ψT|², for the systems which have an exact sampler. It yields
+        the same chunks as metropolis_stream, but every position is a new independent sample, so there is no burn in and
+        the local energies have no autocorrelation. Every move counts as accepted.
+
+    Parameters
+    ----------
+    log_function:           ln|ψT(R)| of the system with R as its input
+    sample_function:        draws independent positions from |ψT|² with the number of positions and a numpy random
+                            Generator as its input, for example the sample_psi2 of the systems
+    N_tries:                Number of steps, every step draws a position for every walker
+    N_walkers:              Number of random walkers placed
+    D:                      Dimension of the system
+    chunk_size:             Number of steps in each yielded block of positions
+    rng:                    numpy random Generator, a new unseeded one is made if None
+    walkers:                dictionary which is updated with the positions "r" and ln|ψT| "log_psi" of the last step, see
+                            metropolis_stream, None if not needed
+
+
+    Yields:
+    --------
+    r_chunk:                numpy array (chunk_size, N_walkers, D) of the positions of the walkers, the last one can be shorter
+    accept:                 numpy array (N_walkers,) of the number of steps up to and including this chunk
+
+    """
+
+    if rng is None:
+        rng = np.random.default_rng()
+
+    N_done = 0
+    while N_done < N_tries:
+        N_steps = min(chunk_size, N_tries - N_done)
+        r_chunk = np.reshape(sample_function(N_steps*N_walkers, rng), (N_steps, N_walkers, D))
+        N_done += N_steps
+
+        if walkers is not None:
+            walkers["r"] = r_chunk[-1]
+            walkers["log_psi"] = log_amplitude(log_function, r_chunk[-1])
+
+        yield (r_chunk, np.full(N_walkers, N_done))
+
+
+def metropolis_warmup(log_function, E_loc, r_initial, rng, step = 0.3, target_rate = None, max_steps = 4000, window = 200,
+                      N_tune = 50, particle_function = None, backend = "numpy", drift_function = None):
+    """ Warm up phase before the production run. First the width of the trial move is tuned towards the target acceptance
+        rate, by multiplying it with exp(rate - target_rate) after every N_tune steps. Then the walkers are moved in windows
+        of window steps until the walker averaged local energy of the last two windows agree within two standard errors,
+        at which point the chain is taken to be stationary. The warm up never takes more than max_steps steps, if the drift
+        test has not passed by then a warning is given, since the start of the production run can still be biased.
+
+        For a batch of chains of shape (n_alpha, N_walkers, D) every chain gets its own step and the warm up continues until
+        every chain has passed the drift test in some pair of windows. Requiring all chains to pass in the same pair would
+        fail by chance for a third of the passes of 8 chains, so the warm up would often run to max_steps.
+
+    Parameters
+    ----------
+    log_function:           ln|ψT(R)| of the system with R as its input
+    E_loc:                  local energy of the system with R as its input, any function of R can be used for the drift test
+    r_initial:              numpy array (N_walkers, D) of the starting positions of the walkers
+    rng:                    numpy random Generator which draws the trial moves and coin flips
+    step:                   initial width of the gaussian trial move
+    target_rate:            acceptance rate the step is tuned to, None for 0.5 with the gaussian moves and 0.8 with the
+                            Langevin moves, which decorrelate fastest with a shorter time step and a higher rate
+    max_steps:              largest number of warm up steps, the chain is used after this even if the drift test fails
+    window:                 Number of steps of the windows of the drift test
+    N_tune:                 Number of steps between the updates of the step
+    particle_function:      ln of the factors of ψT which depend on electron k, None to move the whole walker
+    backend:                "numpy" or "numba", see metropolis_steps
+    drift_function:         ∇ln|ψT(R)| for the Langevin moves, None for the gaussian moves
+
+
+    Returns:
+    --------
+    r_initial:              numpy array of the positions of the walkers after the warm up
+    step:                   the tuned width of the trial move, a float or an array (n_alpha, 1, 1) for a batch
+    N_equil:                Number of steps of the warm up, the burn in length
+    rate:                   acceptance rate with the tuned step
+
+    """
+
+    if target_rate is None:
+        target_rate = 0.5 if drift_function is None else 0.8
+
+    batch_shape = r_initial.shape[:-2]
+    step = np.full(batch_shape + (1, 1), step)
+    log_psi = log_amplitude(log_function, r_initial)
+    N_equil = 0
+
+    # tune the step towards the target acceptance rate, the change shrinks as the rate gets closer
+    rate = np.zeros(batch_shape)
+    while N_equil + N_tune <= max_steps/2:
+        _, r_initial, log_psi, accept = metropolis_steps(log_function, r_initial, log_psi, N_tune, rng, step, False,
+                                                         particle_function, backend, drift_function)
+        N_equil += N_tune
+
+        rate = np.mean(accept, axis = -1)/N_tune
+        step = step*np.exp(rate - target_rate)[..., None, None]
+        if np.all(np.abs(rate - target_rate) < 0.05):
+            break
+
+    # sliding window drift test on the walker averaged local energy, the windows are made shorter for a short warm up so
+    # at least two of them fit, with a step for every block of the test
+    window = min(window, int(max_steps - N_equil)//2)
+    E_previous = None
+    passed = np.zeros(batch_shape, dtype = bool)
+    while window >= 10 and N_equil + window <= max_steps:
+        r_chunk, r_initial, log_psi, accept = metropolis_steps(log_function, r_initial, log_psi, window, rng, step,
+                                                              particle_function = particle_function, backend = backend,
+                                                              drift_function = drift_function)
+        N_equil += window
+
+        E_window = np.mean(np.reshape(E_loc(r_chunk), r_chunk.shape[:-1]), axis = -1)
+        if E_previous is not None:
+            passed |= stationary(E_previous, E_window)
+            if np.all(passed):
+                break
+        E_previous = E_window
+
+    if not np.all(passed):
+        warnings.warn(f"the chain did not pass the drift test in the warm up of {N_equil} steps, the production run can "
+                      f"start out of equilibrium, use more steps")
+
+    if batch_shape == ():
+        step = float(step[0, 0])
+    return (r_initial, step, N_equil, rate)
+
+
+def stationary(E_previous, E_window, N_blocks = 10):
+    """ Drift test between two consecutive windows of the walker averaged local energy. The standard error of the mean of
+        every window is computed from N_blocks block averages, to take the correlation of the steps into account.
+
+    Parameters
+    ----------
+    E_previous:             numpy array (window, ...) of the walker averaged local energy of the previous window
+    E_window:               numpy array (window, ...) of the walker averaged local energy of the last window
+    N_blocks:               Number of blocks the windows are divided in
+
+
+    Returns:
+    --------
+    numpy bool array, True where the means of both windows agree within two standard errors
+    """
+
+    error2 = 0
+    for E in (E_previous, E_window):
+        block_av = np.mean(np.reshape(E[:len(E)//N_blocks*N_blocks], (N_blocks, -1) + E.shape[1:]), axis = 1)
+        error2 = error2 + np.var(block_av, axis = 0)/(N_blocks - 1)
+
+    return np.abs(np.mean(E_window, axis = 0) - np.mean(E_previous, axis = 0)) <= 2*np.sqrt(error2)
+
+
+def check_production(N_tries, N_equil):
+    """ Raises a ValueError if the burn in of N_equil steps leaves fewer than min_production_steps of the N_tries steps for
+        the production run.
+    """
+
+    if N_tries - N_equil < min_production_steps:
+        raise ValueError(f"N_tries = {N_tries} leaves {N_tries - N_equil} steps after the burn in of {N_equil} steps, "
+                         f"at least {min_production_steps} are needed for the production run")
+
+
+def metropolis_algorithm(log_function, N_tries, N_walkers, D, chunk_size = 1000, seed = None, backend = "numpy",
+                         drift_function = None, sample_function = None, E_loc = None, N_equil = None, step = 0.3):
     """ This function performs the metroplolis algorithm for important sampling. it sets N number of walkers in a random position
         It makes a random trail move. The trail function is evauluted at the new configuration and its ratio sqaured with the old
-        configuration is calculated. p = [ψT(R)/ψT(R)]2. If p < 1: the new position is accepted with probability p;
-        If p ≥ 1 the new position is accepted;
+        configuration is calculated. p = [ψT(R')/ψT(R)]2. If p < 1: the new position is accepted with probability p;
+        If p ≥ 1 the new position is accepted; The ratio is computed from ln|ψT| to prevent underflow.
+
+        The random numbers are drawn per chunk of steps, see metropolis_stream for the version which does not store the chain.
+        With drift_function the trial moves drift along the quantum force, see metropolis_drift_steps. With
+        sample_function the positions are drawn directly from |ψT|² instead, without burn in, see exact_stream.
+
+        If N_equil is None the step is tuned and the burn in is detected by metropolis_warmup, which takes at most half of
+        the N_tries steps. A ValueError is raised if fewer than min_production_steps steps are left after the burn in.
 
     Parameters
     ----------
-    function:               The trail wave function of the system with R as its input
+    log_function:           ln|ψT(R)| of the system with R as its input
     N_walkers:              Number of random walkers placed
     N_tries:                Number of steps for the walkers to try
     D:                      Dimension of the system
+    chunk_size:             Number of steps for which the random numbers are drawn at once
+    seed:                   seed of the random number generator, None for a random seed
+    backend:                "numpy" or "numba", see metropolis_steps
+    drift_function:         ∇ln|ψT(R)| of the system with R as its input for the Langevin moves, None for gaussian moves
+    sample_function:        draws independent positions from |ψT|², see exact_stream. None for the metropolis algorithm
+    E_loc:                  local energy of the system with R as its input for the drift test of the warm up, None to
+                            test on ln|ψT|
+    N_equil:                Number of steps thrown away for equilibrium, None to detect it automatically
+    step:                   width of the gaussian trial move, the initial one if N_equil is None
 
 
     Returns:
     --------
     data_error:             All of the walkers and its accepted moves in a single numpy array of
-                            (N_walkers x N_tries -N_walkers*4000, D) which takes away the first 4000 for equiliburm
-    rate:                   int the number of overall accepted moves by the walkers
+                            (N_walkers x (N_tries - N_equil), D) which takes away the burn in for equiliburm,
+                            (N_walkers x N_tries, D) for the exact sampler
+    rate:                   fraction of the moves of the walkers which are accepted after the warm up
 
     """
 
-    r_initial = np.random.randn(N_walkers, D)
-    r_final = np.zeros((N_tries, N_walkers, D))
-    displacement = 0.3*np.random.randn(N_tries, N_walkers, D)       # set outside of for loop
-    coin_flip = np.random.uniform(0, 1, (N_tries, N_walkers, D))    # to compare with if ratio < 1
+    rng = np.random.default_rng(seed)
 
-    # these will help to obtain the acceptance rate
-    A = np.ones((N_walkers, D))
-    B = np.zeros((N_walkers, D))
-    accept = 0
+    # the accepted moves of a fixed burn in are counted by the stream, the ones of the warm up are not
+    N_counted = 0
 
-    for i in range(N_tries):
-        r_trial = r_initial + displacement[i,:,:]       # trial move
-        ratio = (function(r_trial) / function(r_initial))**2
+    if sample_function is not None:
+        # independent samples do not need a burn in
+        N_equil = 0
+        chain = exact_stream(log_function, sample_function, N_tries, N_walkers, D, chunk_size, rng)
+    elif N_equil is None:
+        r_initial = rng.standard_normal((N_walkers, D))
+        r_initial, step, N_equil, _ = metropolis_warmup(log_function, log_function if E_loc is None else E_loc, r_initial,
+                                                        rng, step, max_steps = N_tries//2, backend = backend,
+                                                        drift_function = drift_function)
+        check_production(N_tries, N_equil)
+        chain = metropolis_stream(log_function, N_tries - N_equil, N_walkers, D, chunk_size, 0, rng, step, r_initial,
+                                  backend = backend, drift_function = drift_function)
+    else:
+        check_production(N_tries, N_equil)
+        N_counted = N_equil
+        chain = metropolis_stream(log_function, N_tries, N_walkers, D, chunk_size, N_equil, rng, step,
+                                  backend = backend, drift_function = drift_function)
 
-        r_final[i, :, :] = np.where(ratio >= 1, r_trial, (np.where(coin_flip[i,:,:] < ratio, r_trial, r_initial)))
-        r_initial = np.where(ratio >= 1, r_trial, (np.where(coin_flip[i,:,:] < ratio, r_trial, r_initial)))
+    r_final = np.zeros((N_tries - N_equil, N_walkers, D))
+    accept = 0
 
-        # keep track of accepted moves
-        accept += np.sum( np.where(ratio >= 1, A, (np.where(coin_flip[i,:,:] < ratio, A, B))) )
+    i = 0
+    for r_chunk, accept in chain:
+        r_final[i:i + len(r_chunk)] = r_chunk
+        i += len(r_chunk)
 
-    rate = accept/(N_tries*N_walkers*D)
+    rate = np.sum(accept)/((N_tries - N_equil + N_counted)*N_walkers)
 
-    r_shape = np.reshape(r_final[4000:,:], (N_tries*N_walkers -N_walkers*4000, D))     # trow out first 4000 ensuiring equiliburm
+    r_shape = np.reshape(r_final, (N_tries*N_walkers -N_walkers*N_equil, D))     # trow out the burn in ensuiring equiliburm
     return (r_shape, rate)
 
-import numpy as np
+
+def metropolis_accumulate(log_function, E_loc, N_tries, N_walkers, D, deriv_wave_function = None, N_params = 1,
+                          keep_E_loc = False, chunk_size = 1000, N_processes = 1, seed = None, N_equil = None,
+                          step = 0.3, target_rate = None, particle_function = None, local_function = None,
+                          backend = "numpy", target_error = None, max_seconds = None, r_initial = None,
+                          deriv_E_loc = None, checkpoint_file = None, checkpoint_interval = 60, drift_function = None,
+                          sample_function = None):
+    """ Performs the metropolis algorithm and evaluates the local energy and the logarithmic derivatives of the trail wave
+        function on every chunk of positions as it is sampled. The running sums are kept in an accumulator, so only a chunk
+        of the chain is in memory at the same time.
+
+        With N_processes > 1 the walkers are split over a pool of processes. Every process gets its own statistically
+        independent random stream, spawned from one SeedSequence, and returns its accumulator which are merged afterwards.
+        The functions have to be picklable in that case, so use functools.partial instead of a lambda.
+
+        If N_equil is None the step is tuned and the burn in is detected by metropolis_warmup, which takes at most half of
+        the N_tries steps, the rest is used for the production run. The chosen step and burn in are stored in the
+        accumulator as acc["step"] and acc["N_equil"]. A ValueError is raised if fewer than min_production_steps steps are
+        left after the burn in.
+
+        With a target_error or max_seconds N_tries is the largest number of steps. The error of the energy is estimated
+        with automatic_blocking_error, which goes over the whole series, so it is only done again after check_growth
+        times more steps and the cost of the checks stays of order N log N. The sampling stops as soon as the error is
+        below target_error, or when the wall clock time passes max_seconds. With N_processes > 1 every process publishes
+        its series of the energy in a shared list, and the sampling stops when the error of the merged walkers of all
+        processes is below target_error, see merged_error. The process which finds this tells all processes to stop after
+        their chunk, so they all sample about the same number of steps. The time of the sampling and the estimated time for all N_tries
+        steps are stored as acc["seconds"] and acc["seconds_full"].
+
+        The positions of the walkers after the last step are stored as acc["r_final"]. They can be given as r_initial of
+        the next run, for example after a small change of the parameters, so the warm up starts from walkers which are
+        already close to equilibrium and is short.
+
+        With a checkpoint_file the state of the production run is saved every checkpoint_interval seconds: the positions
+        and ln|ψT| of the walkers, the state of the random number generator and the accumulator. If the file exists when
+        the run starts, the run continues from it and gives the same result to the last bit as a run which was not
+        stopped. The checkpoint stores the signature of the run, the functions with their parameters, the numbers of
+        steps and walkers, the chunk size, the burn in, the moves and the seed, and a ValueError is raised if it belongs
+        to another run, see checkpoint_read. The file is removed when the run is finished. With N_processes > 1 every
+        process has its own file, see checkpoint_files. A run which is stopped during the warm up starts again, with a
+        seed it makes the same chain.
+
+        With a sample_function the positions are drawn directly from |ψT|² by exact_stream instead of the metropolis
+        algorithm. All N_tries steps are used, without warm up or burn in, and the samples are independent.
+
+    Parameters
+    ----------
+    log_function:           ln|ψT(R)| of the system with R as its input
+    E_loc:                  local energy of the system with R as its input
+    N_tries:                Number of steps for the walkers to try, including the burn in
+    N_walkers:              Number of random walkers placed
+    D:                      Dimension of the system
+    deriv_wave_function:    dlnψT/dα with R as its input, returns an array (N, N_params). None if not needed
+    N_params:               Number of parameters returned by deriv_wave_function
+    keep_E_loc:             set to True to also keep every local energy in the accumulator
+    chunk_size:             Number of steps which are evaluated at once
+    N_processes:            Number of processes the walkers are divided over
+    seed:                   seed of the random number generators, None for a random seed
+    N_equil:                Number of steps thrown away for equilibrium, None to detect it automatically
+    step:                   width of the gaussian trial move, the initial one if N_equil is None
+    target_rate:            acceptance rate the step is tuned to if N_equil is None, None for the default of
+                            metropolis_warmup
+    particle_function:      ln of the factors of ψT which depend on electron k to move the electrons one at a time,
+                            None to move the whole walker. See metropolis_particle_steps
+    local_function:         fused kernel of the system with R as its input which returns ln|ψT|, E_loc and dlnψT/dα
+                            from a single geometry of the positions. Used instead of E_loc and deriv_wave_function for
+                            the chunks if it is given
+    backend:                "numpy" or "numba", see metropolis_steps
+    target_error:           error of the energy at which the sampling stops, None to sample all N_tries steps
+    max_seconds:            wall clock budget in seconds at which the sampling stops, None for no budget
+    r_initial:              numpy array (N_walkers, D) of the starting positions of the walkers, None for random positions
+    deriv_E_loc:            dE_loc/dα with R as its input, returns an array (N, N_params). Only needed for the hamiltonian
+                            of the linear method, see accumulator_matrices, and the zero variance energy, see
+                            accumulator_zero_variance
+    checkpoint_file:        name of the .npz file of the checkpoints, None for no checkpoints
+    checkpoint_interval:    time in seconds between two checkpoints
+    drift_function:         ∇ln|ψT(R)| with R as its input for the Langevin moves, None for the gaussian moves. See
+                            metropolis_drift_steps
+    sample_function:        draws independent positions from |ψT|², see exact_stream. None for the metropolis algorithm
+
+
+    Returns:
+    --------
+    acc:                    accumulator with the running sums, see accumulator_results
+    rate:                   fraction of the moves of the walkers which are accepted in the production run
+
+    """
+
+    seeds = np.random.SeedSequence(seed).spawn(N_processes)
+    walkers = [len(w) for w in np.array_split(np.arange(N_walkers), N_processes)]
+
+    settings = {"log_function": log_function, "E_loc": E_loc, "N_tries": N_tries, "D": D,
+                "deriv_wave_function": deriv_wave_function, "N_params": N_params, "keep_E_loc": keep_E_loc,
+                "chunk_size": chunk_size, "N_equil": N_equil, "step": step, "target_rate": target_rate,
+                "particle_function": particle_function, "local_function": local_function,
+                "backend": backend, "max_seconds": max_seconds,
+                "target_error": target_error, "walker_counts": walkers, "seeded": seed is not None,
+                "deriv_E_loc": deriv_E_loc, "checkpoint_interval": checkpoint_interval,
+                "drift_function": drift_function, "sample_function": sample_function}
+    starts = np.array_split(r_initial, N_processes) if r_initial is not None else [None]*N_processes
+    files = checkpoint_files(checkpoint_file, N_processes)
+    tasks = [dict(settings, N_walkers = walkers[i], seed = seeds[i], r_initial = starts[i], checkpoint_file = files[i],
+                  index = i, series = None, stop = None) for i in range(N_processes)]
+
+    if N_processes == 1:
+        results = [accumulate_walkers(tasks[0])]
+    else:
+        with Manager() as manager, ProcessPoolExecutor(max_workers = N_processes) as pool:
+            # the processes share their series of the energy, so they stop on the error of all walkers together
+            if target_error is not None:
+                series, stop = manager.list([None]*N_processes), manager.Event()
+                tasks = [dict(task, series = series, stop = stop) for task in tasks]
+            results = list(pool.map(accumulate_walkers, tasks))
+
+    acc = accumulator_merge([result[0] for result in results])
+    rate = sum(result[1]*walkers[i] for i, result in enumerate(results))/N_walkers
+    return (acc, rate)
+
+
+def accumulate_walkers(task):
+    """ Samples and accumulates a group of walkers with its own random stream. This is the work done by every process of
+        metropolis_accumulate.
+
+    Parameters
+    ----------
+    task:                   dictionary of the arguments of metropolis_accumulate, with the number of walkers of this group,
+                            a SeedSequence as seed, the starting positions and the checkpoint file of this group instead
+                            of N_processes. With a target error also the number of walkers of every group
+                            "walker_counts", the index of this group, the shared list of the series of the energy of
+                            the groups "series" and the shared event "stop" which is set when the target is reached,
+                            None for a single group. "seeded" tells if the seed was given, only then it is part of the
+                            signature of the checkpoint
+
+
+    Returns:
+    --------
+    acc:                    accumulator of this group of walkers
+    rate:                   fraction of the moves of this group which are accepted in the production run
+    """
+
+    log_function = task["log_function"]
+    E_loc = task["E_loc"]
+    deriv_wave_function = task["deriv_wave_function"]
+    particle_function = task["particle_function"]
+    local_function = task["local_function"]
+    backend = task["backend"]
+    drift_function = task["drift_function"]
+    sample_function = task["sample_function"]
+    target_error, max_seconds = task["target_error"], task["max_seconds"]
+    N_tries, N_walkers, D, N_params = task["N_tries"], task["N_walkers"], task["D"], task["N_params"]
+    N_equil, step, chunk_size = task["N_equil"], task["step"], task["chunk_size"]
+
+    start_time = time.time()
+    rng = np.random.default_rng(task["seed"])
+    checkpoint_file, checkpoint_interval = task["checkpoint_file"], task["checkpoint_interval"]
+    checkpoint = checkpoint_read(checkpoint_file, walkers_signature(task))
+    walkers = {}
+
+    if checkpoint is not None:
+        # continue the production run of the checkpoint with the same random numbers and chunks
+        acc = accumulator_from_arrays(checkpoint)
+        rng_restore(rng, checkpoint["rng"])
+        step, N_equil = acc["step"], acc["N_equil"]
+        N_counted, N_done = int(checkpoint["N_counted"]), int(checkpoint["N_done"])
+        next_check = float(checkpoint["next_check"])
+        accept_done = checkpoint["accept"]
+        start_time -= float(checkpoint["seconds"])
+        if sample_function is not None:
+            chain = exact_stream(log_function, sample_function, N_tries - N_equil - N_done, N_walkers, D, chunk_size,
+                                 rng, walkers)
+        else:
+            chain = metropolis_stream(log_function, N_tries - N_equil - N_done, N_walkers, D, chunk_size, 0, rng, step,
+                                      checkpoint["r"], particle_function, backend, checkpoint["log_psi"], walkers,
+                                      drift_function)
+
+    else:
+        r_initial = task["r_initial"]
+        if r_initial is None:
+            r_initial = rng.standard_normal((N_walkers, D))
+
+        # the accepted moves of a fixed burn in are counted by the stream, the ones of the warm up are not
+        N_counted = 0
+
+        # independent samples need no burn in and have no trial moves
+        if sample_function is not None:
+            step, N_equil = 0.0, 0
+            chain = exact_stream(log_function, sample_function, N_tries, N_walkers, D, chunk_size, rng, walkers)
+
+        # the warm up replaces the fixed burn in, the production run starts when the chain is stationary
+        elif N_equil is None:
+            r_initial, step, N_equil, _ = metropolis_warmup(log_function, E_loc, r_initial, rng, step,
+                                                            task["target_rate"], max_steps = N_tries//2,
+                                                            particle_function = particle_function, backend = backend,
+                                                            drift_function = drift_function)
+            check_production(N_tries, N_equil)
+            chain = metropolis_stream(log_function, N_tries - N_equil, N_walkers, D, chunk_size, 0, rng, step,
+                                      r_initial, particle_function, backend, walkers = walkers,
+                                      drift_function = drift_function)
+        else:
+            check_production(N_tries, N_equil)
+            N_counted = N_equil
+            chain = metropolis_stream(log_function, N_tries, N_walkers, D, chunk_size, N_equil, rng, step, r_initial,
+                                      particle_function, backend, walkers = walkers, drift_function = drift_function)
+
+        acc = accumulator_init(N_walkers, N_params, task["keep_E_loc"])
+        acc["step"] = step
+        acc["N_equil"] = N_equil
+        acc["r_final"] = r_initial
+        accept_done = 0
+        N_done = 0
+        next_check = 0
+
+    accept = accept_done
+    writer = None
+    checkpoint_time = time.time()
+
+    for r_chunk, accept in chain:
+        accept = accept_done + accept
+        N_steps = len(r_chunk)
+        N_done += N_steps
+        r = np.reshape(r_chunk, (N_steps*N_walkers, D))
+
+        dpsi = None
+        if local_function is not None:
+            _, E, dpsi = local_function(r)
+            dpsi = np.reshape(dpsi, (N_steps, N_walkers, N_params))
+        else:
+            E = E_loc(r)
+            if deriv_wave_function is not None:
+                dpsi = np.reshape(deriv_wave_function(r), (N_steps, N_walkers, N_params))
+
+        E = np.reshape(E, (N_steps, N_walkers))
+
+        dE = None
+        if task["deriv_E_loc"] is not None:
+            dE = np.reshape(task["deriv_E_loc"](r), (N_steps, N_walkers, N_params))
+
+        accumulator_update(acc, E, dpsi, dE)
+        acc["r_final"] = r_chunk[-1]
+
+        # stop when the error bar or the time budget is reached
+        if max_seconds is not None and time.time() - start_time > max_seconds:
+            break
+        if target_error is not None and N_done >= next_check:
+            next_check = N_done*(1 + check_growth)
+            E_steps = np.concatenate(acc["E_steps"])
+            if merged_error(E_steps, task["series"], task["index"], task["walker_counts"]) <= target_error:
+                if task["stop"] is not None:
+                    task["stop"].set()
+                break
+        if task["stop"] is not None and task["stop"].is_set():
+            break
+
+        # the checkpoint is written after the checks, so a continued run makes the same checks
+        if checkpoint_file is not None and time.time() - checkpoint_time >= checkpoint_interval:
+            writer = checkpoint_write(checkpoint_file, walkers_checkpoint(acc, walkers, rng, accept, N_done, N_counted,
+                                                                          next_check, time.time() - start_time, task),
+                                      writer)
+            checkpoint_time = time.time()
+
+    # the run is finished, so a run which is started again with the same file starts from the beginning
+    checkpoint_remove(checkpoint_file, writer)
+
+    # the time of the steps which were not sampled is estimated from the time per step of the production run
+    acc["seconds"] = time.time() - start_time
+    acc["seconds_full"] = acc["seconds"]*(N_tries - N_equil)/N_done if N_done > 0 else acc["seconds"]
+
+    return (acc, np.sum(accept)/((N_counted + N_done)*N_walkers))
+
+
+def merged_error(E_steps, series, index, walker_counts):
+    """ Error of the energy of the walkers of all processes of metropolis_accumulate together. The walker averaged local
+        energy of every step of this group is stored in the shared list series, and the series of all groups are merged
+        like accumulator_merge does, weighted with their number of walkers and cut to the shortest group, so the error
+        is the one of the merged accumulator. The groups which have not stored their series yet give an infinite error.
+
+    Parameters
+    ----------
+    E_steps:                numpy array (N_steps,) of the walker averaged local energy of every step of this group
+    series:                 shared list of the last stored E_steps of every group, None for a single group
+    index:                  index of this group in series
+    walker_counts:          list of the number of walkers of every group
+
+
+    Returns:
+    --------
+    error of the energy of all groups together, see automatic_blocking_error
+    """
+
+    if series is not None:
+        series[index] = E_steps
+        groups = list(series)
+        if any(group is None for group in groups):
+            return np.inf
+        N_steps = min(len(group) for group in groups)
+        E_steps = sum(n*group[:N_steps] for n, group in zip(walker_counts, groups))/sum(walker_counts)
+
+    return automatic_blocking_error(E_steps)[0]
+
+
+def walkers_checkpoint(acc, walkers, rng, accept, N_done, N_counted, next_check, seconds, task):
+    """ Collects the state of the production run of accumulate_walkers after a chunk as a dictionary of numpy arrays for
+        checkpoint_write. Everything is copied, so the run can go on while the checkpoint is written.
+
+    Parameters
+    ----------
+    acc:                    accumulator of the run
+    walkers:                dictionary with the positions "r" and ln|ψT| "log_psi" of the walkers, see metropolis_stream
+    rng:                    numpy random Generator of the run
+    accept:                 numpy array (N_walkers,) of the number of accepted moves up to now
+    N_done:                 Number of steps of the production run which are done
+    N_counted:              Number of steps of the burn in of which the accepted moves are counted
+    next_check:             Number of steps of the production run at which the error is checked again for target_error
+    seconds:                wall clock time of the run up to now
+    task:                   dictionary of the arguments of the run, see accumulate_walkers and walkers_signature
+
+
+    Returns:
+    --------
+    dictionary of numpy arrays
+    """
+
+    return dict(accumulator_arrays(acc), r = np.array(walkers["r"]), log_psi = np.array(walkers["log_psi"]),
+                rng = rng_state(rng), accept = np.array(accept), N_done = np.array(N_done),
+                N_counted = np.array(N_counted), next_check = np.array(next_check), seconds = np.array(seconds), signature = walkers_signature(task))
+
+
+def walkers_signature(task):
+    """ Signature of the run of a group of walkers of accumulate_walkers, see checkpoint_signature. It has everything
+        which fixes the chain: the functions with their parameters, the numbers of steps and walkers, the chunk size, the
+        burn in, the moves and the seed of the group. Without a given seed the chain only continues from the state of the
+        random number generator in the checkpoint, so the seed is then left out.
+    """
+
+    seed = task["seed"]
+    return checkpoint_signature(log_function = task["log_function"], E_loc = task["E_loc"], N_tries = task["N_tries"],
+                                N_walkers = task["N_walkers"], chunk_size = task["chunk_size"],
+                                N_equil = task["N_equil"], step = task["step"], target_rate = task["target_rate"],
+                                particle_function = task["particle_function"], drift_function = task["drift_function"],
+                                sample_function = task["sample_function"], local_function = task["local_function"],
+                                deriv_wave_function = task["deriv_wave_function"], deriv_E_loc = task["deriv_E_loc"],
+                                N_params = task["N_params"], keep_E_loc = task["keep_E_loc"], backend = task["backend"],
+                                seed = [seed.entropy, seed.spawn_key] if task["seeded"] else None)
+
+
+def metropolis_scan(log_function, E_loc, theta, N_tries, N_walkers, D, chunk_size = 100, seed = None, target_rate = None,
+                    particle_function = None, drift_function = None):
+    """ Samples the chains of all the parameter vectors of a scan in a single vectorized sweep. The walkers are kept in an
+        array of shape (n_alpha, N_walkers, D) and the functions are evaluated for a parameter vector of which every entry
+        is a column of shape (n_alpha, 1, 1), so every metropolis step is done for all chains at once instead of in a python
+        loop over separate runs. Every chain gets its own step from metropolis_warmup.
+
+    Parameters
+    ----------
+    log_function:           ln|ψT(θ, R)| of the system with the parameter vector and R as its input, like System.log_psi
+    E_loc:                  local energy of the system with the parameter vector and R as its input
+    theta:                  numpy array (n_alpha, n_params) of the parameter vectors of the scan
+    N_tries:                Number of steps for the walkers to try, including the burn in
+    N_walkers:              Number of random walkers placed for every alpha
+    D:                      Dimension of the system
+    chunk_size:             Number of steps which are evaluated at once, the chunk holds n_alpha chains
+    seed:                   seed of the random number generator, None for a random seed
+    target_rate:            acceptance rate the steps are tuned to, None for the default of metropolis_warmup
+    particle_function:      ln of the factors of ψT(θ, R) which depend on electron k with the parameter vector, R, k and
+                            the position of electron k as its input. None to move the whole walker
+    drift_function:         ∇ln|ψT(θ, R)| with the parameter vector and R as its input, like System.grad_log_psi, for the
+                            Langevin moves. None for the gaussian moves
+
+
+    Returns:
+    --------
+    accs:                   list of the accumulators of every parameter vector, see accumulator_results
+    rate:                   numpy array of the fraction of accepted moves for every parameter vector in the production run
+
+    """
+
+    n_alpha = len(theta)
+    theta = np.reshape(np.transpose(theta), (np.shape(theta)[1], n_alpha, 1, 1))
+    f = partial(log_function, theta)
+    E = partial(E_loc, theta)
+    if particle_function is not None:
+        particle_function = partial(particle_function, theta)
+    if drift_function is not None:
+        drift_function = partial(drift_function, theta)
+    rng = np.random.default_rng(seed)
+
+    r_initial = rng.standard_normal((n_alpha, N_walkers, D))
+    r_initial, step, N_equil, _ = metropolis_warmup(f, E, r_initial, rng, target_rate = target_rate, max_steps = N_tries//2,
+                                                    particle_function = particle_function, drift_function = drift_function)
+    check_production(N_tries, N_equil)
+
+    accs = [accumulator_init(N_walkers) for i in range(n_alpha)]
+    for i in range(n_alpha):
+        accs[i]["step"] = float(step[i, 0, 0])
+        accs[i]["N_equil"] = N_equil
+    accept = 0
+
+    for r_chunk, accept in metropolis_stream(f, N_tries - N_equil, (n_alpha, N_walkers), D, chunk_size, 0, rng, step,
+                                             r_initial, particle_function, drift_function = drift_function):
+        E_chunk = np.reshape(E(r_chunk), r_chunk.shape[:-1])
+
+        for i in range(n_alpha):
+            accumulator_update(accs[i], E_chunk[:, i])
+
+    rate = np.sum(accept, axis = 1)/((N_tries - N_equil)*N_walkers)
+    return (accs, rate)
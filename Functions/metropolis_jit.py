@@ -0,0 +1,140 @@
+import numpy as np
+
+import Systems.HarmonicOscillator as Oscillator
+import Systems.Hatom as Hydrogen
+import Systems.Helium as Helium
+import Systems.Helium2 as Helium2
+
+try:
+    import numba
+except ImportError:
+    numba = None
+
+""" This file has the compiled backend of the metropolis algorithm. The loop over the steps of metropolis_steps is compiled
+    with numba into a single kernel which runs the walkers in parallel. Every walker does its trial moves, the evaluation
+    of ln|ψT| and the acceptance without temporary arrays of all walkers. The random numbers are drawn by numpy in
+    metropolis_steps like for the numpy backend, so both backends give the same chain for the same seed.
+
+    Only the trail wave functions of the built in systems are compiled. numba is optional, the numpy backend is the
+    reference and is used by default.
+"""
+
+def log_psi_oscillator(params, r):
+    """ ln|ψT| of a single walker of the harmonic oscillator, params = (alpha,). """
+    return -params[0]*r[0]**2
+
+
+def log_psi_hydrogen(params, r):
+    """ ln|ψT| of a single walker of the Hydrogen atom, params = (alpha,). """
+    return -params[0]*np.sqrt(r[0]**2 + r[1]**2 + r[2]**2)
+
+
+def log_psi_helium(params, r):
+    """ ln|ψT| of a single walker of the Helium atom, params = (alpha, beta). beta is 2 for Systems.Helium. """
+    r1 = np.sqrt(r[0]**2 + r[1]**2 + r[2]**2)
+    r2 = np.sqrt(r[3]**2 + r[4]**2 + r[5]**2)
+    r12 = np.sqrt((r[0] - r[3])**2 + (r[1] - r[4])**2 + (r[2] - r[5])**2)
+    return -params[1]*(r1 + r2) + r12/(2*(1 + params[0]*r12))
+
+
+# the walker function and the parameters of the compiled kernel for the log_psi of every system
+walker_functions = {Oscillator.log_psi: (log_psi_oscillator, lambda theta: (theta[0], )),
+                    Hydrogen.log_psi: (log_psi_hydrogen, lambda theta: (theta[0], )),
+                    Helium.log_psi: (log_psi_helium, lambda theta: (theta[0], 2.0)),
+                    Helium2.log_psi: (log_psi_helium, lambda theta: (theta[0], theta[1]))}
+
+kernels = {}
+
+
+def jit_available():
+    """ Returns True if numba can be imported, so the numba backend can be used. """
+    return numba is not None
+
+
+def steps_kernel(log_psi_walker):
+    """ Compiles the metropolis steps for the walker function log_psi_walker. The kernels are compiled once per walker
+        function and kept in kernels.
+
+    Parameters
+    ----------
+    log_psi_walker:         ln|ψT| of a single walker with the parameters and its position as input
+
+
+    Returns:
+    --------
+    compiled function which performs the steps in place, see jit_steps
+    """
+
+    if log_psi_walker in kernels:
+        return kernels[log_psi_walker]
+
+    log_psi_jit = numba.njit(log_psi_walker)
+
+    @numba.njit(parallel = True)
+    def steps(params, r, log_psi, displacement, log_coin_flip, r_chunk, store):
+        N_steps, N_walkers, D = displacement.shape
+        accept = np.zeros(N_walkers, dtype = np.int64)
+
+        # the walkers are independent, so every walker does all of its steps in its own thread
+        for j in numba.prange(N_walkers):
+            r_trial = np.empty(D)
+            for i in range(N_steps):
+                for d in range(D):
+                    r_trial[d] = r[j, d] + displacement[i, j, d]
+                log_psi_trial = log_psi_jit(params, r_trial)
+
+                if log_coin_flip[i, j] < 2*(log_psi_trial - log_psi[j]):
+                    for d in range(D):
+                        r[j, d] = r_trial[d]
+                    log_psi[j] = log_psi_trial
+                    accept[j] += 1
+
+                if store:
+                    for d in range(D):
+                        r_chunk[i, j, d] = r[j, d]
+
+        return accept
+
+    kernels[log_psi_walker] = steps
+    return steps
+
+
+def jit_steps(log_function, r_initial, log_psi, displacement, log_coin_flip, store = True):
+    """ Performs the metropolis steps of metropolis_steps with the compiled kernel.
+
+    Parameters
+    ----------
+    log_function:           functools.partial of the log_psi of one of the systems with its parameter vector
+    r_initial:              numpy array (N_walkers, D) of the current positions of the walkers
+    log_psi:                numpy array (N_walkers,) of ln|ψT| at the current positions
+    displacement:           numpy array (N_steps, N_walkers, D) of the trial moves
+    log_coin_flip:          numpy array (N_steps, N_walkers) of the logarithm of the coin flips
+    store:                  set to False if the positions of the walkers do not have to be stored (burn in)
+
+
+    Returns:
+    --------
+    r_chunk:                numpy array (N_steps, N_walkers, D) of the positions after every step, None if store is False
+    r_initial:              numpy array (N_walkers, D) of the positions after the last step
+    log_psi:                numpy array (N_walkers,) of ln|ψT| at the positions after the last step
+    accept:                 numpy array (N_walkers,) of the number of accepted moves of every walker in these steps
+
+    """
+
+    if numba is None:
+        raise ImportError("the numba backend needs numba, use backend = 'numpy' instead")
+
+    function = getattr(log_function, "func", None)
+    if function not in walker_functions or r_initial.ndim != 2:
+        raise ValueError("the numba backend only supports a single chain of the log_psi of the built in systems")
+
+    log_psi_walker, parameters = walker_functions[function]
+    params = np.array(parameters(*log_function.args), dtype = float)
+
+    r_initial = np.array(r_initial, dtype = float)      # the kernel updates the positions in place
+    log_psi = np.array(log_psi, dtype = float)
+    r_chunk = np.zeros(displacement.shape) if store else np.zeros((0, 0, 0))
+
+    accept = steps_kernel(log_psi_walker)(params, r_initial, log_psi, displacement, log_coin_flip, r_chunk, store)
+
+    return (r_chunk if store else None, r_initial, log_psi, accept)
@@ -0,0 +1,159 @@
+import numpy as np
+from functools import partial
+
+from Functions.metropolis import *
+from Functions.errorcalc import *
+
+""" This file has the functions to estimate the energy for a whole grid of parameters from a single chain with correlated
+    sampling. The walkers are sampled at a reference parameter vector θ0 and every sample is reweighted with
+
+            w(R) = |ψθ(R)/ψθ0(R)|² ,        E(θ) = Σ w E_loc(θ) / Σ w
+
+    When the weights degenerate, which is measured with the effective sample size (Σ w)²/Σ w², a new chain is sampled at
+    another anchor θ.
+"""
+
+def reweight_accumulate(System, theta_ref, theta, N_tries, N_walkers, block_size = None, chunk_size = 1000, seed = None):
+    """ Samples the walkers at theta_ref and estimates the energy, variance and error for every parameter vector from the
+        reweighted samples. Every row of theta is one parameter vector of the grid.
+
+    Parameters
+    ----------
+    System:                 current system. Can choose between: Oscillator, Hydrogen, Helium or Helium2
+    theta_ref:              parameter vector at which the walkers are sampled
+    theta:                  numpy array (n, n_params) of the parameter vectors for which the energy is estimated
+    N_tries:                Number of steps for the walkers to try
+    N_walkers:              Number of random walkers placed
+    block_size:             Size of the blocks in number of samples for the error, None to choose it automatically
+    chunk_size:             Number of steps which are evaluated at once
+    seed:                   seed of the random number generator, None for a random seed
+
+
+    Returns:
+    --------
+    E_a:                    numpy array of the energy for every parameter vector
+    E_var:                  numpy array of the variance of the local energy for every parameter vector
+    E_error:                numpy array of the error of the energy for every parameter vector
+    ess:                    numpy array of the effective sample size divided by the number of samples for every
+                            parameter vector
+    """
+
+    D = System.dimension
+    f = partial(System.log_psi, theta_ref)
+
+    # the log weights are shifted with the largest one of the first chunk so the exponential can not overflow
+    shift = None
+    N = 0
+    w_sum = np.zeros(len(theta))
+    w2_sum = np.zeros(len(theta))
+    wE_sum = np.zeros(len(theta))
+    wE2_sum = np.zeros(len(theta))
+    w_steps = []
+    wE_steps = []
+
+    # the step and burn in are chosen by the warm up at the reference parameters
+    rng = np.random.default_rng(seed)
+    r_initial = rng.standard_normal((N_walkers, D))
+    r_initial, step, N_equil, _ = metropolis_warmup(f, partial(System.local_energy, theta_ref), r_initial, rng,
+                                                    max_steps = N_tries//2)
+
+    for r_chunk, accept in metropolis_stream(f, N_tries - N_equil, N_walkers, D, chunk_size, 0, rng, step, r_initial):
+        N_steps = len(r_chunk)
+        r = np.reshape(r_chunk, (N_steps*N_walkers, D))
+        log_psi_ref = System.log_psi(theta_ref, r)
+
+        log_w = np.zeros((len(theta), N_steps, N_walkers))
+        E = np.zeros((len(theta), N_steps, N_walkers))
+        for i in range(len(theta)):
+            log_w[i] = np.reshape(2*(System.log_psi(theta[i], r) - log_psi_ref), (N_steps, N_walkers))
+            E[i] = np.reshape(System.local_energy(theta[i], r), (N_steps, N_walkers))
+
+        if shift is None:
+            shift = np.max(log_w, axis = (1, 2))
+        w = np.exp(log_w - shift[:, None, None])
+
+        N += N_steps*N_walkers
+        w_sum += np.sum(w, axis = (1, 2))
+        w2_sum += np.sum(w**2, axis = (1, 2))
+        wE_sum += np.sum(w*E, axis = (1, 2))
+        wE2_sum += np.sum(w*E**2, axis = (1, 2))
+        w_steps.append(np.sum(w, axis = 2))
+        wE_steps.append(np.sum(w*E, axis = 2))
+
+    E_a = wE_sum/w_sum
+    E_var = wE2_sum/w_sum - E_a**2
+    ess = w_sum**2/w2_sum/N
+
+    # the error of the ratio estimator follows from the blocking error of the linearised series (Σ wE - E Σ w)/<Σ w>
+    w_steps = np.concatenate(w_steps, axis = 1)
+    wE_steps = np.concatenate(wE_steps, axis = 1)
+    E_error = np.zeros(len(theta))
+    for i in range(len(theta)):
+        z = (wE_steps[i] - E_a[i]*w_steps[i])/np.mean(w_steps[i])
+        if block_size is None:
+            E_error[i], _, _ = automatic_blocking_error(z)
+        else:
+            block_steps = max(1, block_size//N_walkers)
+            N_blocks = len(z)//block_steps
+            E_error[i], _ = data_blocking_error(z[:N_blocks*block_steps], block_steps)
+
+    return (E_a, E_var, E_error, ess)
+
+
+def reweight_scan(System, theta, N_tries, N_walkers, theta_ref = None, min_ess = 0.1, block_size = None, seed = None):
+    """ Estimates the energy for the whole grid of parameter vectors with as few chains as possible. The first chain is
+        sampled at theta_ref, by default the middle of the grid. For every parameter vector where the relative effective
+        sample size drops below min_ess a new anchor is placed at the middle of the ones which are not yet covered, and
+        its chain is sampled. For every parameter vector the estimate of the anchor with the largest effective sample size
+        is used.
+
+    Parameters
+    ----------
+    System:                 current system. Can choose between: Oscillator, Hydrogen, Helium or Helium2
+    theta:                  numpy array (n, n_params) of the parameter vectors for which the energy is estimated
+    N_tries:                Number of steps for the walkers to try
+    N_walkers:              Number of random walkers placed
+    theta_ref:              parameter vector of the first anchor, None for the middle of the grid
+    min_ess:                smallest effective sample size divided by the number of samples which is trusted
+    block_size:             Size of the blocks in number of samples for the error, None to choose it automatically
+    seed:                   seed of the random number generators, None for a random seed
+
+
+    Returns:
+    --------
+    E_a:                    numpy array of the energy for every parameter vector
+    E_var:                  numpy array of the variance of the local energy for every parameter vector
+    E_error:                numpy array of the error of the energy for every parameter vector
+    ess:                    numpy array of the relative effective sample size for every parameter vector
+    anchors:                list of the parameter vectors at which a chain was sampled
+    """
+
+    theta = np.array(theta, dtype = float)
+    E_a = np.zeros(len(theta))
+    E_var = np.zeros(len(theta))
+    E_error = np.zeros(len(theta))
+    ess = np.zeros(len(theta))
+    anchors = []
+
+    if theta_ref is None:
+        theta_ref = theta[len(theta)//2]
+    seeds = np.random.SeedSequence(seed)
+
+    while True:
+        anchors.append(theta_ref)
+        results = reweight_accumulate(System, theta_ref, theta, N_tries, N_walkers, block_size, seed = seeds.spawn(1)[0])
+
+        better = results[3] > ess
+        E_a[better] = results[0][better]
+        E_var[better] = results[1][better]
+        E_error[better] = results[2][better]
+        ess[better] = results[3][better]
+
+        uncovered = theta[ess < min_ess]
+        if len(uncovered) == 0:
+            break
+
+        # a parameter vector which was already an anchor has ess 1 so it can not be picked again
+        theta_ref = uncovered[len(uncovered)//2]
+
+    return (E_a, E_var, E_error, ess, anchors)
@@ -1,21 +1,410 @@
 import numpy as np
+import os
+import time
+from functools import partial
 
 from Functions.metropolis import *
+from Functions.errorcalc import *
 import Systems.HarmonicOscillator  as oscillator
 import Systems.Hatom as Hydrogen
 import Systems.Helium as Helium
-    
-""" This file has the functions to find the optimal parameters by using the steepest descent method,
-    for 1 and 2 parameters
+
+""" This file has the functions to find the optimal parameters of the trail wave function. optimal_parameters_finder works
+    on a vector of parameters with steepest descent, stochastic reconfiguration, the linear method or Adam. The functions
+    for 1 and 2 parameters use its steepest descent.
 """
 
-def deriv_energy_alpha(alpha, N_tries, N_walkers, System):
+def deriv_energy_theta(theta, N_tries, N_walkers, System, N_processes = 1, particle_moves = False, state = None,
+                       linear = False, seed = None, langevin = False, keep_E_loc = True):
+    """ Samples the walkers for the parameter vector theta and accumulates everything the optimizers need: the energy, the
+        derivatives dE/dθ, the covariance matrix S of the logarithmic derivatives and for the linear method the hamiltonian
+        matrix, see accumulator_matrices. The system is used through its parameter vector interface, log_psi, local_energy,
+        evaluate, log_psi_particle and deriv_local_energy, so it works for any number of parameters.
+
+        The walkers start from state, the walkers of the previous call, so only a short warm up is needed when theta
+        changes a little.
+
+    Parameters
+    ----------
+    theta:                  numpy array of the parameters of the trail wave function
+    N_tries:                Number of steps for the walkers to try
+    N_walkers:              Number of random walkers placed
+    System:                 current system. Can choose between: Oscillator, Hydrogen, Helium or Helium2
+    N_processes:            Number of processes the walkers are divided over
+    particle_moves:         set to True to move the electrons one at a time, only for Helium and Helium2
+    state:                  dictionary with the positions "r" and the width of the trial move "step" of the walkers to
+                            start from, None for random positions
+    linear:                 set to True to also accumulate dE_loc/dθ for the hamiltonian of the linear method
+    seed:                   seed of the random number generators, None for a random seed
+    langevin:               set to True to drift the walkers along the quantum force, see metropolis_drift_steps
+    keep_E_loc:             set to False to only keep the walker averages of every step in the accumulator, the error
+                            and the autocorrelation time follow from those, see accumulator_results
+
+
+    Returns:
+    --------
+    acc:                    accumulator of the run, see accumulator_results and accumulator_matrices
+    E_loc:                  numpy array (N_steps, N_walkers) of the local energy of every walker after the burn in, None
+                            when keep_E_loc is False
+    state:                  dictionary with the positions and the step of the walkers after the last step
+
+    """
+
+    theta = np.array(theta, dtype = float).reshape(-1)
+    f = partial(System.log_psi, theta)
+    E = partial(System.local_energy, theta)
+
+    # the fused kernel returns E_loc and dlnψT/dθ from one geometry of the positions for every system
+    local_function = partial(System.evaluate, theta)
+    particle_function = partial(System.log_psi_particle, theta) if particle_moves else None
+    drift_function = partial(System.grad_log_psi, theta) if langevin else None
+    deriv_E_loc = partial(System.deriv_local_energy, theta) if linear else None
+
+    if state is None:
+        state = {"r": None, "step": 0.3}
+
+    acc, accept_rate = metropolis_accumulate(f, E, N_tries, N_walkers, System.dimension, N_params = len(theta),
+                                             keep_E_loc = keep_E_loc, N_processes = N_processes,
+                                             particle_function = particle_function, local_function = local_function,
+                                             r_initial = state["r"], step = state["step"], deriv_E_loc = deriv_E_loc,
+                                             seed = seed, drift_function = drift_function)
+
+    E_loc = accumulated_E_loc_steps(acc) if keep_E_loc else None
+    state = {"r": acc["r_final"], "step": acc["step"]}
+    return (acc, E_loc, state)
+
+
+def parameter_step(method, gradient, S, H, learning_rate, adam, shift = 1e-3):
+    """ Computes the change of the parameters for one iteration of optimal_parameters_finder.
+
+            gradient:   Δθ = -γ g
+            sr:         Δθ = -γ (S + εI)⁻¹ g/2, the natural gradient of stochastic reconfiguration
+            linear:     the lowest eigenvector c of H c = E S c in the basis ψT, ΔO1 ψT, ... gives Δθ = c[1:]/c[0]
+            adam:       Δθ = -γ m/(√v + ε) with the running averages m and v of g and g²
+
+    Parameters
+    ----------
+    method:                 "gradient", "sr", "linear" or "adam"
+    gradient:               numpy array of dE/dθ
+    S:                      numpy array of the covariance of the logarithmic derivatives
+    H:                      numpy array of the hamiltonian of the linear method, only used for "linear"
+    learning_rate:          γ, not used for "linear"
+    adam:                   dictionary with the running averages "m", "v" and the iteration "t" of adam, it is updated
+    shift:                  relative diagonal shift ε which keeps S and H well conditioned
+
+
+    Returns:
+    --------
+    step:                   numpy array of the change of the parameters
+    change:                 numpy array which is tested against the tollerance. This is the step, except for adam where
+                            it is the step without the momentum, since the momentum can make the step small after an
+                            overshoot while the gradient is not
+    """
+
+    N_params = len(gradient)
+    S_shift = S + shift*np.diag(np.diag(S)) + 1e-12*np.eye(N_params)
+
+    if method == "sr":
+        step = -learning_rate*np.linalg.solve(S_shift, gradient/2)
+        return (step, step)
+
+    if method == "linear":
+        S_bar = np.eye(N_params + 1)
+        S_bar[1:, 1:] = S_shift
+        H_bar = np.array(H)
+        H_bar[1:, 1:] += shift*np.eye(N_params)
+
+        eigenvalues, eigenvectors = np.linalg.eig(np.linalg.solve(S_bar, H_bar))
+        c = np.real(eigenvectors[:, np.argmin(np.real(eigenvalues))])
+        return (c[1:]/c[0], c[1:]/c[0])
+
+    if method == "adam":
+        beta1, beta2 = 0.9, 0.999
+        adam["t"] += 1
+        adam["m"] = beta1*adam["m"] + (1 - beta1)*gradient
+        adam["v"] = beta2*adam["v"] + (1 - beta2)*gradient**2
+        m_hat = adam["m"]/(1 - beta1**adam["t"])
+        v_hat = adam["v"]/(1 - beta2**adam["t"])
+        return (-learning_rate*m_hat/(np.sqrt(v_hat) + 1e-8), learning_rate*gradient/(np.sqrt(v_hat) + 1e-8))
+
+    return (-learning_rate*gradient, -learning_rate*gradient)
+
+
+def optimal_parameters_finder(theta_guess, N_tries, N_walkers, System, method = "sr", learning_rate = None,
+                              N_processes = 1, particle_moves = False, toll = 1e-3, max_count = 100, max_step = 0.5,
+                              max_change = 0.1, N_tries_min = None, min_snr = 2.0, n_sigma = 2.0, trace_file = None,
+                              seed = None, checkpoint_file = None, checkpoint_interval = 60, langevin = False):
+    """ Finds the optimal parameters of the trail wave function for any number of parameters. Every iteration samples the
+        walkers once for the current parameters, with the walkers of the previous iteration as the starting positions, and
+        takes a step with one of the methods of parameter_step:
+
+            gradient:   steepest descent with a fixed learning rate
+            sr:         stochastic reconfiguration, the gradient is scaled with the inverse of S so every parameter takes
+                        a step of the right size, which is close to a Newton step
+            linear:     the linear method, which solves for the best parameters in the space of the first derivatives of ψT
+            adam:       Adam, steepest descent with per parameter step sizes from running averages of the gradient
+
+        The covariance matrices of all parameters are computed from the running sums of the accumulator, so no extra pass
+        over the samples is needed.
+
+        The number of steps of an iteration starts at N_tries_min and grows with the signal to noise ratio of the gradient,
+        |g|/|σg| with σg from accumulator_gradient_error. Far from the minimum the gradient is large and a rough estimate
+        gives the right direction. Since σg² goes as 1/N, the next iteration gets the number of steps for which the ratio
+        would be min_snr, but never fewer steps than before and never more than N_tries. The search stops at N_tries
+        steps when every parameter changes less than toll, or when every component of the gradient is within n_sigma
+        times its error from zero, so the remaining change is noise.
+
+        For sr and linear the change of the wave function of a step, sqrt(Δθ S Δθ), is kept below max_change. S is the
+        metric of the parameter space, so this stops steps along parameters which hardly change ψT, like the Jastrow
+        parameter of Helium, from overshooting. When a step goes back against the previous one the minimum was jumped
+        over, so the steps of all methods except adam, which has its own running averages, are halved from then on.
+
+        Only a summary of every iteration is kept in the history, the local energies of an iteration are dropped after its
+        error and autocorrelation time are computed. If trace_file is given they are appended to that file, and the
+        history gets read only memory maps of the file, so the traces of all iterations do not have to fit in memory.
+
+        Every iteration samples with its own seed, made from seed and the number of the iteration. With a checkpoint_file
+        the state of the search after an iteration is saved every checkpoint_interval seconds: the parameters, the
+        walkers, the running averages of the methods and the history. If the file exists the search continues from it, and
+        makes the same iterations to the last bit as a search which was not stopped, except for the wall clock times. The
+        checkpoint stores the signature of the search, the system, theta_guess, the numbers of steps, walkers and
+        processes, the moves, the method and the seed, and a ValueError is raised if it belongs to another search, see
+        checkpoint_read. The file is removed when the search is finished.
+
+    Parameters
+    ----------
+    theta_guess:            numpy array of the first values of the parameters
+    N_tries:                Number of steps for the walkers to try
+    N_walkers:              Number of random walkers placed
+    System:                 current system. Can choose between: Oscillator, Hydrogen, Helium or Helium2
+    method:                 "gradient", "sr", "linear" or "adam"
+    learning_rate:          step size of the method, None for its default
+    N_processes:            Number of processes the walkers are divided over
+    particle_moves:         set to True to move the electrons one at a time, only for Helium and Helium2
+    toll:                   tollerance of the change of the parameters
+    max_count:              largest number of iterations
+    max_step:               largest change of a parameter in one iteration
+    max_change:             largest change of the normalized wave function in one iteration, for sr and linear
+    N_tries_min:            Number of steps of the first iteration, None for N_tries/10. N_tries for a fixed schedule
+    min_snr:                signal to noise ratio of the gradient the number of steps is grown to
+    n_sigma:                number of errors within which the gradient is taken as zero
+    trace_file:             name of the file the local energies of every iteration are written to, None to keep only
+                            the summaries
+    seed:                   seed of the random number generators, None for a random seed
+    checkpoint_file:        name of the .npz file of the checkpoints, None for no checkpoints
+    checkpoint_interval:    time in seconds between two checkpoints
+    langevin:               set to True to drift the walkers along the quantum force, see metropolis_drift_steps
+
+
+    Returns:
+    --------
+    theta_values:           numpy array (count, N_params) of all the parameters calculated in the process
+    count:                  int; number of iteration neccasary
+    history:                dictionary with a numpy array of length count for every summary of the iterations
+                                E:          mean of the local energy
+                                E_var:      variance of the local energy
+                                E_error:    blocking error of E
+                                tau:        integrated autocorrelation time of the local energy
+                                ess:        effective sample size
+                                seconds:    wall clock time of the sampling
+                                samples:    number of samples
+                                N_tries:    number of steps the walkers tried
+                                E_loc:      list of memory maps (N_steps, N_walkers) of the local energies of every
+                                            iteration if trace_file is given, else None. The burn in and so the number of
+                                            steps can differ between the iterations
+                            and the positions "r_final" (N_walkers, D) of the walkers after the last step of the last
+                            iteration, equilibrated for theta_values[-1]
+
+    """
+
+    default_rates = {"gradient": 0.5, "sr": 0.5, "linear": 1.0, "adam": 0.05}
+    if learning_rate is None:
+        learning_rate = default_rates[method]
+
+    # initializing values with the guess, the walkers are kept between the iterations
+    theta = np.array(theta_guess, dtype = float).reshape(-1)
+    state = None
+    adam = {"m": np.zeros(len(theta)), "v": np.zeros(len(theta)), "t": 0}
+    N_tries_iteration = N_tries//10 if N_tries_min is None else min(N_tries_min, N_tries)
+    damping = 1.0
+    previous_step = None
+
+    # store the values in python lists
+    theta_values = []
+    history = {"E": [], "E_var": [], "E_error": [], "tau": [], "ess": [], "seconds": [], "samples": [], "N_tries": []}
+    trace_shapes = []
+    count = 0
+    finished = False
+    entropy = np.random.SeedSequence(seed).entropy
+
+    # without a given seed the search only continues from the entropy in the checkpoint, so the seed is then left out
+    signature = checkpoint_signature(system = System.__name__, theta_guess = theta_guess, N_tries = N_tries,
+                                     N_walkers = N_walkers, N_processes = N_processes, particle_moves = particle_moves,
+                                     langevin = langevin, method = method, learning_rate = learning_rate,
+                                     N_tries_min = N_tries_min, seed = None if seed is None else entropy)
+
+    checkpoint = checkpoint_read(checkpoint_file, signature)
+    if checkpoint is not None:
+        # continue after the last iteration of the checkpoint
+        entropy = int(str(checkpoint["entropy"]))
+        count = int(checkpoint["count"])
+        theta = checkpoint["theta"]
+        N_tries_iteration, damping = int(checkpoint["N_tries_iteration"]), float(checkpoint["damping"])
+        previous_step = checkpoint["previous_step"] if "previous_step" in checkpoint else None
+        adam = {"m": checkpoint["adam_m"], "v": checkpoint["adam_v"], "t": int(checkpoint["adam_t"])}
+        state = {"r": checkpoint["r"], "step": float(checkpoint["step"])}
+        theta_values = list(checkpoint["theta_values"])
+        for key in history:
+            history[key] = list(checkpoint["history_" + key])
+        trace_shapes = [tuple(shape) for shape in checkpoint["trace_shapes"]]
+
+        # the traces of the iterations after the checkpoint are sampled again
+        if trace_file is not None:
+            os.truncate(trace_file, sum(int(np.prod(shape)) for shape in trace_shapes)*np.dtype(float).itemsize)
+
+    writer = None
+    checkpoint_time = time.time()
+
+    while not finished:
+        run_time = time.time()
+        acc, E_loc, state = deriv_energy_theta(theta, N_tries_iteration, N_walkers, System, N_processes, particle_moves,
+                                               state, linear = method == "linear", seed = [entropy, count],
+                                               langevin = langevin, keep_E_loc = trace_file is not None)
+        run_time = time.time() - run_time
+        E_a, E_var, E_error, _ = accumulator_results(acc)
+        tau_int, ess = accumulator_autocorrelation(acc)
+
+        # Keep track of the summary of every iteration, the local energies only go to the trace file
+        theta_values.append(theta)
+        for key, value in zip(["E", "E_var", "E_error", "tau", "ess", "seconds", "samples", "N_tries"],
+                              [E_a, E_var, E_error, tau_int, ess, run_time, acc["N"], N_tries_iteration]):
+            history[key].append(value)
+
+        if trace_file is not None:
+            with open(trace_file, "wb" if count == 0 else "ab") as file:
+                np.ascontiguousarray(E_loc, dtype = float).tofile(file)
+            trace_shapes.append(E_loc.shape)
+        del E_loc
+
+        gradient, S, H = accumulator_matrices(acc)
+        gradient_error = accumulator_gradient_error(acc)
+
+        print("Iteration: {}, parameters: {}, E: {} +/- {}, tau: {:.2f}, ESS: {:.0f}, samples: {}, gradient: {} +/- {}"
+              .format(count, theta, E_a, E_error, tau_int, ess, acc["N"], gradient, gradient_error))
+
+        step, change = parameter_step(method, gradient, S, H, learning_rate, adam)
+
+        # a step which is too large is scaled down, it can come from the noise of S or H
+        if method in ["sr", "linear"] and np.sqrt(step @ S @ step) > max_change:
+            step = step*max_change/np.sqrt(step @ S @ step)
+        if np.max(np.abs(step)) > max_step:
+            step = step*max_step/np.max(np.abs(step))
+
+        if method != "adam" and previous_step is not None and step @ previous_step < 0:
+            damping = damping/2
+        previous_step = step
+        step = damping*step
+        change = damping*change
+
+        count += 1
+        if count > max_count:
+            print("Too many iterations. Try to adjust learning rate")
+            break
+
+        full = N_tries_iteration == N_tries
+        if full and (np.all(np.abs(change) < toll) or np.all(np.abs(gradient) <= n_sigma*gradient_error)):
+            break
+
+        # the number of steps for which |g|/|σg| would be min_snr, a small change needs the full number of steps to be
+        # trusted
+        g, g_error = np.linalg.norm(gradient), np.linalg.norm(gradient_error)
+        if np.all(np.abs(change) < toll) or g == 0:
+            N_tries_iteration = N_tries
+        else:
+            N_needed = int(np.ceil(N_tries_iteration*(min_snr*g_error/g)**2))
+            N_tries_iteration = min(N_tries, max(N_tries_iteration, N_needed))
+
+        theta = theta + step
+
+        if checkpoint_file is not None and time.time() - checkpoint_time >= checkpoint_interval:
+            writer = checkpoint_write(checkpoint_file, optimizer_checkpoint(signature, entropy, count, theta,
+                                      N_tries_iteration, damping, previous_step, adam, state, theta_values, history,
+                                      trace_shapes), writer)
+            checkpoint_time = time.time()
+
+    # the search is finished, so a search which is started again with the same file starts from the beginning
+    checkpoint_remove(checkpoint_file, writer)
+
+    # convert python list into numpy array for better handeling
+    theta_values = np.array(theta_values)
+    for key in history:
+        history[key] = np.array(history[key])
+    history["E_loc"] = trace_memmaps(trace_file, trace_shapes) if trace_file is not None else None
+    history["r_final"] = state["r"]
+
+    # the samples of an iteration grow with its number of steps, apart from the burn in
+    print("Samples used: {}, a fixed schedule of {} steps would have used about {:.0f}".format(
+          np.sum(history["samples"]), N_tries, np.sum(history["samples"]*N_tries/history["N_tries"])))
+
+    return (theta_values, count, history)
+
+
+def optimizer_checkpoint(signature, entropy, count, theta, N_tries_iteration, damping, previous_step, adam, state,
+                         theta_values, history, trace_shapes):
+    """ Collects the state of optimal_parameters_finder after an iteration as a dictionary of numpy arrays for
+        checkpoint_write, see there for the meaning of the arguments. Everything is copied, so the search can go on while
+        the checkpoint is written. The entropy of the seeds does not fit in an integer array, so it is stored as a string.
+
+    Returns:
+    --------
+    dictionary of numpy arrays
+    """
+
+    arrays = {"signature": signature, "entropy": np.array(str(entropy)), "count": np.array(count),
+              "theta": np.array(theta), "N_tries_iteration": np.array(N_tries_iteration), "damping": np.array(damping),
+              "adam_m": np.array(adam["m"]), "adam_v": np.array(adam["v"]), "adam_t": np.array(adam["t"]),
+              "r": np.array(state["r"]), "step": np.array(state["step"]), "theta_values": np.array(theta_values),
+              "trace_shapes": np.array(trace_shapes, dtype = int).reshape(-1, 2)}
+    if previous_step is not None:
+        arrays["previous_step"] = np.array(previous_step)
+    for key in history:
+        arrays["history_" + key] = np.array(history[key])
+    return arrays
+
+
+def trace_memmaps(trace_file, shapes):
+    """ Opens the local energies written to trace_file by optimal_parameters_finder as read only memory maps, so they are
+        only read from the disk when they are used.
+
+    Parameters
+    ----------
+    trace_file:             name of the file the local energies of the iterations were written to one after the other
+    shapes:                 list of the shape (N_steps, N_walkers) of the local energies of every iteration
+
+
+    Returns:
+    --------
+    list of numpy memory maps of the local energies of every iteration
+    """
+
+    traces = []
+    offset = 0
+    for shape in shapes:
+        traces.append(np.memmap(trace_file, dtype = float, mode = "r", offset = offset, shape = shape))
+        offset += int(np.prod(shape))*np.dtype(float).itemsize
+    return traces
+
+
+def deriv_energy_alpha(alpha, N_tries, N_walkers, System, N_processes = 1, particle_moves = False, state = None):
     """ This function calculates the derivative of the energy with respect to alpha.
 
             dE/dα = 2 (<E_loc dlnψT/dα > − E< dlnψT/dα> ).
 
         dlnψT/dα is the natural logarithm derivative with respect to alpha.
 
+        The walkers start from state, the walkers of the previous call, so only a short warm up is needed when alpha
+        changes a little.
+
 
     Parameters
     ----------
@@ -23,41 +412,36 @@ def deriv_energy_alpha(alpha, N_tries, N_walkers, System):
     N_walkers:              Number of random walkers placed
     N_tries:                Number of steps for the walkers to try
     System:                 current system. Can choose between: Oscillator, Hydrogen or Helium
+    N_processes:            Number of processes the walkers are divided over
+    particle_moves:         set to True to move the electrons one at a time, only for Helium
+    state:                  dictionary with the positions "r" and the width of the trial move "step" of the walkers to
+                            start from, None for random positions
 
 
     Returns:
     --------
     deriv_E:                int; dE/dα the derivative of the enrgy with respect to current alpha
-    E_loc:                  numpy array of the local energy for each position
+    E_loc:                  numpy array (N_steps, N_walkers) of the local energy of every walker after the burn in
     E_a:                    The ground state energy for the alpha
+    state:                  dictionary with the positions and the step of the walkers after the last step
 
     """
 
-    f = lambda R: System.trial_wave_function(alpha, R)
-    rn, accept_rate = metropolis_algorithm(f, N_tries, N_walkers, System.dimension)
-
-    # If system is helium the derivative of the trail wave function also depends on alpha
-    if System == Helium:
-        deriv_wf = System.deriv_wave_function(alpha, rn)
-    else:
-        deriv_wf = System.deriv_wave_function(rn)
-
-
-    E_loc = System.E_loc(alpha, rn)
-    E_a = np.mean(E_loc)
+    acc, E_loc, state = deriv_energy_theta([alpha], N_tries, N_walkers, System, N_processes, particle_moves, state)
+    E_a, E_var, E_error, deriv_E = accumulator_results(acc)
 
-    deriv_E = 2*(np.mean(E_loc*deriv_wf)- E_a*np.mean(deriv_wf))
-    return (deriv_E, E_loc, E_a)
+    return (deriv_E[0], E_loc, E_a, state)
 
 
-def deriv_energy_alpha_beta(alpha, beta, N_tries, N_walkers, System):
+def deriv_energy_alpha_beta(alpha, beta, N_tries, N_walkers, System, N_processes = 1, particle_moves = False,
+                            state = None):
     """ This function calculates the derivative of the energy with respect to alpha and beta.
 
             dE/dα = 2 (<E_loc dlnψT/dα > − E< dlnψT/dα> ).
             dE/dβ = 2 (<E_loc dlnψT/dβ > − E< dlnψT/dβ> ).
 
         dlnψT/dα is the natural logarithm derivative with respect to alpha and likewise dlnψT/dβ is the natural
-        logarithm derivative with respect to beta.
+        logarithm derivative with respect to beta. The walkers start from state, see deriv_energy_alpha.
 
         # NOTE: this function only works for System Helium2
 
@@ -69,36 +453,30 @@ def deriv_energy_alpha_beta(alpha, beta, N_tries, N_walkers, System):
     N_walkers:              Number of random walkers placed
     N_tries:                Number of steps for the walkers to try
     System:                 Current system. This function only works for Helium2
+    N_processes:            Number of processes the walkers are divided over
+    particle_moves:         set to True to move the electrons one at a time
+    state:                  dictionary with the positions "r" and the step "step" of the walkers, None for random positions
 
 
     Returns:
     --------
     deriv_E_alpha:          int; dE/dα the derivative of the energy with respect to current alpha
     deriv_E_beta:           int; dE/dβ the derivative of the energy with respect to current beta
-    E_loc:                  numpy array of the local energy for each position
+    E_loc:                  numpy array (N_steps, N_walkers) of the local energy of every walker after the burn in
     E_a:                    The ground state energy for the alpha and beta
+    state:                  dictionary with the positions and the step of the walkers after the last step
 
     """
 
-    f = lambda R: System.trial_wave_function(alpha, beta, R)
+    acc, E_loc, state = deriv_energy_theta([alpha, beta], N_tries, N_walkers, System, N_processes, particle_moves, state)
+    E_a, E_var, E_error, deriv_E = accumulator_results(acc)
+    deriv_E_alpha, deriv_E_beta = deriv_E
 
-    rn, accept_rate = metropolis_algorithm(f, N_tries, N_walkers, System.dimension)
+    return (deriv_E_alpha, deriv_E_beta, E_loc, E_a, state)
 
 
-    deriv_alpha = System.d_alpha_wave_function(alpha, rn)
-    deriv_beta = System.d_beta_wave_function(rn)
-
-
-    E_loc = System.E_loc(alpha,beta, rn)
-    E_a = np.mean(E_loc)
-
-    deriv_E_alpha = 2*(np.mean(E_loc*deriv_alpha)- E_a*np.mean(deriv_alpha))
-    deriv_E_beta = 2*(np.mean(E_loc*deriv_beta)- E_a*np.mean(deriv_beta))
-
-    return (deriv_E_alpha, deriv_E_beta, E_loc, E_a)
-
-
-def optimal_alpha_beta_finder(alpha_guess, beta_guess, N_tries, N_walkers, System):
+def optimal_alpha_beta_finder(alpha_guess, beta_guess, N_tries, N_walkers, System, N_processes = 1,
+                              particle_moves = False, trace_file = None, checkpoint_file = None):
     """ Uses steepest descent method to gain the optimal value for alpha and beta and thus also the optimal value for the Energy.
         First a guess has to be made for the parameters. Then it calculates the derivative of the energy with respect to the parameters and uses
         that value to obtain a new value for the parameters:
@@ -107,6 +485,7 @@ def optimal_alpha_beta_finder(alpha_guess, beta_guess, N_tries, N_walkers, Syste
             β_new = β_old − γ*(dE/dβ)_old
 
         where gamma is the learningrate. The search stops when α_new - α_old and β_new - β_old is smaller than some tollerance.
+        This is optimal_parameters_finder with the gradient method, see there for the other methods.
 
         # NOTE: This function only works for System Helium2
 
@@ -117,6 +496,10 @@ def optimal_alpha_beta_finder(alpha_guess, beta_guess, N_tries, N_walkers, Syste
     N_walkers:              Number of random walkers placed
     N_tries:                Number of steps for the walkers to try
     System:                 current system. Only Helium2
+    N_processes:            Number of processes the walkers are divided over
+    particle_moves:         set to True to move the electrons one at a time
+    trace_file:             name of the file the local energies are written to, None to keep only the summaries
+    checkpoint_file:        name of the .npz file of the checkpoints to continue a stopped search from, None for none
 
 
     Returns:
@@ -124,65 +507,19 @@ def optimal_alpha_beta_finder(alpha_guess, beta_guess, N_tries, N_walkers, Syste
     alpha_values            numpy array of all the values of alpha calculated in the process
     beta_values:            numpy array of all the values of beta calculated in the process
     count:                  int; number of iteration neccasary
-    Eloc_values:            numpy array of the local energies for each alpha and beta
-    Ea_values:              numpy array of the ground state energy found with the alphas and betas
+    history:                dictionary with the summary of every iteration, see optimal_parameters_finder
 
     """
 
+    theta_values, count, history = optimal_parameters_finder([alpha_guess, beta_guess], N_tries, N_walkers, System,
+                                                             "gradient", 0.4, N_processes, particle_moves,
+                                                             trace_file = trace_file, checkpoint_file = checkpoint_file)
 
-    # initializing values with the guess alpha
-    alpha = alpha_guess
-    beta = beta_guess
-    deriv_E_alpha, deriv_E_beta, E_loc, E_a = deriv_energy_alpha_beta(alpha, beta, N_tries, N_walkers, System )
-
-    # store the values in python lists
-    alpha_values = [alpha]
-    beta_values = [beta]
-    Eloc_values = [E_loc]
-    Ea_values = [E_a]
-
-    # settings for the minimalization algorithm
-    toll = 1e-3
-    learningrate = 0.4
-    count = 0
-    max_count = 100
-
-
-    while True:
-        deriv_E_alpha, deriv_E_beta, E_loc, E_a = deriv_energy_alpha_beta(alpha, beta, N_tries, N_walkers, System )
-        alpha_temp = alpha - learningrate*deriv_E_alpha
-        beta_temp = beta - learningrate*deriv_E_beta
-
-        count += 1
-        if count > max_count:
-            print("Too many iteration. Adjust learning rate")
-            break
-
-        if (np.abs(alpha_temp - alpha) < toll) and (np.abs(beta_temp - beta) < toll):
-            break
-
-        # Simultaneuos update
-        alpha = alpha_temp
-        beta = beta_temp
-
-
-        # Keep track of every value found
-        Eloc_values.append(E_loc)
-        Ea_values.append(E_a)
-        alpha_values.append(alpha)
-        beta_values.append(beta)
-        print("Iteration: {}, alpha: {}, beta: {}".format(count, alpha, beta))
-
-    # convert python list into numpy array for better handeling
-    Eloc_values = np.array(Eloc_values)
-    alpha_values = np.array(alpha_values)
-    Ea_values = np.array(Ea_values)
-    beta_values = np.array(beta_values)
-
-    return (alpha_values, beta_values, count, Eloc_values, Ea_values)
+    return (theta_values[:, 0], theta_values[:, 1], count, history)
 
 
-def optimal_alpha_finder(alpha_guess, N_tries, N_walkers, System):
+def optimal_alpha_finder(alpha_guess, N_tries, N_walkers, System, N_processes = 1, particle_moves = False,
+                         trace_file = None, checkpoint_file = None):
     """ Uses steepest descent method to gain the optimal value for alpha and thus also the optimal value for the Energy.
         First a guess has to be made for the alpha. Then it calculates the derivative of the energy with that alpha and uses
         that value to obtain a new value for alpha:
@@ -190,6 +527,9 @@ def optimal_alpha_finder(alpha_guess, N_tries, N_walkers, System):
                 α_new = α_old − γ*(dE/dα)_old
 
         where gamma is the learningrate. The search stops when α_new - α_old is smaller than some tollerance.
+        Every alpha is evaluated once, and the walkers of the previous iteration are the starting positions of the next
+        one, so after the first iteration only a short warm up is needed. This is optimal_parameters_finder with the
+        gradient method, see there for the other methods.
 
 
     Parameters
@@ -198,56 +538,22 @@ def optimal_alpha_finder(alpha_guess, N_tries, N_walkers, System):
     N_walkers:              Number of random walkers placed
     N_tries:                Number of steps for the walkers to try
     System:                 current system. Can choose between: oscillator, Hydrogen or Helium
+    N_processes:            Number of processes the walkers are divided over
+    particle_moves:         set to True to move the electrons one at a time, only for Helium
+    trace_file:             name of the file the local energies are written to, None to keep only the summaries
+    checkpoint_file:        name of the .npz file of the checkpoints to continue a stopped search from, None for none
 
 
     Returns:
     --------
     alpha_values            numpy array of all the values of alpha calculated in the process
     count:                  int; number of iteration neccasary
-    Eloc_values:            numpy array of the local energies for each alpha
-    Ea_values:              numpy array of the ground state energy found with the alphas
+    history:                dictionary with the summary of every iteration, see optimal_parameters_finder
 
     """
-    # initializing values with the guess alpha
-    alpha = alpha_guess
-    deriv_E, E_loc, E_a = deriv_energy_alpha(alpha_guess, N_tries, N_walkers, System )
 
-    # store the values in python lists
-    alpha_values = [alpha_guess]
-    Eloc_values = [E_loc]
-    Ea_values = [E_a]
-
-    # settings for the minimalization algorithm
-    toll = 1e-3
-    learningrate = 0.5
-    prev_step_size = 1
-    count = 0
-    max_count = 100
-
-
-    while True:
-        deriv_E, E_loc, E_a = deriv_energy_alpha(alpha, N_tries, N_walkers, System )
-        alpha_new = alpha - learningrate*deriv_E
-
-        count += 1
-        if count > max_count:
-            print("Too many iterations. Try to adjust learning rate")
-            break
-
-        if np.abs(alpha_new - alpha) < toll:
-            break
-
-        alpha = alpha_new
-
-        # Keep track of every value found
-        Eloc_values.append(E_loc)
-        Ea_values.append(E_a)
-        alpha_values.append(alpha)
-        print("Iteration: {}, alpha: {}".format(count, alpha))
-
-    # convert python list into numpy array for better handeling
-    Eloc_values = np.array(Eloc_values)
-    alpha_values = np.array(alpha_values)
-    Ea_values = np.array(Ea_values)
+    theta_values, count, history = optimal_parameters_finder([alpha_guess], N_tries, N_walkers, System, "gradient", 0.5,
+                                                             N_processes, particle_moves, trace_file = trace_file,
+                                                             checkpoint_file = checkpoint_file)
 
-    return (alpha_values, count, Eloc_values, Ea_values)
+    return (theta_values[:, 0], count, history)
@@ -1,5 +1,6 @@
 import numpy as np
 """ This file contains the System information about the Harmonic oscillator.
+    All functions are elementwise, so alpha may be an array which broadcasts with r.
 """
 
 # alpha values to compare with Jos Thijsen
@@ -23,7 +24,58 @@ def trial_wave_function(alpha, r):
     --------
     np.exp(-alpha*r**2)
     """
-    return np.exp(-alpha*r**2 )
+    return np.exp(log_wave_function(alpha, r))
+
+
+def log_wave_function(alpha, r):
+    """ Natural logarithm of the trail wave function of the harmonic oscillator. Used by the metropolis algorithm.
+
+    Parameters
+    ----------
+    alpha:          int; parameter of the trail wave function to be vaired
+    r:              numpy array of the position of the oscillator
+
+
+    Returns:
+    --------
+    -alpha*r**2
+    """
+    return -alpha*r**2
+
+
+def grad_log_wave_function(alpha, r):
+    """ Gradient of the natural logarithm of the trail wave function with respect to the position. Used for the drift of
+        the Langevin moves of the metropolis algorithm.
+
+    Parameters
+    ----------
+    alpha:          int; parameter of the trail wave function to be vaired
+    r:              numpy array of the position of the oscillator
+
+
+    Returns:
+    --------
+    -2*alpha*r
+    """
+    return -2*alpha*r
+
+
+def sample_wave_function(alpha, N, rng):
+    """ Draws independent positions from the normalized |ψT|² = exp(-2*alpha*r**2), which is a gaussian with variance
+        1/(4*alpha). Used instead of the metropolis algorithm, so there is no burn in and no autocorrelation.
+
+    Parameters
+    ----------
+    alpha:          int; parameter of the trail wave function to be vaired
+    N:              Number of positions
+    rng:            numpy random Generator
+
+
+    Returns:
+    --------
+    numpy array (N, 1) of the positions
+    """
+    return rng.normal(0, 1/np.sqrt(4*alpha), (N, dimension))
 
 
 def E_loc(alpha, r):
@@ -41,6 +93,22 @@ def E_loc(alpha, r):
     """
     return alpha + (0.5-2*alpha**2)*r**(2)
 
+def deriv_E_loc(alpha, r):
+    """ The derivative of the local energy with respect to alpha. Its mean over |ψT|² is zero, so it is used as a control
+        variate of the energy and for the hamiltonian of the linear method.
+
+    Parameters
+    ----------
+    alpha:          int; parameter of the trail wave function to be varied
+    r:              numpy array of the position of the oscillator
+
+
+    Returns:
+    --------
+    1 - 4*alpha*r**2
+    """
+    return 1 - 4*alpha*r**2
+
 def deriv_wave_function(r):
     """ The derivative of the natural logarithm of the trail wave function. Needed for the minimal alpha finder.
 
@@ -54,3 +122,51 @@ def deriv_wave_function(r):
 
     """
     return -r**2
+
+def local_quantities(alpha, r):
+    """ The trail wave function, local energy and derivative in a single call, like for the other systems.
+
+    Parameters
+    ----------
+    alpha:          int; parameter of the trail wave function to be varied
+    r:              numpy array of the position of the oscillator
+
+    Returns:
+    --------
+    -alpha*r**2, alpha + (0.5-2*alpha**2)*r**(2), -r**2
+
+    """
+    r2 = r**2
+    return (-alpha*r2, alpha + (0.5-2*alpha**2)*r2, -r2)
+
+
+# Parameter vector interface. Every system has these functions with the vector of parameters theta in front, so the
+# samplers and the optimizers do not depend on the number of parameters. theta can also hold arrays which broadcast with
+# r, like a column of alphas of shape (n_alpha, 1, 1) for a batch of chains.
+n_params = 1
+theta_jos = alpha_jos[:, None]
+theta_broad = alpha_broad[:, None]
+
+def log_psi(theta, r):
+    """ ln|ψT| for theta = (alpha,), see log_wave_function. """
+    return log_wave_function(theta[0], r)
+
+def local_energy(theta, r):
+    """ Local energy for theta = (alpha,), see E_loc. """
+    return E_loc(theta[0], r)
+
+def evaluate(theta, r):
+    """ ln|ψT|, E_loc and the (N, n_params) matrix of dlnψT/dθ for theta = (alpha,), see local_quantities. """
+    return local_quantities(theta[0], r)
+
+def grad_log_psi(theta, r):
+    """ Gradient of ln|ψT| with respect to R for theta = (alpha,), see grad_log_wave_function. """
+    return grad_log_wave_function(theta[0], r)
+
+def sample_psi2(theta, N, rng):
+    """ N independent positions from |ψT|² for theta = (alpha,), see sample_wave_function. """
+    return sample_wave_function(theta[0], N, rng)
+
+def deriv_local_energy(theta, r):
+    """ The (N, n_params) matrix of dE_loc/dθ for theta = (alpha,), see deriv_E_loc. """
+    return deriv_E_loc(theta[0], r)
@@ -1,5 +1,6 @@
 import numpy as np
 """ This file contains the System information about the Hydrogen atom.
+    The norm is taken over the last axis of r, so alpha may be an array which broadcasts with the leading axes.
 """
 
 # alpha values to compare with Jos Thijsen
@@ -23,8 +24,61 @@ def trial_wave_function(alpha, r):
     --------
     np.exp(-alpha*r)
     """
-    r = np.linalg.norm(r, axis = 1, keepdims = True)
-    return np.exp(-alpha*r)
+    return np.exp(log_wave_function(alpha, r))
+
+def log_wave_function(alpha, r):
+    """ Natural logarithm of the trail wave function of the Hydrogen atom. Used by the metropolis algorithm.
+
+    Parameters
+    ----------
+    alpha:          int; parameter of the trail wave function to be varied
+    r:              numpy array of the position of the electron orbiting the atom
+
+
+    Returns:
+    --------
+    -alpha*r
+    """
+    r = np.linalg.norm(r, axis = -1, keepdims = True)
+    return -alpha*r
+
+def grad_log_wave_function(alpha, r):
+    """ Gradient of the natural logarithm of the trail wave function with respect to the position of the electron. Used
+        for the drift of the Langevin moves of the metropolis algorithm.
+
+    Parameters
+    ----------
+    alpha:          int; parameter of the trail wave function to be varied
+    r:              numpy array of the position of the electron orbiting the atom
+
+
+    Returns:
+    --------
+    -alpha*r/|r|
+    """
+    return -alpha*r/np.linalg.norm(r, axis = -1, keepdims = True)
+
+def sample_wave_function(alpha, N, rng):
+    """ Draws independent positions from the normalized |ψT|² = exp(-2*alpha*r). In spherical coordinates the density of
+        the radius is r**2 exp(-2*alpha*r), a gamma distribution with shape 3 and scale 1/(2*alpha), and the direction is
+        uniform, which is the direction of a gaussian vector. Used instead of the metropolis algorithm, so there is no
+        burn in and no autocorrelation.
+
+    Parameters
+    ----------
+    alpha:          int; parameter of the trail wave function to be varied
+    N:              Number of positions
+    rng:            numpy random Generator
+
+
+    Returns:
+    --------
+    numpy array (N, 3) of the positions of the electron
+    """
+    radius = rng.gamma(3, 1/(2*alpha), (N, 1))
+    direction = rng.standard_normal((N, dimension))
+    return radius*direction/np.linalg.norm(direction, axis = -1, keepdims = True)
+
 
 def E_loc(alpha, r):
     """ Local Energy of the Hydrogen atom.
@@ -39,9 +93,26 @@ def E_loc(alpha, r):
     --------
     -1/r - 0.5*alpha*(alpha -2/r)
     """
-    r = np.linalg.norm(r, axis = 1, keepdims = True)
+    r = np.linalg.norm(r, axis = -1, keepdims = True)
     return (-1/r - 0.5*alpha*(alpha -2/r))
 
+def deriv_E_loc(alpha, r):
+    """ The derivative of the local energy with respect to alpha. Its mean over |ψT|² is zero, so it is used as a control
+        variate of the energy and for the hamiltonian of the linear method.
+
+    Parameters
+    ----------
+    alpha:          int; parameter of the trail wave function to be varied
+    r:              numpy array of the position of the electron orbiting the atom
+
+
+    Returns:
+    --------
+    -alpha + 1/r
+    """
+    r = np.linalg.norm(r, axis = -1, keepdims = True)
+    return -alpha + 1/r
+
 def deriv_wave_function(r):
     """ The derivative of the natural logarithm of the trail wave function. Needed for the minimal alpha finder.
 
@@ -54,5 +125,53 @@ def deriv_wave_function(r):
     -r
 
     """
-    r = np.linalg.norm(r, axis = 1, keepdims = True)
+    r = np.linalg.norm(r, axis = -1, keepdims = True)
     return -r
+
+def local_quantities(alpha, r):
+    """ The trail wave function, local energy and derivative in a single call, the norm of r is only taken once.
+
+    Parameters
+    ----------
+    alpha:          int; parameter of the trail wave function to be varied
+    r:              numpy array of the position of the electron orbiting the atom
+
+    Returns:
+    --------
+    -alpha*r, -1/r - 0.5*alpha*(alpha -2/r), -r
+
+    """
+    r = np.linalg.norm(r, axis = -1, keepdims = True)
+    return (-alpha*r, -1/r - 0.5*alpha*(alpha -2/r), -r)
+
+
+# Parameter vector interface. Every system has these functions with the vector of parameters theta in front, so the
+# samplers and the optimizers do not depend on the number of parameters. theta can also hold arrays which broadcast with
+# r, like a column of alphas of shape (n_alpha, 1, 1) for a batch of chains.
+n_params = 1
+theta_jos = alpha_jos[:, None]
+theta_broad = alpha_broad[:, None]
+
+def log_psi(theta, r):
+    """ ln|ψT| for theta = (alpha,), see log_wave_function. """
+    return log_wave_function(theta[0], r)
+
+def local_energy(theta, r):
+    """ Local energy for theta = (alpha,), see E_loc. """
+    return E_loc(theta[0], r)
+
+def evaluate(theta, r):
+    """ ln|ψT|, E_loc and the (N, n_params) matrix of dlnψT/dθ for theta = (alpha,), see local_quantities. """
+    return local_quantities(theta[0], r)
+
+def grad_log_psi(theta, r):
+    """ Gradient of ln|ψT| with respect to R for theta = (alpha,), see grad_log_wave_function. """
+    return grad_log_wave_function(theta[0], r)
+
+def sample_psi2(theta, N, rng):
+    """ N independent positions from |ψT|² for theta = (alpha,), see sample_wave_function. """
+    return sample_wave_function(theta[0], N, rng)
+
+def deriv_local_energy(theta, r):
+    """ The (N, n_params) matrix of dE_loc/dθ for theta = (alpha,), see deriv_E_loc. """
+    return deriv_E_loc(theta[0], r)
@@ -1,5 +1,7 @@
 import numpy as np
 """ This file contains the System information about the Helium atom.
+    The functions work on the last axis of r, so a batch of walkers of shape (n_alpha, N_walkers, 6) can be evaluated
+    for a vector of alphas of shape (n_alpha, 1, 1) at once.
 """
 
 # alpha values to compare with Jos Thijsen
@@ -10,6 +12,38 @@ alpha_broad = np.arange(0.05, 0.25, 0.015)
 
 dimension = 6
 
+def geometry(r):
+    """ Computes the distances of a batch of positions once, so they can be shared by the trail wave function, the local
+        energy and the derivatives instead of every function taking the norms again.
+
+    Parameters
+    ----------
+    r:              matrix of shape (N, 6) of the positions of both electrons
+
+
+    Returns:
+    --------
+    geo:            dictionary with
+                        r1, r2:             (N, 1) distances between the proton and electron 1 and 2
+                        r12:                (N, 1) distance between the electrons
+                        r1_unit, r2_unit:   (N, 3) unit vectors of the electrons
+                        r1dotr2:            (N, 1) inner product of the positions of the electrons
+    """
+    r1_vec = r[..., :3]
+    r2_vec = r[..., 3:]
+
+    r1 = np.linalg.norm(r1_vec, axis = -1, keepdims = True)
+    r2 = np.linalg.norm(r2_vec, axis = -1, keepdims = True)
+    r12 = np.linalg.norm(r1_vec - r2_vec, axis = -1, keepdims = True)
+
+    geo = {"r1": r1, "r2": r2, "r12": r12, "r1_unit": r1_vec/r1, "r2_unit": r2_vec/r2,
+           "r1dotr2": np.sum(r1_vec*r2_vec, axis = -1, keepdims = True)}
+    return geo
+
+def as_geometry(r):
+    """ Returns r if it already is a geometry from geometry(r), else computes it. """
+    return r if isinstance(r, dict) else geometry(r)
+
 def trial_wave_function(alpha, r):
     """ Trail wave function of the Helium atom.
 
@@ -29,12 +63,96 @@ def trial_wave_function(alpha, r):
     Trail wave function with 3 variables
 
     """
-    r1 = np.linalg.norm(r[:,:3], axis = 1, keepdims = True)
-    r2 = np.linalg.norm(r[:,3:], axis = 1, keepdims = True)
-    r12 =  np.linalg.norm(r[:, :3]-r[:, 3:], axis = 1, keepdims = True)
+    return np.exp(log_wave_function(alpha, r))
+
+def log_wave_function(alpha, r):
+    """ Natural logarithm of the trail wave function of the Helium atom. Used by the metropolis algorithm, working with
+        the logarithm prevents the product of the exponentials from underflowing.
+
+    Parameters
+    ----------
+    alpha:          int; parameter of the trail wave function to be varied
+    r:              matrix of shape (N_tries*N_walkers-N_walkers*4000) x 6, or its geometry from geometry(r)
+                     N_tries , number of steps
+                     N_walkers , number of walkers
+                     :3 x (N*n_walkers-n_walkers*4000) , distance between proton and electron 1
+                     3: x (N*n_walkers-n_walkers*4000) , distance between proton and electron 2
+
+
+
+    Returns:
+    --------
+    -2*r1 - 2*r2 + r12/(2*(1+alpha*r12))
+
+    """
+    # the metropolis algorithm only needs the distances, so the full geometry is not computed here
+    if isinstance(r, dict):
+        r1, r2, r12 = r["r1"], r["r2"], r["r12"]
+    else:
+        r1 = np.linalg.norm(r[..., :3], axis = -1, keepdims = True)
+        r2 = np.linalg.norm(r[..., 3:], axis = -1, keepdims = True)
+        r12 =  np.linalg.norm(r[..., :3]-r[..., 3:], axis = -1, keepdims = True)
+
+    log_wf = -2*r1 - 2*r2 + r12/(2*(1+alpha*r12))
+    return log_wf
+
+def log_wave_function_particle(alpha, r, k, r_k):
+    """ Natural logarithm of the factors of the trail wave function which depend on electron k, with electron k placed at
+        r_k. Only the distances to the proton and the other electron are computed, which is all the metropolis algorithm
+        needs for the ratio when a single electron is moved.
+
+    Parameters
+    ----------
+    alpha:          int; parameter of the trail wave function to be varied
+    r:              matrix of shape (N_walkers, 6) of the current positions of both electrons
+    k:              int; electron which is moved, 0 or 1
+    r_k:            matrix of shape (N_walkers, 3) of the position of electron k
+
+
+    Returns:
+    --------
+    -2*rk + r12/(2*(1+alpha*r12))
+
+    """
+    r_other = r[..., 3:] if k == 0 else r[..., :3]
+
+    rk = np.linalg.norm(r_k, axis = -1, keepdims = True)
+    r12 = np.linalg.norm(r_k - r_other, axis = -1, keepdims = True)
+
+    return -2*rk + r12/(2*(1+alpha*r12))
+
+
+def grad_log_wave_function(alpha, r):
+    """ Gradient of the natural logarithm of the trail wave function with respect to the positions of both electrons. Used
+        for the drift of the Langevin moves of the metropolis algorithm. With r12_unit = (r1 - r2)/r12 the Jastrow factor
+        pulls the electrons apart:
+
+            ∇1 ln ψT = -2 r1_unit + r12_unit/(2(1 + alpha*r12)²)
+            ∇2 ln ψT = -2 r2_unit - r12_unit/(2(1 + alpha*r12)²)
+
+    Parameters
+    ----------
+    alpha:          int; parameter of the trail wave function to be varied
+    r:              matrix of shape (N, 6) of the positions of both electrons, or its geometry from geometry(r)
+
+
+    Returns:
+    --------
+    matrix of shape (N, 6) of the gradient for electron 1 and 2
+
+    """
+    return grad_log_jastrow(alpha, 2, r)
+
+def grad_log_jastrow(alpha, beta, r):
+    """ Gradient of -beta*(r1 + r2) + r12/(2*(1+alpha*r12)) with respect to the positions of both electrons, which is
+        ∇ ln ψT of Helium for beta = 2 and of Helium2 for a variable beta. See grad_log_wave_function.
+    """
+    geo = as_geometry(r)
+    r12_unit = (geo["r1_unit"]*geo["r1"] - geo["r2_unit"]*geo["r2"])/geo["r12"]
+    jastrow = r12_unit/(2*(1 + alpha*geo["r12"])**2)
+
+    return np.concatenate((-beta*geo["r1_unit"] + jastrow, -beta*geo["r2_unit"] - jastrow), axis = -1)
 
-    wf = np.exp(-2*r1)*np.exp(-2*r2)*np.exp(r12/(2*(1+alpha*r12)))
-    return wf
 
 def E_loc(alpha, r):
     """ Local Energy of the Helium atom.
@@ -42,7 +160,7 @@ def E_loc(alpha, r):
     Parameters
     ----------
     alpha:          int; parameter of the trail wave function to be varied
-    r:              matrix of shape (N_tries*N_walkers-N_walkers*4000) x 6
+    r:              matrix of shape (N_tries*N_walkers-N_walkers*4000) x 6, or its geometry from geometry(r)
                      N_tries , number of steps
                      N_walkers , number of walkers
                      :3 x (N*n_walkers-n_walkers*4000) , distance between proton and electron 1
@@ -55,16 +173,39 @@ def E_loc(alpha, r):
     E_loc:          local energy for the positions of the electrons
 
     """
-    r1_unit = r[:,:3] / np.linalg.norm(r[:, :3], axis = 1, keepdims = True)
+    geo = as_geometry(r)
+    r12 = geo["r12"]
 
-    r2_unit = r[:,3:] / np.linalg.norm(r[:, 3:], axis = 1, keepdims = True)
-    r12_unit = r1_unit - r2_unit
-    r12 = np.linalg.norm(r[:, :3] - r[:, 3:], axis = 1, keepdims = True)
+    # (r1_unit - r2_unit).(r1 - r2) = (r1 + r2)(1 - r1.r2/(r1*r2))
+    r12_unit_dot = (geo["r1"] + geo["r2"])*(1 - geo["r1dotr2"]/(geo["r1"]*geo["r2"]))
 
-    E_loc = -4 + np.sum(r12_unit * (r[:, :3] - r[:, 3:]), axis = 1, keepdims = True) * 1/(r12*(1+alpha*r12)**2) - 1/(r12*(1+alpha*r12)**3) - 1/(4*(1+alpha*r12)**4) + 1/r12
+    E_loc = -4 + r12_unit_dot * 1/(r12*(1+alpha*r12)**2) - 1/(r12*(1+alpha*r12)**3) - 1/(4*(1+alpha*r12)**4) + 1/r12
     return E_loc
 
 
+def deriv_E_loc(alpha, r):
+    """ The derivative of the local energy with respect to alpha. Its mean over |ψT|² is zero, so it is used as a control
+        variate of the energy and for the hamiltonian of the linear method.
+
+    Parameters
+    ----------
+    alpha:          int; parameter of the trail wave function to be varied
+    r:              matrix of shape (N, 6) of the positions of both electrons, or its geometry from geometry(r)
+
+
+    Returns:
+    --------
+    dE_loc:         -2*r12_unit_dot/(1 + alpha*r12)**3 + 3/(1 + alpha*r12)**4 + r12/(1 + alpha*r12)**5
+
+    """
+    geo = as_geometry(r)
+    r12 = geo["r12"]
+    r12_unit_dot = (geo["r1"] + geo["r2"])*(1 - geo["r1dotr2"]/(geo["r1"]*geo["r2"]))
+
+    u = 1 + alpha*r12
+    return -2*r12_unit_dot/u**3 + 3/u**4 + r12/u**5
+
+
 def deriv_wave_function(alpha, r):
     """ The derivative of the natural logarithm of the trail wave function with respec to alpha.
         Needed for the optimal alpha finder.
@@ -72,7 +213,7 @@ def deriv_wave_function(alpha, r):
     Parameters
     ----------
     alpha:          int; parameter of the trail wave function to be varied
-    r:              matrix of shape (N_tries*N_walkers-N_walkers*4000) x 6
+    r:              matrix of shape (N_tries*N_walkers-N_walkers*4000) x 6, or its geometry from geometry(r)
                      N_tries , number of steps
                      N_walkers , number of walkers
                      :3 x (N*n_walkers-n_walkers*4000) , distance between proton and electron 1
@@ -85,6 +226,67 @@ def deriv_wave_function(alpha, r):
     dwf:          r12**2/(-2*(1 + alpha*r12)**2)
 
     """
-    r12 =  np.linalg.norm(r[:, :3]-r[:, 3:], axis = 1, keepdims = True)
+    if isinstance(r, dict):
+        r12 = r["r12"]
+    else:
+        r12 =  np.linalg.norm(r[..., :3]-r[..., 3:], axis = -1, keepdims = True)
+
     dwf = r12**2/(-2*(1 + alpha*r12)**2)
     return dwf
+
+
+def local_quantities(alpha, r):
+    """ Fused kernel which computes the geometry of a batch of positions once and returns everything the sampler and the
+        optimizer need from it.
+
+    Parameters
+    ----------
+    alpha:          int; parameter of the trail wave function to be varied
+    r:              matrix of shape (N_tries*N_walkers-N_walkers*4000) x 6
+                     N_tries , number of steps
+                     N_walkers , number of walkers
+                     :3 x (N*n_walkers-n_walkers*4000) , distance between proton and electron 1
+                     3: x (N*n_walkers-n_walkers*4000) , distance between proton and electron 2
+
+
+    Returns:
+    --------
+    log_wf:         ln of the trail wave function
+    E_loc:          local energy for the positions of the electrons
+    dwf:            dlnψT/dα
+
+    """
+    geo = geometry(r)
+    return (log_wave_function(alpha, geo), E_loc(alpha, geo), deriv_wave_function(alpha, geo))
+
+
+# Parameter vector interface. Every system has these functions with the vector of parameters theta in front, so the
+# samplers and the optimizers do not depend on the number of parameters. theta can also hold arrays which broadcast with
+# r, like a column of alphas of shape (n_alpha, 1, 1) for a batch of chains.
+n_params = 1
+theta_jos = alpha_jos[:, None]
+theta_broad = alpha_broad[:, None]
+
+def log_psi(theta, r):
+    """ ln|ψT| for theta = (alpha,), see log_wave_function. """
+    return log_wave_function(theta[0], r)
+
+def local_energy(theta, r):
+    """ Local energy for theta = (alpha,), see E_loc. """
+    return E_loc(theta[0], r)
+
+def evaluate(theta, r):
+    """ ln|ψT|, E_loc and the (N, n_params) matrix of dlnψT/dθ for theta = (alpha,), see local_quantities. """
+    return local_quantities(theta[0], r)
+
+def log_psi_particle(theta, r, k, r_k):
+    """ ln of the factors of ψT which depend on electron k for theta = (alpha,), see log_wave_function_particle. """
+    return log_wave_function_particle(theta[0], r, k, r_k)
+
+def grad_log_psi(theta, r):
+    """ Gradient of ln|ψT| with respect to R for theta = (alpha,), see grad_log_wave_function. """
+    return grad_log_wave_function(theta[0], r)
+
+def deriv_local_energy(theta, r):
+    """ The (N, n_params) matrix of dE_loc/dθ for theta = (alpha,), see deriv_E_loc. """
+    return deriv_E_loc(theta[0], r)
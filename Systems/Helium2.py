@@ -1,7 +1,11 @@
 import numpy as np
 
+from Systems.Helium import geometry, as_geometry, grad_log_jastrow
+
 """ This file contains the System information about the Helium atom with 2 variational parameters alpha and beta.
-    This file can only be used with optimal_energy_helium_2_parameters.py file
+    Through the parameter vector interface at the end of the file it can be used by all scripts.
+    The positions can have extra leading axes, e.g. (n_alpha, N_walkers, 6), with alpha and beta broadcasting over them.
+    The functions also accept the geometry of the positions, see Helium.geometry, so it can be shared between them.
 """
 
 dimension = 6
@@ -26,12 +30,85 @@ def trial_wave_function(alpha, beta, r):
     Trail wave function with 4 variables
 
     """
-    r1 = np.linalg.norm(r[:,:3], axis = 1, keepdims = True)
-    r2 = np.linalg.norm(r[:,3:], axis = 1, keepdims = True)
-    r12 =  np.linalg.norm(r[:, :3]-r[:, 3:], axis = 1, keepdims = True)
+    return np.exp(log_wave_function(alpha, beta, r))
+
+def log_wave_function(alpha, beta, r):
+    """ Natural logarithm of the trail wave function of the Helium atom. Used by the metropolis algorithm, working with
+        the logarithm prevents the product of the exponentials from underflowing for large beta.
+
+    Parameters
+    ----------
+    alpha:          int; parameter of the trail wave function to be varied
+    beta:           int; parameter of the trail wave function to be varied
+    r:              matrix of shape (N_tries*N_walkers-N_walkers*4000) x 6, or its geometry from geometry(r)
+                     N_tries , number of steps
+                     N_walkers , number of walkers
+                     :3 x (N*n_walkers-n_walkers*4000) , distance between proton and electron 1
+                     3: x (N*n_walkers-n_walkers*4000) , distance between proton and electron 2
+
+
+
+    Returns:
+    --------
+    -beta*(r1 + r2) + r12/(2*(1+alpha*r12))
+
+    """
+    # the metropolis algorithm only needs the distances, so the full geometry is not computed here
+    if isinstance(r, dict):
+        r1, r2, r12 = r["r1"], r["r2"], r["r12"]
+    else:
+        r1 = np.linalg.norm(r[..., :3], axis = -1, keepdims = True)
+        r2 = np.linalg.norm(r[..., 3:], axis = -1, keepdims = True)
+        r12 =  np.linalg.norm(r[..., :3]-r[..., 3:], axis = -1, keepdims = True)
+
+    log_wf = -beta*(r1 + r2) + r12/(2*(1+alpha*r12))
+    return log_wf
+
+def log_wave_function_particle(alpha, beta, r, k, r_k):
+    """ Natural logarithm of the factors of the trail wave function which depend on electron k, with electron k placed at
+        r_k. Only the distances to the proton and the other electron are computed, which is all the metropolis algorithm
+        needs for the ratio when a single electron is moved.
+
+    Parameters
+    ----------
+    alpha:          int; parameter of the trail wave function to be varied
+    beta:           int; parameter of the trail wave function to be varied
+    r:              matrix of shape (N_walkers, 6) of the current positions of both electrons
+    k:              int; electron which is moved, 0 or 1
+    r_k:            matrix of shape (N_walkers, 3) of the position of electron k
+
+
+    Returns:
+    --------
+    -beta*rk + r12/(2*(1+alpha*r12))
+
+    """
+    r_other = r[..., 3:] if k == 0 else r[..., :3]
+
+    rk = np.linalg.norm(r_k, axis = -1, keepdims = True)
+    r12 = np.linalg.norm(r_k - r_other, axis = -1, keepdims = True)
+
+    return -beta*rk + r12/(2*(1+alpha*r12))
+
+
+def grad_log_wave_function(alpha, beta, r):
+    """ Gradient of the natural logarithm of the trail wave function with respect to the positions of both electrons. Used
+        for the drift of the Langevin moves of the metropolis algorithm, see Helium.grad_log_wave_function.
+
+    Parameters
+    ----------
+    alpha:          int; parameter of the trail wave function to be varied
+    beta:           int; parameter of the trail wave function to be varied
+    r:              matrix of shape (N, 6) of the positions of both electrons, or its geometry from geometry(r)
+
+
+    Returns:
+    --------
+    matrix of shape (N, 6) of the gradient for electron 1 and 2
+
+    """
+    return grad_log_jastrow(alpha, beta, r)
 
-    wf = np.exp(-beta*(r1 + r2))*np.exp(r12/(2*(1+alpha*r12)))
-    return wf
 
 def E_loc(alpha, beta, r):
     """ Local Energy of the Helium atom.
@@ -40,7 +117,7 @@ def E_loc(alpha, beta, r):
     ----------
     alpha:          int; parameter of the trail wave function to be varied
     beta:           int; parameter of the trail wave function to be varied
-    r:              matrix of shape (N_tries*N_walkers-N_walkers*4000) x 6
+    r:              matrix of shape (N_tries*N_walkers-N_walkers*4000) x 6, or its geometry from geometry(r)
                      N_tries , number of steps
                      N_walkers , number of walkers
                      :3 x (N*n_walkers-n_walkers*4000) , distance between proton and electron 1
@@ -57,10 +134,8 @@ def E_loc(alpha, beta, r):
     # for helium Z = 2
     Z = 2
 
-    r1 = np.linalg.norm(r[:,:3], axis = 1, keepdims = True)
-    r2 = np.linalg.norm(r[:,3:], axis = 1, keepdims = True)
-    r12 =  np.linalg.norm(r[:, :3]-r[:, 3:], axis = 1, keepdims = True)
-    rdot12 = np.sum(r[:, :3]*r[:, 3:], axis = 1, keepdims = True)
+    geo = as_geometry(r)
+    r1, r2, r12, rdot12 = geo["r1"], geo["r2"], geo["r12"], geo["r1dotr2"]
 
     El1 = (beta - Z)*(1/r1 + 1/r2) + 1/r12 - beta**2
     El2 = 1/(2*(1+ alpha*r12)**2)
@@ -71,6 +146,36 @@ def E_loc(alpha, beta, r):
 
     return E_loc
 
+def deriv_E_loc(alpha, beta, r):
+    """ The derivatives of the local energy with respect to alpha and beta as the columns of a single array. Their mean
+        over |ψT|² is zero, so they are used as control variates of the energy and for the hamiltonian of the linear method.
+
+    Parameters
+    ----------
+    alpha:          int; parameter of the trail wave function to be varied
+    beta:           int; parameter of the trail wave function to be varied
+    r:              matrix of shape (N, 6) of the positions of both electrons, or its geometry from geometry(r)
+
+
+    Returns:
+    --------
+    dE_loc:         matrix of shape (N, 2) with dE_loc/dα and dE_loc/dβ
+
+    """
+
+    geo = as_geometry(r)
+    r1, r2, r12, rdot12 = geo["r1"], geo["r2"], geo["r12"], geo["r1dotr2"]
+
+    u = 1 + alpha*r12
+    r12_unit_dot = (r1 + r2)*(1 - rdot12/(r1*r2))
+    El3 = beta*r12_unit_dot/r12 - 1/(2*u**2) - 2/r12 + 2*alpha/u
+
+    # E_loc = El1 + El2*El3 with El2 = 1/(2u²), only El2 and El3 depend on alpha
+    dE_alpha = -r12/u**3*El3 + (r12/u**3 + 2/u**2)/(2*u**2)
+    dE_beta = 1/r1 + 1/r2 - 2*beta + r12_unit_dot/(2*r12*u**2)
+
+    return np.concatenate((dE_alpha, dE_beta), axis = -1)
+
 def d_alpha_wave_function(alpha, r):
     """ The derivative of the natural logarithm of the trail wave function with respect to alpha.
         Needed for the optimal alpha beta finder.
@@ -78,7 +183,7 @@ def d_alpha_wave_function(alpha, r):
     Parameters
     ----------
     alpha:          int; parameter of the trail wave function to be varied
-    r:              matrix of shape (N_tries*N_walkers-N_walkers*4000) x 6
+    r:              matrix of shape (N_tries*N_walkers-N_walkers*4000) x 6, or its geometry from geometry(r)
                      N_tries , number of steps
                      N_walkers , number of walkers
                      :3 x (N*n_walkers-n_walkers*4000) , distance between proton and electron 1
@@ -91,7 +196,11 @@ def d_alpha_wave_function(alpha, r):
     dwf:          r12**2/(-2*(1 + alpha*r12)**2)
 
     """
-    r12 =  np.linalg.norm(r[:, :3]-r[:, 3:], axis = 1, keepdims = True)
+    if isinstance(r, dict):
+        r12 = r["r12"]
+    else:
+        r12 =  np.linalg.norm(r[..., :3]-r[..., 3:], axis = -1, keepdims = True)
+
     dwf = r12**2/(-2*(1 + alpha*r12)**2)
     return dwf
 
@@ -102,7 +211,7 @@ def d_beta_wave_function( r):
     Parameters
     ----------
     alpha:          int; parameter of the trail wave function to be varied
-    r:              matrix of shape (N_tries*N_walkers-N_walkers*4000) x 6
+    r:              matrix of shape (N_tries*N_walkers-N_walkers*4000) x 6, or its geometry from geometry(r)
                      N_tries , number of steps
                      N_walkers , number of walkers
                      :3 x (N*n_walkers-n_walkers*4000) , distance between proton and electron 1
@@ -115,7 +224,85 @@ def d_beta_wave_function( r):
     dwf:          -(r1 + r2)
 
     """
-    r1 = np.linalg.norm(r[:,:3], axis = 1, keepdims = True)
-    r2 = np.linalg.norm(r[:,3:], axis = 1, keepdims = True)
+    if isinstance(r, dict):
+        r1, r2 = r["r1"], r["r2"]
+    else:
+        r1 = np.linalg.norm(r[..., :3], axis = -1, keepdims = True)
+        r2 = np.linalg.norm(r[..., 3:], axis = -1, keepdims = True)
+
     dwf = -(r1 + r2)
     return dwf
+
+def deriv_wave_function(alpha, beta, r):
+    """ The derivatives of the natural logarithm of the trail wave function with respect to alpha and beta as the columns
+        of a single array. Needed for the optimal alpha beta finder.
+
+    Parameters
+    ----------
+    alpha:          int; parameter of the trail wave function to be varied
+    beta:           int; parameter of the trail wave function to be varied
+    r:              matrix of shape (N_tries*N_walkers-N_walkers*4000) x 6
+
+
+    Returns:
+    --------
+    dwf:          matrix of shape (N_tries*N_walkers-N_walkers*4000) x 2 with dlnψT/dα and dlnψT/dβ
+
+    """
+    return np.concatenate((d_alpha_wave_function(alpha, r), d_beta_wave_function(r)), axis = -1)
+
+
+def local_quantities(alpha, beta, r):
+    """ Fused kernel which computes the geometry of a batch of positions once and uses it for the trail wave function, the
+        local energy and both derivatives, instead of every function taking the norms of the whole batch again.
+
+    Parameters
+    ----------
+    alpha:          int; parameter of the trail wave function to be varied
+    beta:           int; parameter of the trail wave function to be varied
+    r:              matrix of shape (N, 6) of the positions of both electrons
+
+
+    Returns:
+    --------
+    log_wf:         ln of the trail wave function
+    E_loc:          local energy for the positions of the electrons
+    dwf:            matrix of shape (N, 2) with dlnψT/dα and dlnψT/dβ
+
+    """
+    geo = geometry(r)
+    dwf = np.concatenate((d_alpha_wave_function(alpha, geo), d_beta_wave_function(geo)), axis = -1)
+    return (log_wave_function(alpha, beta, geo), E_loc(alpha, beta, geo), dwf)
+
+
+# Parameter vector interface with theta = (alpha, beta), see Systems/Helium.py. The scans vary alpha with beta close to
+# its optimal value.
+n_params = 2
+alpha_jos = np.arange(0.05, 0.25, 0.025)
+alpha_broad = np.arange(0.05, 0.25, 0.015)
+theta_jos = np.column_stack((alpha_jos, np.full(len(alpha_jos), 1.85)))
+theta_broad = np.column_stack((alpha_broad, np.full(len(alpha_broad), 1.85)))
+
+def log_psi(theta, r):
+    """ ln|ψT| for theta = (alpha, beta), see log_wave_function. """
+    return log_wave_function(theta[0], theta[1], r)
+
+def local_energy(theta, r):
+    """ Local energy for theta = (alpha, beta), see E_loc. """
+    return E_loc(theta[0], theta[1], r)
+
+def evaluate(theta, r):
+    """ ln|ψT|, E_loc and the (N, 2) matrix of dlnψT/dα and dlnψT/dβ for theta = (alpha, beta), see local_quantities. """
+    return local_quantities(theta[0], theta[1], r)
+
+def log_psi_particle(theta, r, k, r_k):
+    """ ln of the factors of ψT which depend on electron k for theta = (alpha, beta), see log_wave_function_particle. """
+    return log_wave_function_particle(theta[0], theta[1], r, k, r_k)
+
+def grad_log_psi(theta, r):
+    """ Gradient of ln|ψT| with respect to R for theta = (alpha, beta), see grad_log_wave_function. """
+    return grad_log_wave_function(theta[0], theta[1], r)
+
+def deriv_local_energy(theta, r):
+    """ The (N, n_params) matrix of dE_loc/dθ for theta = (alpha, beta), see deriv_E_loc. """
+    return deriv_E_loc(theta[0], theta[1], r)
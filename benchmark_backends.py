@@ -0,0 +1,49 @@
+import numpy as np
+import time
+from functools import partial
+
+from Functions.metropolis import *
+from Functions.metropolis_jit import jit_available
+import Systems.HarmonicOscillator  as Oscillator
+import Systems.Hatom as Hydrogen
+import Systems.Helium as Helium
+
+""" This file compares the time taken by the numpy and the numba backend of the metropolis algorithm for the Harmonic
+    Oscillator, the Hydrogen atom and the Helium atom. Both backends get the same seed, so the chains are also checked to
+    be the same. The first run of the numba backend compiles the kernel and is not timed.
+
+    See below for simulation parameters
+"""
+
+
+def benchmark(System, alpha, N_tries, N_walkers, N_repeat, seed = 1):
+    f = partial(System.log_psi, [alpha])
+    D = System.dimension
+
+    # compile the kernel before timing
+    metropolis_algorithm(f, 4100, N_walkers, D, seed = seed, backend = "numba")
+
+    times = {}
+    chains = {}
+    for backend in ["numpy", "numba"]:
+        start = time.time()
+        for i in range(N_repeat):
+            chains[backend], rate = metropolis_algorithm(f, N_tries, N_walkers, D, seed = seed, backend = backend)
+        times[backend] = (time.time() - start)/N_repeat
+
+    same = np.array_equal(chains["numpy"], chains["numba"])
+    print(f"{System.__name__:28s} numpy : {times['numpy']:.3f} s   numba : {times['numba']:.3f} s   "
+          f"speed up : {times['numpy']/times['numba']:.1f}   same chain : {same}")
+
+# Simulation parameters
+N_tries = 30000
+N_walkers = 400
+N_repeat = 3
+systems = [(Oscillator, 0.5), (Hydrogen, 1.0), (Helium, 0.15)]
+
+if __name__ == "__main__":
+    if not jit_available():
+        print("numba is not installed, only the numpy backend can be used")
+    else:
+        for System, alpha in systems:
+            benchmark(System, alpha, N_tries, N_walkers, N_repeat)
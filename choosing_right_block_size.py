@@ -1,5 +1,6 @@
 import numpy as np
-import
+import matplotlib.pyplot as plt
+from functools import partial
 
 from Functions.metropolis import *
 from Functions.errorcalc import *
@@ -10,26 +11,27 @@ import Systems.Helium as Helium
 
 
 """ This file is to help choose the right block size to calculate the error of a correlated time series.
-    It will plot the error as function of the block size, and if the error is rougly constant the data series
-    becomes uncorrelated.
+    It will plot the error as function of the block size for every level of the blocking transform, which doubles the
+    block size at every level. If the error is rougly constant the data series becomes uncorrelated, the block size of
+    this plateau is found automatically and marked in the plot.
 """
-def block_size_error_plot(System, N_tries, N_walkers, alpha, D, plots):
+def block_size_error_plot(System, N_tries, N_walkers, alpha, D, plots, N_processes = 1):
 
-    f = lambda R: System.trial_wave_function(alpha,  R)
-    rn, accept_rate = metropolis_algorithm(f, N_tries, N_walkers, D)
-    E = System.E_loc(alpha, rn)
+    f = partial(System.log_psi, [alpha])
+    E_loc = partial(System.local_energy, [alpha])
+    acc, accept_rate = metropolis_accumulate(f, E_loc, N_tries, N_walkers, D, keep_E_loc = True, N_processes = N_processes)
+    E = accumulated_E_loc_steps(acc)
     E_a = np.mean(E)
 
-    block_size = np.arange(200, 2000)
+    block_size, E_error, E_error_error, _ = blocking_levels(E)
+    error, error_error, block_size_plateau = automatic_blocking_error(E)
 
-    E_error = np.zeros(len(block_size))
-    var = np.zeros(len(block_size))
-
-    for i in range(len(block_size)):
-        E_error[i], var[i]  = data_blocking_error(E[:,0], block_size[i])
+    print(f"E = {E_a} +/- {error} ({error_error}) with block size {block_size_plateau}")
 
     if plots == True:
-        plt.plot(block_size, E_error)
+        plt.errorbar(block_size, E_error, E_error_error, fmt = "o-")
+        plt.axvline(block_size_plateau, color = "k", linestyle = "--")
+        plt.xscale("log", base = 2)
         plt.savefig("Plots/Error_blocksize.png")
         plt.show()
 
@@ -37,8 +39,10 @@ def block_size_error_plot(System, N_tries, N_walkers, alpha, D, plots):
 System = Helium
 N_tries = 30000
 N_walkers = 400
+N_processes = 1
 plots = True
 alpha = 0.14
 D = System.dimension
 
-block_size_error_plot(System, N_tries, N_walkers, alpha, D, plots)
+if __name__ == "__main__":
+    block_size_error_plot(System, N_tries, N_walkers, alpha, D, plots, N_processes)
@@ -1,49 +1,122 @@
 import numpy as np
 import time
+from functools import partial
 
 from Functions.metropolis import *
 from Functions.errorcalc import *
+from Functions.reweighting import *
 from Functions.plot_figures import *
 import Systems.HarmonicOscillator  as Oscillator
 import Systems.Hatom as Hydrogen
 import Systems.Helium as Helium
+import Systems.Helium2 as Helium2
 
 """ This file will preform a monte carlo integration to get the ground state energy of a given system.
-    It will do this for varying system parameter alpha. It will show the plot of the Energy and the variance for
+    It will do this for varying system parameters. It will show the plot of the Energy and the variance for
     alphas as given bij jos Thijsen. The Systems that can be simulated are:
 
                                                                         - Harmonic Oscillator
                                                                         - Hydrogen atom
                                                                         - Helium atom
+                                                                        - Helium atom with a variable nuclear exponent beta
     See below for simulation parameters.
 """
 
 start_time = time.time()
 
 
-def VMC(N_walkers, N_tries, System, plot_setting):
-    alpha = System.alpha_jos
+def VMC(N_walkers, N_tries, System, plot_setting, N_processes = 1, scan = "separate", particle_moves = False,
+        backend = "numpy", target_error = None, max_seconds = None, langevin = False, exact = True, zero_variance = False):
+    theta = System.theta_jos
+    alpha = theta[:, 0]
     D = System.dimension
 
     E_a = np.zeros(len(alpha))
     E_var = np.zeros(len(alpha))
     E_error = np.zeros(len(alpha))
+    tau = np.zeros(len(alpha))
+    ess = np.zeros(len(alpha))
+    seconds = np.zeros(len(alpha))
+    N_samples = np.zeros(len(alpha))
+    seconds_saved = np.zeros(len(alpha))
+    E_zv = np.zeros(len(alpha))
+    E_zv_error = np.zeros(len(alpha))
+    reduction = np.zeros(len(alpha))
 
-    for i in range(len(alpha)):
-        f = lambda R: System.trial_wave_function(alpha[i],  R)
+    # one chain at an anchor alpha is reweighted to the whole grid, more anchors are added when the weights degenerate
+    if scan == "reweight":
+        E_a, E_var, E_error, weight_ess, anchors = reweight_scan(System, theta, N_tries, N_walkers)
+        print(f"Anchors: {np.array(anchors).tolist()}")
+        print(f"Relative effective sample size: {weight_ess}")
 
-        rn, accept_rate = metropolis_algorithm(f, N_tries, N_walkers, D)
-        E = System.E_loc(alpha[i], rn)
-        E_a[i] = np.mean(E)
-        E_error[i], E_var[i] = data_blocking_error(E[:,0], block_size = 6000)
+    # the chains of all alphas are sampled together in one vectorized sweep
+    elif scan == "batched":
+        particle_function = System.log_psi_particle if particle_moves else None
+        drift_function = System.grad_log_psi if langevin else None
+        run_time = time.time()
+        accs, accept_rate = metropolis_scan(System.log_psi, System.local_energy, theta, N_tries, N_walkers, D,
+                                            particle_function = particle_function, drift_function = drift_function)
+
+        # the sweep is shared by all alphas, so every alpha gets an equal part of the time
+        seconds[:] = (time.time() - run_time)/len(alpha)
+        for i in range(len(alpha)):
+            E_a[i], E_var[i], E_error[i], _ = accumulator_results(accs[i])
+            tau[i], ess[i] = accumulator_autocorrelation(accs[i])
+            N_samples[i] = accs[i]["N"]
+
+        print(f"Acceptance rate : {accept_rate}")
+        print(f"Step : {[acc['step'] for acc in accs]}, burn in : {accs[0]['N_equil']}")
+
+    else:
+        for i in range(len(alpha)):
+            f = partial(System.log_psi, theta[i])
+            E = partial(System.local_energy, theta[i])
+            particle_function = partial(System.log_psi_particle, theta[i]) if particle_moves else None
+            drift_function = partial(System.grad_log_psi, theta[i]) if langevin else None
+
+            # the systems with an exact sampler do not need the metropolis algorithm
+            exact_sampler = exact and hasattr(System, "sample_psi2")
+            sample_function = partial(System.sample_psi2, theta[i]) if exact_sampler else None
+            deriv_E_loc = partial(System.deriv_local_energy, theta[i]) if zero_variance else None
+
+            run_time = time.time()
+            acc, accept_rate = metropolis_accumulate(f, E, N_tries, N_walkers, D, N_processes = N_processes,
+                                                     particle_function = particle_function, backend = backend,
+                                                     drift_function = drift_function, sample_function = sample_function,
+                                                     deriv_E_loc = deriv_E_loc, N_params = System.n_params,
+                                                     target_error = target_error, max_seconds = max_seconds)
+            seconds[i] = time.time() - run_time
+            E_a[i], E_var[i], E_error[i], _ = accumulator_results(acc)
+            tau[i], ess[i] = accumulator_autocorrelation(acc)
+            N_samples[i] = acc["N"]
+            seconds_saved[i] = acc["seconds_full"] - acc["seconds"]
+            if zero_variance:
+                E_zv[i], _, E_zv_error[i], reduction[i], _ = accumulator_zero_variance(acc)
+
+        print(f"Acceptance rate : {accept_rate}")
+        print(f"Step : {acc['step']}, burn in : {acc['N_equil']}")
+
+        if target_error is not None or max_seconds is not None:
+            print(f"Samples used : {N_samples}")
+            print(f"Time saved : {np.sum(seconds_saved)} s")
+
+        # the control variates give the same energy with a smaller error, the reduction is the factor of steps saved
+        if zero_variance:
+            print(f"Zero variance energy : {E_zv}")
+            print(f"Zero variance error : {E_zv_error}")
+            print(f"Variance reduction : {reduction}")
+
+    # the reweighted chains do not have an autocorrelation time of their own
+    if scan != "reweight":
+        print(f"Autocorrelation time : {tau}")
+        print(f"Effective sample size : {ess}")
+        print(f"Efficiency : {efficiency(E_var, tau, seconds, N_samples)}")
 
     print("E(alpha):")
     print(E_a)
     print()
     print("var(E)")
     print(E_var)
-    print()
-    print(f"Acceptance rate : {accept_rate}")
 
     if plots == True:
         plot_energy(alpha, E_a, E_error, plotsave)
@@ -51,16 +124,27 @@ def VMC(N_walkers, N_tries, System, plot_setting):
 
         
 # Simulation parameters
-System = Helium                 # please Choose: Oscillator, Hydrogen or Helium.
+System = Helium                 # please Choose: Oscillator, Hydrogen, Helium or Helium2.
 N_tries = 30000
 N_walkers = 400
+N_processes = 1                 # number of processes the walkers are divided over
+scan = "separate"               # "separate" chain per alpha, "reweight" a single chain or "batched" in one sweep
+particle_moves = False          # set to True to move the electrons of Helium one at a time
+langevin = False                # set to True for Langevin moves along the quantum force, not with particle_moves
+backend = "numpy"               # "numpy" or the compiled "numba" kernel for the separate chains
+target_error = None             # stop the separate chains when the error of the energy is below this, None to not stop
+max_seconds = None              # wall clock budget of every separate chain in seconds, None for no budget
+exact = True                    # draw independent samples of |ψT|² in the separate chains of Oscillator and Hydrogen
+zero_variance = False           # also report the energy with the dE_loc/dalpha control variates for the separate chains
 
 # plot settings
 plots = True
 plotsave = False
 plot_setting = [plots, plotsave]
 
-VMC(N_walkers, N_tries, System, plot_setting)
+if __name__ == "__main__":
+    VMC(N_walkers, N_tries, System, plot_setting, N_processes, scan, particle_moves, backend, target_error,
+        max_seconds, langevin, exact, zero_variance)
 
-elapsed_time = time.time() - start_time
-print(f"time taken for simulation :{elapsed_time}")
+    elapsed_time = time.time() - start_time
+    print(f"time taken for simulation :{elapsed_time}")
@@ -8,7 +8,8 @@ import Systems.Hatom as Hydrogen
 import Systems.Helium as Helium
 
 
-def optimal_energy_finder(alpha_guess, N_walkers, N_tries, System, plot_setting):
+def optimal_energy_finder(alpha_guess, N_walkers, N_tries, System, plot_setting, N_processes = 1, particle_moves = False,
+                          method = "gradient", checkpoint_file = None, langevin = False):
     """ For a given system finds the optimal ground state energy.
 
     Parameters
@@ -21,16 +22,26 @@ def optimal_energy_finder(alpha_guess, N_walkers, N_tries, System, plot_setting)
 
                                     plots:      set to True if want to show the plot
                                     plotsave:   set to True if want to save the plot
+    N_processes:            Number of processes the walkers are divided over
+    particle_moves:         set to True to move the electrons one at a time, only for Helium
+    method:                 optimizer of optimal_parameters_finder: "gradient", "sr", "linear" or "adam"
+    checkpoint_file:        name of the checkpoint to continue a stopped search from, None for no checkpoints
+    langevin:               set to True to drift the walkers along the quantum force
 
     """
 
-    alpha, iteration, E_loc , E_a = optimal_alpha_finder(alpha_guess, N_tries, N_walkers, System)
+    theta, iteration, history = optimal_parameters_finder([alpha_guess], N_tries, N_walkers, System, method,
+                                                          N_processes = N_processes, particle_moves = particle_moves,
+                                                          checkpoint_file = checkpoint_file, langevin = langevin)
+    alpha = theta[:, 0]
 
-    E_var = np.zeros(len(alpha))
-    E_error = np.zeros(len(alpha))
-
-    for i in range(len(alpha)):
-       E_error[i], E_var[i] = data_blocking_error(E_loc[i,:,0], block_size = 6000)
+    # only the summary of every iteration is kept by the optimizer
+    E_a = history["E"]
+    E_var = history["E_var"]
+    E_error = history["E_error"]
+    tau = history["tau"]
+    ess = history["ess"]
+    eff = efficiency(E_var, tau, history["seconds"], history["samples"])
 
 
     alpha_min = alpha[-1]
@@ -44,6 +55,8 @@ def optimal_energy_finder(alpha_guess, N_walkers, N_tries, System, plot_setting)
     print("The energy was found to be optimal with \N{greek small letter alpha} = {}".format(alpha_min))
     print("The corresponding Energy is E = {} +/- {}".format(E_min, E_error[-1]))
     print("With variance var = {} ".format(E_var[-1]))
+    print("Autocorrelation time tau = {}, effective sample size = {}, efficiency = {}".format(tau[-1], ess[-1], eff[-1]))
+    print("Samples used in {} iterations: {}".format(iteration, np.sum(history["samples"])))
 
     if System == Helium:
         print()
@@ -61,6 +74,11 @@ def optimal_energy_finder(alpha_guess, N_walkers, N_tries, System, plot_setting)
 System = Oscillator             # please choose: Oscillator, Hydrogen or Helium.
 N_tries = 30000
 N_walkers = 400
+N_processes = 1                 # number of processes the walkers are divided over
+particle_moves = False          # set to True to move the electrons of Helium one at a time
+method = "gradient"             # optimizer: "gradient", "sr", "linear" or "adam"
+langevin = False                # set to True for Langevin moves along the quantum force
+checkpoint_file = None          # name of the .npz checkpoint to continue a stopped search from, None for none
 alpha_guess = 1.2
 
 # plot settings
@@ -68,4 +86,6 @@ plots = True
 plotsave = False
 plot_setting = [plots, plotsave]
 
-optimal_energy_finder(alpha_guess, N_walkers, N_tries, System, plot_setting)
+if __name__ == "__main__":
+    optimal_energy_finder(alpha_guess, N_walkers, N_tries, System, plot_setting, N_processes, particle_moves, method, checkpoint_file,
+                          langevin)
@@ -3,10 +3,13 @@ import numpy as np
 from Functions.errorcalc import *
 from Functions.steepest_descent import *
 from Functions.plot_figures import *
+from Functions.diffusion import *
 import Systems.Helium2 as Helium2
 
 
-def optimal_energy_finder(alpha_guess, beta_guess, N_walkers, N_tries, System, plot_setting):
+def optimal_energy_finder(alpha_guess, beta_guess, N_walkers, N_tries, System, plot_setting, N_processes = 1,
+                          particle_moves = False, method = "gradient", checkpoint_file = None, langevin = False,
+                          learning_rate = None):
     """For a System with 2 parameters alpha and beta: Helium2. Finds the optimal ground state energy.
 
     Parameters
@@ -17,18 +20,29 @@ def optimal_energy_finder(alpha_guess, beta_guess, N_walkers, N_tries, System, p
     N_tries:                Number of steps for the walkers to try
     System:                 Current system. Only Helium2
     plots:                  True or False to plot the results
+    N_processes:            Number of processes the walkers are divided over
+    particle_moves:         set to True to move the electrons one at a time
+    method:                 optimizer of optimal_parameters_finder: "gradient", "sr", "linear" or "adam"
+    checkpoint_file:        name of the checkpoint to continue a stopped search from, None for no checkpoints
+    langevin:               set to True to drift the walkers along the quantum force
+    learning_rate:          size of the steps of the method, None for the default of optimal_parameters_finder
 
     """
 
-    alpha, beta, iteration, E_loc , E_a = optimal_alpha_beta_finder(alpha_guess, beta_guess, N_tries, N_walkers, System)
+    theta, iteration, history = optimal_parameters_finder([alpha_guess, beta_guess], N_tries, N_walkers, System, method,
+                                                          learning_rate, N_processes = N_processes,
+                                                          particle_moves = particle_moves, checkpoint_file = checkpoint_file,
+                                                          langevin = langevin)
+    alpha = theta[:, 0]
+    beta = theta[:, 1]
 
-    E_var = np.zeros(len(alpha))
-    E_error = np.zeros(len(alpha))
-    var_error = np.zeros(len(alpha))
-
-    # calculate the errors
-    for i in range(len(alpha)):
-       E_error[i], E_var[i] = data_blocking_error(E_loc[i,:,0], block_size = 6000)
+    # only the summary of every iteration is kept by the optimizer
+    E_a = history["E"]
+    E_var = history["E_var"]
+    E_error = history["E_error"]
+    tau = history["tau"]
+    ess = history["ess"]
+    eff = efficiency(E_var, tau, history["seconds"], history["samples"])
 
 
     alpha_min = alpha[-1]
@@ -39,18 +53,71 @@ def optimal_energy_finder(alpha_guess, beta_guess, N_walkers, N_tries, System, p
     print("The energy was found to be optimal with \N{greek small letter alpha} = {} and \N{greek small letter beta} = {} ".format(alpha_min, beta[-1]))
     print("The corresponding Energy is E = {} +/- {}".format(E_min, E_error[-1]))
     print("With variance var = {} ".format(E_var[-1]))
+    print("Autocorrelation time tau = {}, effective sample size = {}, efficiency = {}".format(tau[-1], ess[-1], eff[-1]))
+    print("Samples used in {} iterations: {}".format(iteration, np.sum(history["samples"])))
     print()
     print("Deviation from experimental value: {}%".format(round(percentage, 2)))
 
     if plots == True:
         subplot_energy_variance_alpha_beta(alpha, beta, E_a, E_var, E_error, iteration, plotsave)
 
+    return (theta[-1], history["r_final"])
+
+
+def diffusion_energy_finder(theta, r_final, N_walkers, N_steps, tau, System, N_processes = 1, seed = None):
+    """ Diffusion Monte Carlo after the optimization. The walkers of the last iteration of the optimizer are already
+        equilibrated for the optimal parameters, so they are the starting population, drawn with replacement if the
+        population is larger, and ψT the guiding function of the fixed node diffusion Monte Carlo, see
+        diffusion_monte_carlo.
+
+    Parameters
+    ----------
+    theta:                  numpy array of the optimal parameters
+    r_final:                numpy array (N, D) of the positions of the walkers of the last iteration of the optimizer
+    N_walkers:              Number of walkers of the population
+    N_steps:                Number of steps of the diffusion Monte Carlo
+    tau:                    time step of the diffusion Monte Carlo
+    System:                 Current system
+    N_processes:            Number of processes the walkers are divided over
+    seed:                   seed of the random number generators, None for a random seed
+
+    """
+
+    rng = np.random.default_rng(seed)
+    r_initial = r_final[rng.choice(len(r_final), N_walkers, replace = N_walkers > len(r_final))]
+
+    f = partial(System.log_psi, theta)
+    E = partial(System.local_energy, theta)
+    E_mixed, E_mixed_error, E_growth, E_growth_error, history = diffusion_monte_carlo(
+        f, partial(System.grad_log_psi, theta), E, r_initial, N_steps, tau, N_processes = N_processes, seed = seed,
+        local_function = partial(System.evaluate, theta))
+
+    E_exp = - 2.9037            # experimental value of ground state Helium
+    print()
+    print("Diffusion Monte Carlo with time step {}: mixed estimator E = {} +/- {}, growth estimator E = {} +/- {}".format(
+          tau, E_mixed, E_mixed_error, E_growth, E_growth_error))
+    print("Acceptance rate {}, autocorrelation time tau = {}, population {} to {}".format(
+          history["rate"], history["tau"], np.min(history["N_walkers"]), np.max(history["N_walkers"])))
+    print("Deviation from experimental value: {}%".format(round(np.abs(100*(E_mixed - E_exp)/E_exp), 2)))
+
 
 
 # System parameters
 System = Helium2        # only Helium2 for this file
 N_tries = 10000
 N_walkers = 50
+N_processes = 1         # number of processes the walkers are divided over
+particle_moves = False  # set to True to move the electrons one at a time
+method = "gradient"     # optimizer: "gradient", "sr", "linear" or "adam"
+learning_rate = 0.4     # learning rate of the gradient descent, None for the default of the method
+langevin = False        # set to True for Langevin moves along the quantum force
+checkpoint_file = None  # name of the .npz checkpoint to continue a stopped search from, None for none
+
+# diffusion Monte Carlo after the optimization
+diffusion = True
+N_walkers_dmc = 500     # drawn from the walkers of the last iteration of the optimizer
+N_steps_dmc = 4000
+tau_dmc = 0.01          # time step, the energy has an error of order tau
 
 # Guess the initial values of the parameters
 alpha_guess = 0.4
@@ -61,4 +128,8 @@ plots = True
 plotsave = False
 plot_setting = [plots, plotsave]
 
-optimal_energy_finder(alpha_guess, beta_guess, N_walkers, N_tries, System, plot_setting)
+if __name__ == "__main__":
+    theta, r_final = optimal_energy_finder(alpha_guess, beta_guess, N_walkers, N_tries, System, plot_setting, N_processes, particle_moves, method, checkpoint_file,
+                                  langevin, learning_rate)
+    if diffusion == True:
+        diffusion_energy_finder(theta, r_final, N_walkers_dmc, N_steps_dmc, tau_dmc, System, N_processes)
@@ -0,0 +1,59 @@
+import numpy as np
+import os
+import pytest
+from functools import partial
+
+from Functions.metropolis import *
+import Systems.Helium as Helium
+
+
+class Interrupted(Exception):
+    pass
+
+
+class LocalEnergy:
+    """ Local energy of Helium which stops the run with Interrupted after fail_after chunks, like a killed run. """
+
+    def __init__(self, fail_after = None):
+        self.fail_after = fail_after
+        self.calls = 0
+
+    def __call__(self, r):
+        self.calls += 1
+        if self.fail_after is not None and self.calls > self.fail_after:
+            raise Interrupted
+        return Helium.local_energy([0.2], r)
+
+
+def sample(E_loc, checkpoint_file = None, seed = 1, target_error = None):
+    return metropolis_accumulate(partial(Helium.log_psi, [0.2]), E_loc, 20000, 50, 6, chunk_size = 50, seed = seed,
+                                 N_equil = 500, target_error = target_error, checkpoint_file = checkpoint_file,
+                                 checkpoint_interval = 0)[0]
+
+
+@pytest.mark.parametrize("target_error", [None, 0.002])
+def test_resume(tmp_path, target_error):
+    """ A run which is stopped and continued from its checkpoint gives the same result to the last bit. """
+
+    checkpoint_file = str(tmp_path/"run.npz")
+    reference = sample(LocalEnergy(), target_error = target_error)
+
+    with pytest.raises(Interrupted):
+        sample(LocalEnergy(fail_after = 70), checkpoint_file, target_error = target_error)
+    assert os.path.exists(checkpoint_file)
+
+    acc = sample(LocalEnergy(), checkpoint_file, target_error = target_error)
+    assert not os.path.exists(checkpoint_file)
+    assert acc["N"] == reference["N"]
+    assert acc["E"] == reference["E"]
+
+
+def test_resume_other_run(tmp_path):
+    """ A checkpoint of another seed is not continued. """
+
+    checkpoint_file = str(tmp_path/"run.npz")
+    with pytest.raises(Interrupted):
+        sample(LocalEnergy(fail_after = 5), checkpoint_file)
+
+    with pytest.raises(ValueError):
+        sample(LocalEnergy(), checkpoint_file, seed = 2)
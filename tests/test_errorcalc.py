@@ -0,0 +1,14 @@
+import numpy as np
+
+from Functions.errorcalc import *
+
+
+def test_blocking_iid_walkers():
+    """ Uncorrelated walkers need no blocking, so the plateau is at the first level and the error is σ/sqrt(N). """
+
+    rng = np.random.default_rng(1)
+    data = rng.standard_normal((2500, 400))
+    error, _, block_size = automatic_blocking_error(data)
+
+    assert block_size == 1
+    assert abs(error*np.sqrt(data.size) - 1) < 0.05